@@ -3,10 +3,20 @@
 Calls on functions from other scripts
 and saves the incidence results in a xlsx file
 
+Runs one country, price scenario and decile target. Grids of countries, scenarios
+and decile targets are run in parallel (and resumed after interruptions) by
+batch_household_results.py
+
 """
+import shutil
 import subprocess
 
-import pandas as pd
+from data_cache import read_csv_cached
+from data_cache import read_excel_cached
+from data_cache import read_microdata
+from instrumentation import frame_info
+from instrumentation import stage
+from instrumentation import write_trace
 from tax_burden_scaled import save_results
 from transfers import save_results_public
 from transfers import save_results_target
@@ -20,38 +30,43 @@ country = "BGR"
 # 1. INPUT DATA
 # 1.1 MICRODATA
 
-HH_data = pd.read_excel(f"./base_data/HH_data_with_elas.xlsx")
+with stage("load", country=country) as event:
+    HH_data = read_microdata("./base_data")
+
+    # 1.2 LOAD MINDSET RESULTS
 
-# 1.2 LOAD MINDSET RESULTS
+    MS = read_excel_cached(f"./base_data/results_{country}.xlsx", sheet_name=None)
 
-MS = pd.read_excel(f"./base_data/results_{country}.xlsx", sheet_name=None)
+    # 1.2.4 PUBLIC INFRASTRUCTURE INVESTMENT -- If not applicable remove
 
-# 1.2.4 PUBLIC INFRASTRUCTURE INVESTMENT -- If not applicable remove
+    public_inv = read_csv_cached("./base_data/Public_inv.csv", skiprows=1)
 
-public_inv = pd.read_csv("./base_data/Public_inv.csv", skiprows=1)
+    countrynames = read_excel_cached("./base_data/GTAPtoGLORIA.xlsx", sheet_name="Regions")
 
-countrynames = pd.read_excel("./base_data/GTAPtoGLORIA.xlsx", sheet_name="Regions")
+    shares = read_excel_cached(
+        f"./base_data/Templates_tax_BTA_{country}_GLORIA.xlsx", sheet_name="govt_spending"
+    )
 
-shares = pd.read_excel(
-    f"./base_data/Templates_tax_BTA_{country}_GLORIA.xlsx", sheet_name="govt_spending"
-)
+    # 1.3 CONCORDANCE TABLE
 
-# 1.3 CONCORDANCE TABLE
+    concordance = read_excel_cached(f"./base_data/GLORIA_CPAT_concordance.xlsx")
 
-concordance = pd.read_excel(f"./base_data/GLORIA_CPAT_concordance.xlsx")
+    # 1.4 
 
-# 1.4 
+    pop_data = read_csv_cached(
+            "./base_data/population/API_SP.POP.TOTL_DS2_en_csv_v2_5454896.csv", skiprows=4)
 
-pop_data = pd.read_csv(
-        "./base_data/population/API_SP.POP.TOTL_DS2_en_csv_v2_5454896.csv", skiprows=4)
+    # 1.2.1 FINAL HOUSEHOLD DEMAND VECTOR -- Path/naming of variables has to be changed to location of MINDSET results
 
-# 1.2.1 FINAL HOUSEHOLD DEMAND VECTOR -- Path/naming of variables has to be changed to location of MINDSET results
+    MS_final_demand = MS["output"]
 
-MS_final_demand = MS["output"]
+    MS_q = MS_final_demand.loc[
+        MS_final_demand["REG_imp"] == country, ["PROD_COMM", "q_hh_base", "REG_imp"]
+    ]
 
-MS_q = MS_final_demand.loc[
-    MS_final_demand["REG_imp"] == country, ["PROD_COMM", "q_hh_base", "REG_imp"]
-]
+    event["frames"].update(
+        HH_data=frame_info(HH_data), MS=frame_info(MS), concordance=frame_info(concordance)
+    )
 
 # 1.2.2 PRICE CHANGE VECTOR -- might have to be  - Path/naming of variables has to be changed to location of MINDSET results
 
@@ -64,6 +79,7 @@ Has to be updated with updated input price vector
 1: delta_p_base : Total price changes prior to any changes in technical coefficient for each sector TRAD_COMM in REG_exp
 2: delta_p_0 : Total price changes after technological effect for each sector TRAD_COMM in REG_exp
 3: delta_p_1: Total price changes after technological and trade effect for each sector TRAD_COMM
+4: all three price vectors are evaluated in one run: results contain a column "scenario"
 """
 scen = 3
 
@@ -75,6 +91,11 @@ elif scen == 2:
     MS_p = MS_prices.loc[MS_prices["REG_exp"] == country, ["TRAD_COMM", "delta_p0"]]
 elif scen == 3:
     MS_p = MS_prices.loc[MS_prices["REG_exp"] == country, ["TRAD_COMM", "delta_p1"]]
+elif scen == 4:
+    MS_p = MS_prices.loc[
+        MS_prices["REG_exp"] == country,
+        ["TRAD_COMM", "delta_p_base", "delta_p0", "delta_p1"],
+    ]
 
 # 1.2.3 REVENUE recycled into government spending and into direct transfers
 
@@ -103,22 +124,30 @@ save_results functions at the bottom of tax_burden_scaled.py and transfers.py
 
 """
 
-# 2.1 SAVE ABSOLUTE AND RELATIVE TAX BURDEN + PRICE CHANGES PER CONS. CATEGORY
-save_results(country = country, HH_data = HH_data, MS_q = MS_q, MS_p = MS_p, concordance = concordance , pop_data = pop_data)
+with stage("save", country=country):
+    # 2.1 SAVE ABSOLUTE AND RELATIVE TAX BURDEN + PRICE CHANGES PER CONS. CATEGORY
+    save_results(country = country, HH_data = HH_data, MS_q = MS_q, MS_p = MS_p, concordance = concordance , pop_data = pop_data)
+
+    # 2.2 SAVE TAX BURDEN WITH REVENUE RECYCLING
 
-# 2.2 SAVE TAX BURDEN WITH REVENUE RECYCLING
+    save_results_target(
+        country = country, HH_data = HH_data, MS_q = MS_q, MS_p = MS_p, MS_rev_inc = MS_rev_inc, concordance = concordance, pop_data = pop_data ,decile_target = decile_target
+    )
 
-save_results_target(
-    country = country, HH_data = HH_data, MS_q = MS_q, MS_p = MS_p, MS_rev_inc = MS_rev_inc, concordance = concordance, pop_data = pop_data ,decile_target = decile_target
-)
+    # 2.3 SAVE TRANSFER PROXIES FOR INFRASTRUCTURE DISTRIBUTIONAL ANALYSIS
 
-# 2.3 SAVE TRANSFER PROXIES FOR INFRASTRUCTURE DISTRIBUTIONAL ANALYSIS
+    # if the share_rev_govt is not zero call the function
+    if not public_inv.empty:
+        save_results_public(country = country, HH_data = HH_data, MS_rev_govt = MS_rev_govt, shares = shares, countrynames = countrynames, public_inv = public_inv , pop_data = pop_data)
 
-# if the share_rev_govt is not zero call the function
-if not public_inv.empty:
-    save_results_public(country = country, HH_data = HH_data, MS_rev_govt = MS_rev_govt, shares = shares, countrynames = countrynames, public_inv = public_inv , pop_data = pop_data)
 
+# 2.4 Create Plots -- skipped if R is not installed
 
-# 2.4 Create Plots
+if shutil.which("Rscript") is not None:
+    with stage("plot"):
+        subprocess.run(["Rscript", "plots.R"])
+else:
+    print("Rscript not found: plots skipped")
 
-subprocess.run(["Rscript", "plots.R"])
+# 3. OPTIONAL TRACE: written if HH_TRACE is set, e.g. $ HH_TRACE=trace.json python MASTER_household_results.py
+write_trace()
@@ -1,20 +1,90 @@
+import os
 import pandas as pd
 import numpy as np
+from data_cache import read_csv_cached
+from data_cache import read_excel_cached
+from data_cache import read_microdata
+from wdi_store import WDI_FILES
+from wdi_store import as_wdi_store
 
-# exchange rates
-er = pd.read_csv("./base_data/exchange_rates/API_PA.NUS.FCRF_DS2_en_csv_v2_5457514.csv", skiprows = 4)
-# population
-pop_wb = pd.read_csv("./base_data/population/API_SP.POP.TOTL_DS2_en_csv_v2_5454896.csv", skiprows= 4)
-# gdp deflator
-gdp_defl = pd.read_csv("./base_data/gdp_deflator/API_NY.GDP.DEFL.ZS_DS2_en_csv_v2_5455800.csv" , skiprows =4)
-# gdp per capita
-MS_q = pd.read_excel(f"./base_data/results_BGR.xlsx", sheet_name="output" , usecols = ["PROD_COMM","q_hh_base","REG_imp"])
-
-HH_data = pd.read_excel("./base_data/HH_data_with_elas.xlsx")
 
+def load_check_inputs(base_path="./base_data"):
+    """
+    Loads the inputs of pcc_check()
 
+    Inputs:
+        - base_path (str): folder containing the input data
+    Returns:
+        - (dict): er, pop_wb, gdp_defl, MS_q and HH_data
+    """
+    return {
+        # exchange rates
+        "er": read_csv_cached(os.path.join(base_path, WDI_FILES["er"]), skiprows=4),
+        # population
+        "pop_wb": read_csv_cached(os.path.join(base_path, WDI_FILES["pop"]), skiprows=4),
+        # gdp deflator
+        "gdp_defl": read_csv_cached(os.path.join(base_path, WDI_FILES["gdp_defl"]), skiprows=4),
+        # gdp per capita
+        "MS_q": read_excel_cached(f"{base_path}/results_BGR.xlsx", sheet_name="output" , usecols = ["PROD_COMM","q_hh_base","REG_imp"]),
+        "HH_data": read_microdata(base_path),
+    }
+
+
+def pcc_table(er, pop_wb, gdp_defl, MS_q, HH_data, MS_year=2019):
+    """
+    Compares total per capita consumption from MINDSET (sum of q_hh_base divided by
+    population) with inflation adjusted per capita consumption from the household survey
+    for all countries at once
 
+    Inputs:
+        - er (df): exchange rates
+        - pop_wb (df): population
+        - gdp_defl (df): gdp deflator
+        - MS_q (df): MINDSET final household demand vector(s) with column "REG_imp"
+        - HH_data (df): Microdata with elasticities
+        - MS_year (int): OPTIONAL - base year of MINDSET (default: 2019)
 
+    Returns:
+        - (df): country, HH_Survey, MINDSET, Percent_Deviation for all countries of the
+                microdata with household demand in MS_q
+    """
+    # (indicator, country, year) store of all indicators
+    wdi = as_wdi_store({"er": er, "gdp_defl": gdp_defl, "pop": pop_wb})
+
+    # MINDSET household demand per country
+    MS_demand = MS_q.groupby("REG_imp")["q_hh_base"].sum()
+
+    # average HH per country: survey year and per capita consumption
+    survey = HH_data.groupby("iso3", sort=False)[["year", "cons_pc_acrent"]].mean()
+    survey = survey.loc[survey.index.isin(MS_demand.index)]
+    countries = survey.index
+    survey_year = survey["year"].astype(int).to_numpy()
+
+    # exchange rate in survey year: LCU per USD
+    er_sy = wdi.lookup("er", countries, survey_year)
+    # GDP deflator ratio b/w survey year and MINDSET year
+    gdp_ratio = wdi.lookup("gdp_defl", countries, MS_year) / wdi.lookup(
+        "gdp_defl", countries, survey_year
+    )
+
+    # average per capita consumption in MINDSET year USD
+    avg_pc_cons = survey["cons_pc_acrent"].to_numpy() / er_sy * gdp_ratio
+    q_hh_base_sum_pc = (
+        MS_demand.reindex(countries).to_numpy()
+        / wdi.lookup("pop", countries, MS_year)
+        * 1000
+    )
+
+    percentage_deviation = np.abs((q_hh_base_sum_pc - avg_pc_cons) / avg_pc_cons) * 100
+
+    return pd.DataFrame(
+        {
+            "country": countries.to_numpy(),
+            "HH_Survey": avg_pc_cons,
+            "MINDSET": q_hh_base_sum_pc,
+            "Percent_Deviation": ["{:.2f} %".format(perc) for perc in percentage_deviation],
+        }
+    )
 
 
 def pcc_check(er,pop_wb,gdp_defl,MS_q,HH_data):
@@ -36,71 +106,8 @@ def pcc_check(er,pop_wb,gdp_defl,MS_q,HH_data):
         - xlsx file with total per capita consumption from MINDSET and household survey
      
     """
+    pcc_table(er, pop_wb, gdp_defl, MS_q, HH_data).to_excel('Survey_MINDSET_check.xlsx')
 
-    
-    # All countries for which microdata is available
-    countries = HH_data["iso3"].unique().tolist()
-
-    # Create an empty DataFrame
-    datalist = []
-
-    # Iterate over the countries
-    for country in countries:
-        # Check if rows with HH_data iso3 exist for the current country
-        if (MS_q["REG_imp"] == country).any():
-            # Retrieve the HH_data for the current country
-            HH_data_country = HH_data.loc[(HH_data["iso3"] == country)]
-            # Check if any rows exist for the current country
-            # Get the average HH expenditures data: avg. HH
-            numeric_columns = HH_data_country.select_dtypes(include=[np.number]).columns
-            HH_data_avg = HH_data_country[numeric_columns].mean().to_frame().T
-            HH_data_avg.columns = numeric_columns
-            
-            # Get survey year
-            survey_year = int(HH_data_avg["year"].iloc[0])
-            
-            # Get average HH expenditures
-            avg_cons = HH_data_avg["cons_pc_acrent"].iloc[0]
-            
-            # Get exchange rate in the survey year: LCU per USD
-            er_country = er[er["Country Code"] == country]
-            # Excahnge rate in survey year
-            er_sy = er_country[str(survey_year)].values[0]
-            
-            # Get  GDP deflator
-            gdp_defl_country = gdp_defl[gdp_defl["Country Code"] == country]
-            
-            # GDP deflator for MINDSET year
-            gdp_defl_2019 = gdp_defl_country[str(2019)].values[0]
-            
-            # GDP deflator for survey year
-            gdp_defl_sy = gdp_defl_country[str(survey_year)].values[0]
-        
-            # GDP deflator ratio b/w survey year and MINDSET year
-            gdp_ratio = gdp_defl_2019 / gdp_defl_sy
-            
-            # Calculate the average per capita consumption in 2019 USD
-            avg_pc_cons_2019_dollar = avg_cons * (1/er_sy) * gdp_ratio
-        
-            # get population in 2019
-            pop_country = pop_wb[(pop_wb["Country Code"] == country)]
-            pop_2019 = (pop_country["2019"]).iloc[0]
-            ## subset REG_IMP == country
-            M_hhdemand = MS_q.loc[MS_q["REG_imp"] == country]
-            q_hh_base_sum_pc = M_hhdemand["q_hh_base"].sum()/pop_2019 * 1000
-
-            ## calc deviation
-
-            percentage_deviation = abs((q_hh_base_sum_pc - avg_pc_cons_2019_dollar) / avg_pc_cons_2019_dollar) * 100
-            perc = "{:.2f} %".format(percentage_deviation)
-        
-            dict = {'country': country, 'HH_Survey': avg_pc_cons_2019_dollar, 'MINDSET': q_hh_base_sum_pc , 'Percent_Deviation' : perc}
-            datalist.append(dict)
-        else:
-            # Skip to the next country if no rows with reg_imp exist
-            continue
-
-
-    pd.DataFrame(datalist).to_excel('Survey_MINDSET_check.xlsx')
-
-pcc_check(er,pop_wb,gdp_defl,MS_q,HH_data)
\ No newline at end of file
+
+if __name__ == "__main__":
+    pcc_check(**load_check_inputs())
@@ -1,7 +1,23 @@
 import numpy as np
 import pandas as pd
-
-
+from concordance_matrix import as_concordance_matrix
+from household_data import CONS_CATEGORIES
+from household_data import column_values
+from household_data import country_rows
+from household_data import HouseholdData
+from instrumentation import traced
+from memo import memoize
+from wdi_store import as_wdi_store
+
+# OPTIONAL column of the microdata with survey weights (population represented by a row).
+# Without it all rows of a country represent equal population shares (deciles, percentiles)
+WEIGHT_COLUMN = "weight"
+# OPTIONAL column of the microdata with the number of consumption quantiles labelled by
+# "quant_cons" (e.g. 100 for percentiles). Without it "quant_cons" are deciles
+QUANTILES_COLUMN = "n_quantiles"
+
+
+@traced
 def calculate_sectorshares(MS_q, concordance):
     """
     Calculate sector shares of final demand per CPAT category for a given country using MINDSET final
@@ -28,31 +44,79 @@ def calculate_sectorshares(MS_q, concordance):
             - 'sector_share': Share of final HH demand of GLORIA sectors within the CPAT category
     """
 
-    # Load concordance table : INPUT
-    cpat_glor = concordance
+    # Load concordance operator (built once per concordance table)
+    operator = as_concordance_matrix(concordance)
 
-    # merge exploded concordance table with MINDSET Household demand results
-    merged = pd.merge(
-        cpat_glor, MS_q, left_on="GLORIASector", right_on="PROD_COMM", how="inner"
-    )
-    # Calculate sector shares of final demand per CPAT category and convert into dataframe
+    # align MINDSET household demand with the GLORIA sectors of the concordance
+    q = operator.align(MS_q["PROD_COMM"], MS_q["q_hh_base"])
+    # sector shares of final demand per CPAT category: sparse (sectors x categories) matrix
+    shares = operator.sector_shares(q)
+    # keep sectors contained in MS_q (inner merge of concordance and demand vector)
+    in_demand = np.isin(operator.sectors[shares.row], MS_q["PROD_COMM"])
 
     sectorshares = pd.DataFrame(
-        merged.groupby(["CPAT Variable", "GLORIASector"])["q_hh_base"].sum()
-        / merged.groupby("CPAT Variable")["q_hh_base"].sum()
+        {
+            "CPAT Variable": operator.categories[shares.col[in_demand]],
+            "GLORIASector": operator.sectors[shares.row[in_demand]],
+            "sector_share": shares.data[in_demand],
+        }
     )
-    # reset index to get single index df
-    sectorshares.reset_index(inplace=True)
-    sectorshares.rename(columns={"q_hh_base": "sector_share"}, inplace=True)
+    sectorshares["CPAT Variable"] = sectorshares["CPAT Variable"].astype(object)
+    sectorshares.sort_values(["CPAT Variable", "GLORIASector"], inplace=True)
+    sectorshares.reset_index(drop=True, inplace=True)
 
     return sectorshares
 
 
+@traced
+@memoize
+def calc_price_changes_scenarios(MS_q, MS_p, concordance):
+    """
+    Calculate the price changes per CPAT consumption category for all price scenarios
+    contained in MS_p in one pass: demand weighted sector shares of the concordance operator
+    are multiplied with the (GLORIA sectors x scenarios) matrix of MINDSET price changes.
+
+    Inputs:
+
+        - MS_q(df): MINDSET final demand vector (120 rows x 2 columns)
+
+                need columns PROD_COMM and q_hh_base (if those are labelled differently change in code)
+
+        - Ms_p(df): MINDSET price vectors (120 rows x 1 + number of scenarios columns)
+
+                need column TRAD_COMM and one column per scenario starting with "delta_p"
+                (e.g. delta_p_base, delta_p0, delta_p1)
+
+        - concordance(df): concordance table between GLORIA and expenditure categories
+
+    Outputs:
+
+        delta_p_CPAT(df): price changes with CPAT consumption categories as index and one column per scenario
+    """
+    operator = as_concordance_matrix(concordance)
+
+    # define price column names : named differently in different scenarios
+    delta_p_columns = [col for col in MS_p.columns if col.startswith("delta_p")]
+    # align demand and (sectors x scenarios) price matrix with the concordance
+    q = operator.align(MS_q["PROD_COMM"], MS_q["q_hh_base"])
+    p = operator.align(MS_p["TRAD_COMM"], MS_p[delta_p_columns])
+    # demand weighted price changes per CPAT Variable for all scenarios
+    present = operator.present_categories(MS_q["PROD_COMM"])
+    delta_p_CPAT = pd.DataFrame(
+        operator.category_prices(q, p)[present],
+        index=pd.Index(operator.categories[present].tolist(), name="CPAT Variable"),
+        columns=delta_p_columns,
+    )
+
+    return delta_p_CPAT
+
+
+@traced
 def calc_price_changes(MS_q, MS_p, concordance):
     """
     Calculate the price changes per CPAT consumption category for a given country.
-    The function calls calculate_sectorshares() which returns a dataframe including mapped
-    CPAT cons. categories , GLORIA Sectors and their corresponding MINDSET price changes.
+    The function calls calc_price_changes_scenarios() which maps MINDSET price changes
+    to CPAT cons. categories using the sector shares of calculate_sectorshares().
 
     Inputs:
 
@@ -65,90 +129,90 @@ def calc_price_changes(MS_q, MS_p, concordance):
         - Ms_p(df): MINDSET price vector 120 rows x 2 columns
 
                 need columns TRAD_COMM and delta_p_base (change accordingly in code if labelled differently)
+                If several price columns are given (e.g. delta_p_base, delta_p0, delta_p1) all
+                scenarios are evaluated at once
 
         - concordance(df): concordance table between GLORIA and expenditure categories
 
     Outputs:
 
         delta_p_CPAT(dict): A dictionary containing the price changes as values and CPAT consumption categories as keys
+                            (with several price scenarios the values are arrays with one price change per scenario)
     """
-    # load sectorshares
-    sectorshares = calculate_sectorshares(MS_q, concordance)
-    # merge with MINDSET price changes
-    df_prices = pd.merge(
-        sectorshares, MS_p, left_on="GLORIASector", right_on="TRAD_COMM"
-    )
-    # drop duplicate sector col
-    df_prices.drop(columns="TRAD_COMM", inplace=True)
-    # group by CPAT Variable again to calculate price changes per CPAT consumption category
-    cpat_group = df_prices.groupby("CPAT Variable")
-
-    # define price column name : named differently in different scenarios
-    delta_p_column = [col for col in df_prices.columns if col.startswith("delta_p")][0]
-    # multiply sector shares (q_hh_base) by price changes and add them per CPAT Variable, reset index to get delta_p_CPAT as output variable
-    delta_p_CPAT = cpat_group.apply(
-        lambda x: (x["sector_share"] * x[delta_p_column]).sum()
-    ).reset_index(name="delta_p_CPAT")
+    delta_p_CPAT = calc_price_changes_scenarios(MS_q, MS_p, concordance)
+
     # Return
-    cpat_dict = dict(zip(delta_p_CPAT["CPAT Variable"], delta_p_CPAT["delta_p_CPAT"]))
+    if delta_p_CPAT.shape[1] == 1:
+        cpat_dict = delta_p_CPAT.iloc[:, 0].to_dict()
+    else:
+        cpat_dict = dict(zip(delta_p_CPAT.index, delta_p_CPAT.to_numpy()))
 
     return cpat_dict
 
 
-def petroleum_coke_frs_shares(country, HH_data):
+def average_budget_shares(HH_data, categories):
     """
-    Calculates expenditure shares for refined petroleum
-    and coke oven products within the respective GLORIA sectors: Multiple consumption
-    categories mapped to two GLORIA sectors so
-    final GLORIA demand has to be split up accordingly
+    Returns the average budget shares per country and consumption category, weighted with
+    the survey weights of the groups (mean over deciles): all countries in one pass
 
     Inputs:
-
-    - country : country of interest
-    - HH_data : household expenditure data containing budget shares
-
+        - HH_data (df or HouseholdData): Microdata containing budget shares "{g}_share"
+        - categories (list): consumption categories
     Outputs:
-
-    - shares_cp (dict): expenditure categories (keys) , shares (values)
+        - average (df): average budget shares in percent, countries (index) x categories
     """
-    HH_data_country = HH_data.loc[(HH_data["iso3"] == country)]
-    ## create column for average hh
-    HH_data_country = HH_data[HH_data["iso3"] == "BGR"]
+    shares = column_values(HH_data, [f"{g}_share" for g in categories], float)
+    weights = group_weights(HH_data)[:, None] * np.ones_like(shares)
+    # missing shares neither enter the sum nor the weights
+    weights[np.isnan(shares)] = 0
+    iso3 = column_values(HH_data, "iso3")
 
-    ## Add average row to split up
-    numeric_columns = HH_data_country.select_dtypes(include=[np.number])
+    weighted = pd.DataFrame(np.nan_to_num(shares) * weights, columns=categories)
+    total_weights = pd.DataFrame(weights, columns=categories)
 
-    # Calculate the average values for numeric columns
-    average_values = numeric_columns.mean()
+    return weighted.groupby(iso3).sum() / total_weights.groupby(iso3).sum()
 
-    # Create new avg row
-    average = pd.DataFrame(average_values).T
-    average["quant_cons"] = "avg"
 
-    # list of categories mapped to p_c
-    pc_list = ["die", "ethanol", "gso", "ker", "lpg"]
-    # calculate sum of shares for expenditure categories in g_list+
-    sharesum_pc = sum(average[f"{g}_share"].values[0] for g in pc_list)
-    # shares dictionary for coke and petroleum products
-    shares_pc = {g: average[f"{g}_share"].values[0] / sharesum_pc for g in pc_list}
-    # same for charcoal and firewood
-    frs_list = ["ccl", "fwd"]
-    sharesum_frs = sum(average[f"{g}_share"].values[0] for g in frs_list)
-    shares_frs = {g: average[f"{g}_share"].values[0] / sharesum_frs for g in frs_list}
+@memoize
+def concordance_weights(country, HH_data, concordance):
+    """
+    Returns the weighted concordance of a country: demand of GLORIA sectors mapped to
+    several consumption categories (e.g. refined petroleum and coke oven products, or
+    charcoal and firewood) is split in proportion to the country's average budget shares
+    of these categories (see ConcordanceMatrix.split_matrix())
 
-    shares_pc.update(shares_frs)
+    Inputs:
+        - country (str): 3-digit iso code
+        - HH_data (df or HouseholdData): Microdata containing budget shares
+        - concordance (df): concordance table between GLORIA and expenditure categories
+    Outputs:
+        - weights (scipy.sparse.csr_matrix): (GLORIA sectors x consumption categories) in
+                    the order of the concordance operator
+    """
+    operator = as_concordance_matrix(concordance)
+
+    average = average_budget_shares(country_rows(HH_data, country), operator.categories)
+    shares = (
+        average.loc[country].to_numpy()
+        if country in average.index
+        else np.zeros(len(operator.categories))
+    )
 
-    return shares_pc
+    return operator.split_matrix(shares)
 
 
+@traced
+@memoize
 def calc_tot_demand_g(country, HH_data, MS_q, concordance):
     """
     Returns the total household demand per consumption category G
     based on MINDSETS final household demand per GLORIA sector.
+    Demand of sectors mapped to several categories is split with the
+    country's budget shares (concordance_weights()).
 
     Inputs:
         - country (str): 3-digit iso code
-        - HH_data (df): Microdata
+        - HH_data (df or HouseholdData): Microdata
         - MS_q(df): MINDSET final demand vector (120 rows x 2 columns)
                     needs columns PROD_COMM and q_hh_base (if those are
                     labelled differently change in code)
@@ -159,28 +223,20 @@ def calc_tot_demand_g(country, HH_data, MS_q, concordance):
 
     """
 
-    cpat_glor = concordance
-
-    # merge exploded concordance table with MINDSET Household demand results
-    merged = pd.merge(
-        cpat_glor, MS_q, left_on="GLORIASector", right_on="PROD_COMM", how="inner"
-    )
-    # Calculate sector shares of final demand per CPAT category and convert into dataframe
-    total_hh_demand_G = merged.groupby("CPAT Variable")["q_hh_base"].sum().to_dict()
-
-    # multiply by 1000 and by expenditure shares within sector
-    # when refined petroleum or coke oven products
+    operator = as_concordance_matrix(concordance)
 
-    p_c_shares = petroleum_coke_frs_shares(country, HH_data)
+    # household demand per CPAT category: weighted concordance times demand vector,
+    # multiplied by 1000
+    q = operator.align(MS_q["PROD_COMM"], MS_q["q_hh_base"])
+    present = operator.present_categories(MS_q["PROD_COMM"])
+    weights = concordance_weights(country, HH_data, concordance)
 
-    result = {}
-
-    # for all sectors mapped to multiple cons categories:  multiply hh demand with share
-    for key in total_hh_demand_G:
-        if key in p_c_shares:
-            result[key] = total_hh_demand_G[key] * p_c_shares[key] * 1000
-        else:
-            result[key] = total_hh_demand_G[key] * 1000
+    result = dict(
+        zip(
+            operator.categories[present].tolist(),
+            (weights.T @ q)[present] * 1000,
+        )
+    )
 
     return result
 
@@ -192,90 +248,281 @@ def get_pop(country,pop_data):
 
     Inputs:
         - country (str) : 3-digit iso code
+        - pop_data (df or WDIStore) : WDI population table
     Outputs:
         - pop2019 (int) : population in 2019
     """
-    pop_wb = pop_data
-    # select country and year
-    pop_country = pop_wb[(pop_wb["Country Code"] == country)]
-    pop_2019 = (pop_country["2019"]).iloc[0].astype(int)
+    # select country and year: indexed lookup in the store built once per table
+    pop_2019 = as_wdi_store(pop_data).get("pop", country, 2019).astype(int)
 
     return pop_2019
 
 
+def group_weights(HH_df):
+    """
+    Returns the survey weights of the groups (rows) of the microdata: WEIGHT_COLUMN if
+    contained in HH_df, otherwise equal weights (deciles, percentiles)
+
+    Inputs:
+        - HH_df (df or HouseholdData): Microdata or results of one country
+    Outputs:
+        - weights (np.array): weight per row
+    """
+    if WEIGHT_COLUMN in HH_df.columns:
+        return column_values(HH_df, WEIGHT_COLUMN, dtype=float)
+    return np.ones(len(HH_df))
+
+
+def _n_quantiles(HH_df):
+    """
+    Returns the number of quantiles labelled by "quant_cons": QUANTILES_COLUMN if
+    contained in HH_df, otherwise 10 (deciles)
+    """
+    if QUANTILES_COLUMN in HH_df.columns:
+        return column_values(HH_df, QUANTILES_COLUMN, dtype=float)
+    return 10
+
+
+def population_shares(HH_df):
+    """
+    Returns the population share of the groups (rows) of the microdata: survey weights
+    relative to their sum (WEIGHT_COLUMN) or, without weights, one quantile of the
+    population per group (1/10 for deciles as in the original implementation, also if
+    deciles are missing in the survey)
+
+    Inputs:
+        - HH_df (df or HouseholdData): Microdata or results of one country
+    Outputs:
+        - shares (np.array): population share per row
+    """
+    if WEIGHT_COLUMN in HH_df.columns:
+        weights = column_values(HH_df, WEIGHT_COLUMN, dtype=float)
+        return weights / weights.sum()
+    return np.ones(len(HH_df)) / _n_quantiles(HH_df)
+
+
+def targeted_population_shares(HH_df, decile_targets):
+    """
+    Returns the groups targeted by transfers to the deciles up to and including the
+    decile target and the population share of the targeted deciles: sum of the population
+    shares of the targeted groups with survey weights, otherwise decile_target / 10 (as in
+    the original implementation, also if deciles are missing in the survey)
+
+    Inputs:
+        - HH_df (df or HouseholdData): Microdata or results of one country
+        - decile_targets (int or array): decile target(s)
+    Outputs:
+        - targeted (np.array): bool per row, (targets x rows) for several targets
+        - share (float or np.array): population share of the targeted deciles per target
+    """
+    targets = np.asarray(decile_targets)
+    targeted = group_deciles(HH_df) <= targets[..., None]
+    if WEIGHT_COLUMN in HH_df.columns:
+        return targeted, targeted @ population_shares(HH_df)
+    return targeted, targets / 10
+
+
+def revenue_shares(HH_df, decile_target):
+    """
+    Returns the share of the recycled revenue received by each group (row) when the
+    revenue is paid as equal per capita transfers to the deciles up to and including
+    decile_target (see targeted_population_shares())
+
+    Inputs:
+        - HH_df (df or HouseholdData): Microdata or results of one country
+        - decile_target (int): decile target
+    Outputs:
+        - shares (np.array): share of the revenue per row (0 for groups not targeted)
+    """
+    targeted, share = targeted_population_shares(HH_df, decile_target)
+    return np.where(targeted, population_shares(HH_df) / share, 0)
+
+
+def group_deciles(HH_df, n_quantiles=None):
+    """
+    Returns the expenditure decile of each group (row) of the microdata: "quant_cons" for
+    deciles and household records, the decile containing the quantile for finer quantiles
+    (e.g. quant_cons 1 to 100 for percentiles). Deciles missing in a country do not change
+    the deciles of the other groups.
+
+    Inputs:
+        - HH_df (df or HouseholdData): Microdata or results of one country
+        - n_quantiles (int): OPTIONAL - number of quantiles labelled by "quant_cons"
+                    (default: QUANTILES_COLUMN if contained in HH_df, otherwise 10)
+    Outputs:
+        - deciles (np.array): decile (1 to 10) per row
+    """
+    quant_cons = column_values(HH_df, "quant_cons", dtype=float)
+    if n_quantiles is None:
+        n_quantiles = _n_quantiles(HH_df)
+    return np.ceil(quant_cons * 10 / n_quantiles).astype(np.int8)
+
+
+def aggregate_deciles(results):
+    """
+    Aggregates results of finer groups (households with survey weights, percentiles) to
+    deciles: per capita values are population weighted means per decile, relative values
+    ("rel_" columns) are recomputed from the aggregated absolute values ("abs_" columns)
+    and per capita consumption "cons_pc_MS". Results of deciles are returned unchanged.
+
+    Inputs:
+        - results (df): per group results of tax_burden_MS(), targeted_transfer() or
+                    targeted_transfer_sweep()
+    Outputs:
+        - deciles (df): same columns (without WEIGHT_COLUMN and QUANTILES_COLUMN), one
+                    row per decile and price scenario / decile target and revenue
+    """
+    if WEIGHT_COLUMN not in results.columns and QUANTILES_COLUMN not in results.columns:
+        return results
+
+    weights = group_weights(results)
+    keys = [
+        col
+        for col in ("iso3", "scenario", "decile_target", "MS_rev_inc")
+        if col in results.columns
+    ]
+    columns = [
+        col for col in results.columns if col not in (WEIGHT_COLUMN, QUANTILES_COLUMN)
+    ]
+    values = [
+        col
+        for col in columns
+        if col not in keys + ["quant_cons"] and not col.startswith("rel_")
+    ]
+
+    # blocks (scenarios, targets, revenues) in order of appearance, deciles sorted
+    block = results.groupby(keys, sort=False, dropna=False).ngroup().rename("_block")
+    decile = pd.Series(group_deciles(results), index=results.index, name="quant_cons")
+
+    weighted = results[values].mul(weights, axis=0)
+    weighted[WEIGHT_COLUMN] = weights
+    sums = weighted.groupby([block, decile]).sum()
+
+    deciles = sums[values].div(sums[WEIGHT_COLUMN], axis=0)
+    deciles[keys] = results[keys].groupby([block, decile]).first()
+    deciles = deciles.reset_index()
+    for col in columns:
+        if col.startswith("rel_"):
+            deciles[col] = deciles[col.replace("rel_", "abs_", 1)] / deciles["cons_pc_MS"]
+
+    return deciles[columns]
+
+
+def expenditure_allocation(HH_df, cons_categories, population):
+    """
+    Survey part of calc_pc_exp_dg(), independent of MINDSET demand: per capita
+    expenditures of the groups, their shares of total expenditures per category and the
+    factor converting the demand of a group into per capita demand
+
+    Inputs:
+        - HH_df (df or HouseholdData): Microdata of one country
+        - cons_categories (list): consumption categories
+        - population (int): population of the country
+    Outputs:
+        - sums (np.array): (groups x categories) per capita expenditures from the survey
+        - sharetotal (np.array): (groups x categories) shares of total expenditures,
+                    weighted with the survey weights
+        - pc_factor (np.array): (groups) inverse of the population of each group
+                    (see population_shares())
+    """
+    # survey weights of the groups
+    weights = group_weights(HH_df)
+
+    # (groups x categories) matrices: one pass over all categories
+    shares = column_values(HH_df, [f"{cons}_share" for cons in cons_categories], float)
+    sums = shares / 100 * column_values(HH_df, "cons_pc_acrent", float)[:, None]
+    weighted_sums = weights[:, None] * sums
+    # nansum: a missing share only affects its group (same as the pandas sum)
+    sharetotal = weighted_sums / np.nansum(weighted_sums, axis=0)
+    pc_factor = 1 / (population_shares(HH_df) * population)
+
+    return sums, sharetotal, pc_factor
+
+
+@traced
+def pc_expenditures(country, HH_data, MS_q, concordance, pop_data, cons_categories):
+    """
+    Array version of calc_pc_exp_dg(): expenditures per group and category scaled to
+    MINDSET demand as (groups x categories) matrices, without building a DataFrame
+
+    Inputs:
+        - country (str): 3-digit iso code
+        - HH_data (df or HouseholdData): Microdata
+        - MS_q (df): MINDSET final household demand vector of country of interest
+        - concordance (df): concordance table between GLORIA and expenditure categories
+        - pop_data (df): population data
+        - cons_categories (list): consumption categories (columns of the matrices)
+    Outputs:
+        - (dict) of (groups x categories) np.arrays:
+            - "sums": per capita expenditures from the survey
+            - "sharetotal": group shares of total expenditures per category
+            - "total_d": total consumption per category and group (in 2019 US$)
+            - "pc": per capita expenditures per category and group (in 2019 US$)
+    """
+    # load dictionary with total demand by category g ( in 1000 US$ )
+    MS_total_demand = calc_tot_demand_g(country, HH_data, MS_q, concordance)
+    # 1. calculate group share of total expenditures per category (groups x categories)
+    sums, sharetotal, pc_factor = expenditure_allocation(
+        country_rows(HH_data, country), cons_categories, get_pop(country, pop_data)
+    )
+    # 2. ventilate total MINDSET demand per cons category g on groups depending on their total shares
+    total_d = sharetotal * np.array([MS_total_demand[cons] for cons in cons_categories])
+    # 3. divide by population of the group (tenth of 2019 population for deciles)
+    pc = total_d * pc_factor[:, None]
+
+    return {"sums": sums, "sharetotal": sharetotal, "total_d": total_d, "pc": pc}
+
+
+@traced
+@memoize
 def calc_pc_exp_dg(country, HH_data, MS_q, concordance , pop_data):
     """
-    Calculates per capita expenditures per decile and consumption category g
-    based on expenditure shares and shares of total expenditures
-    per decile from household survey data and final HH_demand per
+    Calculates per capita expenditures per group (decile, percentile or household record)
+    and consumption category g based on expenditure shares and shares of total expenditures
+    per group from household survey data and final HH_demand per
     cons. category G from MINDSET to have absolute tax burdens which
-    are consistent with MINDSET revenue results.
+    are consistent with MINDSET revenue results. Groups represent the population
+    share of their survey weight (WEIGHT_COLUMN, equal shares if not given).
 
     Inputs:
         - country (str): 3-digit iso code
-        - HH_data (df): Microdata
+        - HH_data (df or HouseholdData): Microdata
         - MS_q(df): MINDSET final household demand vector of country of interest:
                     Has to include columns "PROD_COMM" and "q_hh_base"
 
         - concordance : concordance table between GLORIA and expenditure categories
     Outputs:
 
-        - HH_cdf(df): HH survey dataframe with added decile shares of total consumption
-        for each category, total consumption per category/decile (in 2019 US$) and per capita expenditures
-        per decile/category (in 2019 US$).
+        - HH_cdf(df): HH survey dataframe with added group shares of total consumption
+        for each category, total consumption per category/group (in 2019 US$) and per capita expenditures
+        per group/category (in 2019 US$). For a HouseholdData only the columns iso3,
+        quant_cons (weight and n_quantiles) of the survey are returned with the added columns.
 
     """
 
     # subset country of interest
-    HH_df = HH_data.loc[(HH_data["iso3"] == country)].copy()
-    # list of consumption categories
-    cons_categories = [
-        "appliances",
-        "chemicals",
-        "clothing",
-        "communications",
-        "education",
-        "food",
-        "health_srv",
-        "housing",
-        "other",
-        "paper",
-        "pharma",
-        "rectourism",
-        "transp_eqt",
-        "transp_pub",
-        "ely",
-        "gso",
-        "die",
-        "ker",
-        "lpg",
-        "nga",
-        "ethanol",
-        "oil",
-        "coa",
-        "ccl",
-        "fwd",
-    ]
-    # load dictionary with total demand by category g ( in 1000 US$ )
-    MS_total_demand = calc_tot_demand_g(country, HH_data, MS_q, concordance)
-    # load 2019 population
-    pop2019 = get_pop(country,pop_data)
+    HH_df = country_rows(HH_data, country)
+    arrays = pc_expenditures(country, HH_data, MS_q, concordance, pop_data, CONS_CATEGORIES)
+
+    # added columns as one (groups x 4 * categories) float block, ordered by category
+    names = {"sums": "{}_sum", "sharetotal": "{}_sharetotal", "total_d": "total_{}_d", "pc": "{}_pc"}
+    values = np.stack([arrays[key] for key in names], axis=2).reshape(len(HH_df), -1)
+    added = pd.DataFrame(
+        values,
+        index=HH_df.index,
+        columns=[name.format(cons) for cons in CONS_CATEGORIES for name in names.values()],
+        copy=False,
+    )
 
-    for cons_category in cons_categories:
-        # 1. calculate decile share of total expenditures per category
-        HH_df[f"{cons_category}_sum"] = (
-            HH_df[f"{cons_category}_share"] / 100 * HH_df["cons_pc_acrent"]
-        )
-        HH_df[f"{cons_category}_sharetotal"] = (
-            HH_df[f"{cons_category}_sum"] / HH_df[f"{cons_category}_sum"].sum()
-        )
-        # 2. ventilate total MINDSET demand per cons category g on deciles depending on their total shares
-        HH_df[f"total_{cons_category}_d"] = HH_df[
-            f"{cons_category}_sharetotal"
-        ] * MS_total_demand.get(cons_category)
-        # 3. divide by tenth of 2019 population
-        HH_df[f"{cons_category}_pc"] = HH_df[f"total_{cons_category}_d"] * (
-            10 / pop2019
-        )
+    if isinstance(HH_df, HouseholdData):
+        keys = [
+            col
+            for col in ("iso3", "quant_cons", WEIGHT_COLUMN, QUANTILES_COLUMN)
+            if col in HH_df.columns
+        ]
+        HH_df = pd.DataFrame({col: HH_df[col] for col in keys}, index=HH_df.index)
+
+    # add all columns at once
+    HH_df = pd.concat([HH_df, added], axis=1)
 
     return HH_df
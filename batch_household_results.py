@@ -0,0 +1,569 @@
+"""
+Batch driver for the household module: runs the per-country pipeline of
+MASTER_household_results.py (save_results, save_results_target, save_results_public)
+for every country in the microdata that is also contained in the MINDSET results.
+
+Countries are spread over a process pool. Inputs shared by all countries (microdata,
+concordance, population, countrynames, public investment) are loaded by the parent
+process before the pool is started, which fills the cache, and once per worker from the
+cache. The MINDSET results of the countries are parsed by the workers.
+Failures of single countries are collected and reported at the end of the batch.
+
+run_grid() runs a grid of countries x price scenarios x decile targets of the transfers.
+Every cell is saved in its own folder and recorded in a manifest (one JSON line per
+cell) as soon as it is finished. The incidence does not depend on the decile target and
+is saved once per country and price scenario. A run that is interrupted resumes with the
+missing cells when it is started again; cells whose input files (MINDSET results,
+microdata, concordance, WDI tables, ...) changed are recomputed.
+
+Run from the root of the repository:
+
+    $ python batch_household_results.py --workers 4 --scen 3 --decile_target 5
+    $ python batch_household_results.py --workers 4 --scen 1 2 3 --decile_target 3 5 10 --output_dir grid
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import time
+import traceback
+from concurrent.futures import as_completed
+from concurrent.futures import ProcessPoolExecutor
+
+from data_cache import file_hash
+from data_cache import read_csv_cached
+from data_cache import read_excel_cached
+from data_cache import read_microdata
+from tax_burden_scaled import save_results
+from transfers import save_results_public
+from transfers import save_results_target
+from wdi_store import WDI_FILES
+
+# MINDSET price vector per price scenario (see MASTER_household_results.py)
+SCENARIOS = {1: "delta_p_base", 2: "delta_p0", 3: "delta_p1"}
+
+# inputs shared by all countries, filled once per worker process
+SHARED_INPUTS = {}
+
+# file of the finished cells of run_grid() in the output folder
+MANIFEST = "manifest.jsonl"
+
+
+def load_shared_inputs(base_path="./base_data"):
+    """
+    Loads the inputs which are the same for all countries
+
+    Inputs:
+        - base_path (str): folder containing the input data
+    Returns:
+        - (dict): HH_data, concordance, pop_data, countrynames and public_inv
+    """
+    return {
+        "HH_data": read_microdata(base_path),
+        "concordance": read_excel_cached(
+            os.path.join(base_path, "GLORIA_CPAT_concordance.xlsx")
+        ),
+        "pop_data": read_csv_cached(
+            os.path.join(base_path, WDI_FILES["pop"]), skiprows=4
+        ),
+        "countrynames": read_excel_cached(
+            os.path.join(base_path, "GTAPtoGLORIA.xlsx"), sheet_name="Regions"
+        ),
+        "public_inv": read_csv_cached(
+            os.path.join(base_path, "Public_inv.csv"), skiprows=1
+        ),
+    }
+
+
+def load_country_inputs(country, scen=3, base_path="./base_data"):
+    """
+    Loads the MINDSET results and the tax template of a country
+
+    Inputs:
+        - country (str): 3-digit iso code
+        - scen (int): price scenario, key of SCENARIOS
+        - base_path (str): folder containing the input data
+    Returns:
+        - (dict): MS_q, MS_p, MS_rev_inc, MS_rev_govt and shares
+    """
+    MS = read_excel_cached(
+        os.path.join(base_path, f"results_{country}.xlsx"), sheet_name=None
+    )
+
+    MS_final_demand = MS["output"]
+    MS_prices = MS["price"]
+    MS_revenue = MS["revenue"]
+
+    return {
+        "MS_q": MS_final_demand.loc[
+            MS_final_demand["REG_imp"] == country, ["PROD_COMM", "q_hh_base", "REG_imp"]
+        ],
+        "MS_p": MS_prices.loc[
+            MS_prices["REG_exp"] == country, ["TRAD_COMM", SCENARIOS[scen]]
+        ],
+        "MS_rev_inc": MS_revenue["recyc_inc"].loc[1],
+        "MS_rev_govt": MS_revenue["recyc_govt"].loc[1],
+        "shares": read_excel_cached(
+            os.path.join(base_path, f"Templates_tax_BTA_{country}_GLORIA.xlsx"),
+            sheet_name="govt_spending",
+        ),
+    }
+
+
+def _has_household_demand(country, base_path):
+    """
+    Returns whether results_{country}.xlsx contains household demand for the country
+    """
+    # same cache entry as in load_country_inputs
+    MS = read_excel_cached(
+        os.path.join(base_path, f"results_{country}.xlsx"), sheet_name=None
+    )
+    return bool((MS["output"]["REG_imp"] == country).any())
+
+
+def get_batch_countries(HH_data, base_path="./base_data", pool=None):
+    """
+    Returns all countries of the microdata for which MINDSET results exist,
+    i.e. results_{country}.xlsx is available and contains household demand
+    for the country
+
+    Inputs:
+        - HH_data (df): Microdata
+        - base_path (str): folder containing the input data
+        - pool (Executor): OPTIONAL - pool parsing the results workbooks in parallel
+                    (default: parsed one after the other)
+    Returns:
+        - countries (list): 3-digit iso codes
+    """
+    candidates = [
+        country
+        for country in HH_data["iso3"].unique().tolist()
+        if os.path.exists(os.path.join(base_path, f"results_{country}.xlsx"))
+    ]
+    mapper = map if pool is None else pool.map
+    has_demand = mapper(
+        _has_household_demand, candidates, itertools.repeat(base_path, len(candidates))
+    )
+
+    return [country for country, demand in zip(candidates, has_demand) if demand]
+
+
+def _init_worker(base_path):
+    """
+    Initializer of the worker processes: loads the shared inputs once per worker from the
+    cache filled by the parent process. Errors are not raised here, where they would
+    break the pool, but by run_country(), which loads the inputs again
+    """
+    try:
+        SHARED_INPUTS.update(load_shared_inputs(base_path))
+    except Exception:
+        pass
+
+
+def _warm_country_inputs(country, scen, base_path):
+    """
+    Parses the inputs of a country into the cache; errors are reported by run_country()
+    """
+    try:
+        load_country_inputs(country, scen, base_path)
+    except Exception:
+        pass
+
+
+def run_country(
+    country,
+    scen=3,
+    decile_target=5,
+    base_path="./base_data",
+    folder_path=None,
+    steps=("incidence", "targeted", "public"),
+):
+    """
+    Runs the household pipeline of MASTER_household_results.py for one country
+    and saves the results in the folder {country}_household_results
+
+    Inputs:
+        - country (str): 3-digit iso code
+        - scen (int): price scenario, key of SCENARIOS
+        - decile_target (int): deciles up to and including which the transfers are paid
+        - base_path (str): folder containing the input data
+        - folder_path (str): OPTIONAL - output folder (default: {country}_household_results
+                    in the current working directory)
+        - steps (tuple): OPTIONAL - parts of the pipeline to run: "incidence"
+                    (save_results), "targeted" (save_results_target) and "public"
+                    (save_results_public)
+    """
+    if not SHARED_INPUTS:
+        SHARED_INPUTS.update(load_shared_inputs(base_path))
+
+    shared = SHARED_INPUTS
+    inputs = load_country_inputs(country, scen, base_path)
+
+    if "incidence" in steps:
+        save_results(
+            country=country,
+            HH_data=shared["HH_data"],
+            MS_q=inputs["MS_q"],
+            MS_p=inputs["MS_p"],
+            concordance=shared["concordance"],
+            pop_data=shared["pop_data"],
+            folder_path=folder_path,
+        )
+
+    if "targeted" in steps:
+        save_results_target(
+            country=country,
+            HH_data=shared["HH_data"],
+            MS_q=inputs["MS_q"],
+            MS_p=inputs["MS_p"],
+            MS_rev_inc=inputs["MS_rev_inc"],
+            concordance=shared["concordance"],
+            pop_data=shared["pop_data"],
+            decile_target=decile_target,
+            folder_path=folder_path,
+        )
+
+    if "public" in steps and not shared["public_inv"].empty:
+        save_results_public(
+            country=country,
+            HH_data=shared["HH_data"],
+            MS_rev_govt=inputs["MS_rev_govt"],
+            shares=inputs["shares"],
+            countrynames=shared["countrynames"],
+            public_inv=shared["public_inv"],
+            pop_data=shared["pop_data"],
+            folder_path=folder_path,
+        )
+
+
+def _run_country_safe(
+    country,
+    scen,
+    decile_target,
+    base_path,
+    folder_path=None,
+    steps=("incidence", "targeted", "public"),
+):
+    """
+    Runs run_country() and returns wall time and traceback instead of raising
+    """
+    start = time.perf_counter()
+    try:
+        run_country(country, scen, decile_target, base_path, folder_path, steps)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+
+    return country, time.perf_counter() - start, error
+
+
+def run_batch(
+    countries=None, scen=3, decile_target=5, max_workers=None, base_path="./base_data"
+):
+    """
+    Runs the household pipeline for several countries in a process pool and prints
+    a summary of the wall time per country
+
+    Inputs:
+        - countries (list): OPTIONAL - 3-digit iso codes (default: get_batch_countries())
+        - scen (int): price scenario, key of SCENARIOS
+        - decile_target (int): deciles up to and including which the transfers are paid
+        - max_workers (int): OPTIONAL - number of worker processes (default: number of CPUs)
+        - base_path (str): folder containing the input data
+    Returns:
+        - timings (dict): wall time in seconds per country
+        - failures (dict): traceback per failed country
+    """
+    start = time.perf_counter()
+
+    # load the shared inputs before the pool: errors are raised here and the workers
+    # read the inputs from the cache
+    shared = load_shared_inputs(base_path)
+
+    timings = {}
+    failures = {}
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=_init_worker, initargs=(base_path,)
+    ) as pool:
+        if countries is None:
+            countries = get_batch_countries(shared["HH_data"], base_path, pool)
+        futures = [
+            pool.submit(_run_country_safe, country, scen, decile_target, base_path)
+            for country in countries
+        ]
+        for future in as_completed(futures):
+            country, seconds, error = future.result()
+            timings[country] = seconds
+            if error is not None:
+                failures[country] = error
+
+    # summary
+    print(f"{'country':<10}{'status':<10}{'seconds':>10}")
+    for country in countries:
+        status = "failed" if country in failures else "ok"
+        print(f"{country:<10}{status:<10}{timings[country]:>10.2f}")
+    print(
+        f"{len(countries) - len(failures)}/{len(countries)} countries succeeded "
+        f"in {time.perf_counter() - start:.2f} s"
+    )
+    for country, error in failures.items():
+        print(f"\n{country} failed:\n{error}")
+
+    return timings, failures
+
+
+def cell_folder(output_dir, country, scen, decile_target):
+    """
+    Returns the output folder of a cell of the grid:
+    {output_dir}/{country}_household_results/scen{scen}_target{decile_target}, or
+    {output_dir}/{country}_household_results/scen{scen} for the incidence of a price
+    scenario (decile_target None)
+    """
+    name = f"scen{scen}" if decile_target is None else f"scen{scen}_target{decile_target}"
+    return os.path.join(output_dir, f"{country}_household_results", name)
+
+
+def input_files(base_path="./base_data", country=None):
+    """
+    Returns the input files shared by all countries (microdata, concordance, WDI tables,
+    country names, public investment) or, if country is given, the input files of the
+    country (MINDSET results and tax template)
+    """
+    if country is not None:
+        return [
+            os.path.join(base_path, f"results_{country}.xlsx"),
+            os.path.join(base_path, f"Templates_tax_BTA_{country}_GLORIA.xlsx"),
+        ]
+
+    microdata = os.path.join(base_path, "HH_data_with_elas.parquet")
+    if not os.path.exists(microdata):
+        microdata = os.path.join(base_path, "HH_data_with_elas.xlsx")
+    return [
+        microdata,
+        os.path.join(base_path, "GLORIA_CPAT_concordance.xlsx"),
+        *(os.path.join(base_path, path) for path in WDI_FILES.values()),
+        os.path.join(base_path, "GTAPtoGLORIA.xlsx"),
+        os.path.join(base_path, "Public_inv.csv"),
+    ]
+
+
+def input_hash(paths, prefix=""):
+    """
+    Returns the sha256 hash of several input files
+
+    Inputs:
+        - paths (list): input files, missing files are hashed by their name only
+        - prefix (str): OPTIONAL - hash of further inputs, e.g. of the shared files
+    Returns:
+        - (str): hex digest
+    """
+    sha = hashlib.sha256(prefix.encode())
+    for path in paths:
+        digest = file_hash(path) if os.path.exists(path) else None
+        sha.update(f"{os.path.basename(path)}:{digest}\n".encode())
+    return sha.hexdigest()
+
+
+def read_manifest(path):
+    """
+    Reads the manifest of a grid run
+
+    Inputs:
+        - path (str): manifest written by run_grid()
+    Returns:
+        - (dict): (country, scen, decile_target) -> last record of the cell. A line cut
+                    off by an interruption is ignored
+    """
+    records = {}
+    if not os.path.exists(path):
+        return records
+
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            records[(record["country"], record["scen"], record["decile_target"])] = record
+
+    return records
+
+
+def _append_manifest(path, record):
+    """
+    Appends one record to the manifest and flushes it to disk
+    """
+    line = (json.dumps(record) + "\n").encode()
+    with open(path, "ab+") as f:
+        # start a new line after a line cut off by an interruption
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                line = b"\n" + line
+        f.write(line)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def run_grid(
+    countries=None,
+    scenarios=(3,),
+    decile_targets=(5,),
+    max_workers=None,
+    base_path="./base_data",
+    output_dir=".",
+    force=False,
+):
+    """
+    Runs the household pipeline for every cell (country, price scenario, decile target)
+    of a grid in a process pool. The incidence is computed once per country and price
+    scenario, as cell (country, scen, None). Finished cells are appended to the manifest
+    {output_dir}/manifest.jsonl; cells which are recorded as finished with the same
+    input files (sha256 of the files of input_files()) are skipped, failed cells are
+    run again.
+
+    Inputs:
+        - countries (list): OPTIONAL - 3-digit iso codes (default: get_batch_countries())
+        - scenarios (list): price scenarios, keys of SCENARIOS
+        - decile_targets (list): deciles up to and including which the transfers are paid
+        - max_workers (int): OPTIONAL - number of worker processes (default: number of CPUs)
+        - base_path (str): folder containing the input data
+        - output_dir (str): folder of the results (see cell_folder()) and the manifest
+        - force (bool): OPTIONAL - recompute all cells, ignoring the manifest
+    Returns:
+        - timings (dict): wall time in seconds per computed cell (incidence cells
+                    with decile target None)
+        - failures (dict): traceback per failed cell
+    """
+    start = time.perf_counter()
+
+    # load the shared inputs before the pool: errors are raised here and the workers
+    # read the inputs from the cache
+    shared = load_shared_inputs(base_path)
+    shared_hash = input_hash(input_files(base_path))
+
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, MANIFEST)
+    finished = {} if force else read_manifest(manifest_path)
+
+    timings = {}
+    failures = {}
+
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=_init_worker, initargs=(base_path,)
+    ) as pool:
+        if countries is None:
+            countries = get_batch_countries(shared["HH_data"], base_path, pool)
+
+        inputs = {
+            country: input_hash(input_files(base_path, country), shared_hash)
+            for country in countries
+        }
+
+        # incidence once per country and price scenario, transfers per decile target
+        cells = list(itertools.product(countries, scenarios, [None, *decile_targets]))
+        pending = [
+            cell
+            for cell in cells
+            if not (
+                cell in finished
+                and finished[cell]["status"] == "ok"
+                and finished[cell]["inputs"] == inputs[cell[0]]
+            )
+        ]
+
+        # parse the inputs of every pending country once (in parallel) before its cells
+        # share the cache
+        pending_countries = sorted({cell[0] for cell in pending})
+        list(
+            pool.map(
+                _warm_country_inputs,
+                pending_countries,
+                itertools.repeat(scenarios[0], len(pending_countries)),
+                itertools.repeat(base_path, len(pending_countries)),
+            )
+        )
+
+        futures = {
+            pool.submit(
+                _run_country_safe,
+                *cell,
+                base_path,
+                cell_folder(output_dir, *cell),
+                ("incidence",) if cell[2] is None else ("targeted", "public"),
+            ): cell
+            for cell in pending
+        }
+        for future in as_completed(futures):
+            cell = futures[future]
+            _, seconds, error = future.result()
+            timings[cell] = seconds
+            if error is not None:
+                failures[cell] = error
+            _append_manifest(
+                manifest_path,
+                {
+                    "country": cell[0],
+                    "scen": cell[1],
+                    "decile_target": cell[2],
+                    "status": "failed" if error is not None else "ok",
+                    "seconds": seconds,
+                    "inputs": inputs[cell[0]],
+                    "finished": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                },
+            )
+
+    # summary
+    print(f"{'country':<10}{'scen':>6}{'target':>8}  {'status':<10}{'seconds':>10}")
+    for cell in pending:
+        status = "failed" if cell in failures else "ok"
+        target = "-" if cell[2] is None else cell[2]
+        print(f"{cell[0]:<10}{cell[1]:>6}{target:>8}  {status:<10}{timings[cell]:>10.2f}")
+    print(
+        f"{len(pending) - len(failures)}/{len(pending)} cells succeeded, "
+        f"{len(cells) - len(pending)} already finished, "
+        f"in {time.perf_counter() - start:.2f} s"
+    )
+    for cell, error in failures.items():
+        print(f"\n{cell} failed:\n{error}")
+
+    return timings, failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--countries", nargs="*", default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument(
+        "--scen", type=int, nargs="+", default=[3], choices=sorted(SCENARIOS)
+    )
+    parser.add_argument("--decile_target", type=int, nargs="+", default=[5])
+    parser.add_argument("--base_path", default="./base_data")
+    parser.add_argument(
+        "--output_dir",
+        default=None,
+        help="run the grid: one folder per cell and a manifest to resume interrupted runs",
+    )
+    parser.add_argument("--force", action="store_true", help="ignore the manifest")
+    args = parser.parse_args()
+
+    if args.output_dir is None and len(args.scen) == 1 and len(args.decile_target) == 1:
+        run_batch(
+            countries=args.countries,
+            scen=args.scen[0],
+            decile_target=args.decile_target[0],
+            max_workers=args.workers,
+            base_path=args.base_path,
+        )
+    else:
+        run_grid(
+            countries=args.countries,
+            scenarios=args.scen,
+            decile_targets=args.decile_target,
+            max_workers=args.workers,
+            base_path=args.base_path,
+            output_dir=args.output_dir or ".",
+            force=args.force,
+        )
@@ -0,0 +1,127 @@
+"""
+Benchmark of the startup cost of the household module: wall time of importing each
+module in a fresh interpreter.
+
+Imports run in an empty working directory, so a module which reads from base_data or
+writes output at import time fails instead of being timed. numpy, pandas and scipy are
+imported before the clock starts ("baseline" is their own import time), so the numbers
+are the cost of the modules themselves.
+
+Run from the root of the repository:
+
+    $ python benchmarks/import_time.py --repeat 5 --max_ms 500
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "auxiliary",
+    "concordance_matrix",
+    "data_cache",
+    "dataprep",
+    "household_data",
+    "instrumentation",
+    "memo",
+    "Survey_MINDSET_check",
+    "synthetic_data",
+    "tax_burden_scaled",
+    "trajectory",
+    "transfers",
+    "wdi_store",
+    "batch_household_results",
+    "elasticity_uncertainty",
+    "factor_export",
+    "incidence_service",
+    "Price_and_Income_Elas.sector_adj_factors",
+]
+
+# dependencies imported by all modules
+BASELINE = "import numpy, pandas, scipy.sparse"
+
+# times the import of {module} after the baseline imports and prints the time in ms
+TIMER = """
+import time
+start = time.perf_counter()
+{baseline}
+middle = time.perf_counter()
+import {module}
+print((middle - start) * 1000, (time.perf_counter() - middle) * 1000)
+"""
+
+
+def time_import(module, cwd):
+    """
+    Returns the wall time in ms of importing module in a fresh interpreter
+
+    Inputs:
+        - module (str): module name, e.g. "dataprep"
+        - cwd (str): working directory of the interpreter
+    Returns:
+        - baseline (float): import time of numpy, pandas and scipy in ms
+        - module (float): import time of the module in ms
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT, PYTHONDONTWRITEBYTECODE="1")
+    out = subprocess.run(
+        [sys.executable, "-c", TIMER.format(baseline=BASELINE, module=module)],
+        cwd=cwd,
+        env=env,
+        check=True,
+        capture_output=True,
+        text=True,
+    )
+    baseline, module_ms = map(float, out.stdout.split())
+    return baseline, module_ms
+
+
+def benchmark_imports(modules=MODULES, repeat=5):
+    """
+    Measures the median import time of each module on top of the baseline imports
+
+    Inputs:
+        - modules (list): module names
+        - repeat (int): number of fresh interpreters per module
+    Returns:
+        - (dict): {"baseline": ms, module: ms}
+    """
+    baselines = []
+    results = {}
+    with tempfile.TemporaryDirectory() as cwd:
+        for module in modules:
+            timings = [time_import(module, cwd) for _ in range(repeat)]
+            baselines += [baseline for baseline, _ in timings]
+            results[module] = statistics.median(ms for _, ms in timings)
+            # nothing may be written by the import
+            if os.listdir(cwd):
+                raise RuntimeError(f"import {module} wrote {os.listdir(cwd)}")
+
+    return {"baseline": statistics.median(baselines), **results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--max_ms", type=float, default=None, help="fail if a module takes longer"
+    )
+    args = parser.parse_args()
+
+    results = benchmark_imports(repeat=args.repeat)
+
+    print(f"{'module':<45}{'ms':>10}")
+    for module, ms in results.items():
+        print(f"{module:<45}{ms:>10.1f}")
+
+    if args.max_ms is not None:
+        slow = [
+            module
+            for module, ms in results.items()
+            if module != "baseline" and ms > args.max_ms
+        ]
+        if slow:
+            sys.exit(f"imports slower than {args.max_ms} ms: {', '.join(slow)}")
@@ -0,0 +1,314 @@
+"""
+Benchmark of the stages of the household pipeline on synthetic inputs.
+
+For every scale, synthetic inputs are written with synthetic_data.write_synthetic_data()
+and each stage is run for all countries of the scale: input loading (cold and warm
+cache), sector shares, price changes, per capita expenditures, tax burden, targeted
+transfers, public investment, the adjustment factors of Price_and_Income_Elas and the
+xlsx writers. The memoization cache is cleared before every run of a stage, so stages
+do not profit from each other.
+
+Wall time is the minimum over repeated runs, memory is the peak of allocations traced
+with tracemalloc in a separate run. Results are written as JSON and can be compared
+with a saved baseline: stages which got slower or need more memory than the tolerance
+are reported and the script exits with status 1.
+
+Run from the root of the repository:
+
+    $ python -m benchmarks.pipeline --scales small medium --output benchmarks/results.json
+    $ python -m benchmarks.pipeline --baseline benchmarks/results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import warnings
+
+import data_cache
+import numpy as np
+import pandas as pd
+from auxiliary import calc_pc_exp_dg
+from auxiliary import calc_price_changes
+from auxiliary import calculate_sectorshares
+from batch_household_results import load_country_inputs
+from batch_household_results import load_shared_inputs
+from memo import cache_clear
+from Price_and_Income_Elas.sector_adj_factors import HHdemand_adjustments_income_GLORIA
+from Price_and_Income_Elas.sector_adj_factors import HHdemand_adjustments_price_GLORIA
+from synthetic_data import write_synthetic_data
+from tax_burden_scaled import save_results
+from tax_burden_scaled import tax_burden_MS
+from transfers import public_investment
+from transfers import save_results_public
+from transfers import save_results_target
+from transfers import targeted_transfer
+
+# keyword arguments of write_synthetic_data() per scale
+SCALES = {
+    "small": {"n_countries": 3},
+    "medium": {"n_countries": 30},
+    "large": {"n_countries": 150},
+}
+
+# price scenario of the inputs (default of batch_household_results.py)
+SCENARIO = 3
+
+
+def load_inputs(countries, base_path):
+    """
+    Loads shared and per country inputs as in batch_household_results.py
+    """
+    shared = load_shared_inputs(base_path)
+    per_country = {
+        country: load_country_inputs(country, SCENARIO, base_path)
+        for country in countries
+    }
+    return shared, per_country
+
+
+def pipeline_stages(countries, base_path):
+    """
+    Returns the stages of the pipeline: functions without arguments which run the
+    stage for all countries
+
+    Inputs:
+        - countries (list): 3-digit iso codes
+        - base_path (str): folder containing the (synthetic) input data
+    Returns:
+        - (dict): stage name -> function
+    """
+    shared, per_country = load_inputs(countries, base_path)
+    HH_data = shared["HH_data"]
+    concordance = shared["concordance"]
+    pop_data = shared["pop_data"]
+
+    def for_all(stage):
+        return lambda: [stage(country, per_country[country]) for country in countries]
+
+    def load_cold():
+        data_cache.clear_cache()
+        load_inputs(countries, base_path)
+
+    return {
+        "load_inputs_cold": load_cold,
+        "load_inputs_warm": lambda: load_inputs(countries, base_path),
+        "calculate_sectorshares": for_all(
+            lambda country, inputs: calculate_sectorshares(inputs["MS_q"], concordance)
+        ),
+        "calc_price_changes": for_all(
+            lambda country, inputs: calc_price_changes(
+                inputs["MS_q"], inputs["MS_p"], concordance
+            )
+        ),
+        "calc_pc_exp_dg": for_all(
+            lambda country, inputs: calc_pc_exp_dg(
+                country, HH_data, inputs["MS_q"], concordance, pop_data
+            )
+        ),
+        "tax_burden_MS": for_all(
+            lambda country, inputs: tax_burden_MS(
+                country, HH_data, inputs["MS_q"], inputs["MS_p"], concordance, pop_data
+            )
+        ),
+        "targeted_transfer": for_all(
+            lambda country, inputs: targeted_transfer(
+                country,
+                HH_data,
+                inputs["MS_q"],
+                inputs["MS_p"],
+                inputs["MS_rev_inc"],
+                concordance,
+                pop_data,
+                5,
+            )
+        ),
+        "public_investment": for_all(
+            lambda country, inputs: public_investment(
+                country,
+                HH_data,
+                inputs["MS_rev_govt"],
+                inputs["shares"],
+                shared["countrynames"],
+                shared["public_inv"],
+                pop_data,
+            )
+        ),
+        "adjustment_factors_price": for_all(
+            lambda country, inputs: HHdemand_adjustments_price_GLORIA(
+                country, HH_data, inputs["MS_q"], inputs["MS_p"], concordance
+            )
+        ),
+        "adjustment_factors_income": for_all(
+            lambda country, inputs: HHdemand_adjustments_income_GLORIA(
+                country, HH_data, inputs["MS_q"], inputs["MS_rev_inc"], concordance
+            )
+        ),
+        "xlsx_writers": for_all(
+            lambda country, inputs: (
+                save_results(
+                    country, HH_data, inputs["MS_q"], inputs["MS_p"], concordance, pop_data
+                ),
+                save_results_target(
+                    country,
+                    HH_data,
+                    inputs["MS_q"],
+                    inputs["MS_p"],
+                    inputs["MS_rev_inc"],
+                    concordance,
+                    pop_data,
+                ),
+                save_results_public(
+                    country,
+                    HH_data,
+                    inputs["MS_rev_govt"],
+                    inputs["shares"],
+                    shared["countrynames"],
+                    shared["public_inv"],
+                    pop_data,
+                ),
+            )
+        ),
+    }
+
+
+def measure(stage, repeat=3):
+    """
+    Returns minimum wall time over repeat runs and peak traced memory of one run
+
+    Inputs:
+        - stage (callable): function without arguments
+        - repeat (int): number of timed runs
+    Returns:
+        - (dict): {"seconds": float, "peak_mb": float}
+    """
+    timings = []
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for _ in range(repeat):
+            cache_clear()
+            start = time.perf_counter()
+            stage()
+            timings.append(time.perf_counter() - start)
+
+        cache_clear()
+        tracemalloc.start()
+        try:
+            stage()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return {"seconds": min(timings), "peak_mb": peak / 2**20}
+
+
+def run_benchmarks(scales=("small",), repeat=3, workdir=None):
+    """
+    Runs all stages at the given scales on synthetic inputs
+
+    Inputs:
+        - scales (list): keys of SCALES
+        - repeat (int): number of timed runs per stage
+        - workdir (str): OPTIONAL - folder for the synthetic inputs and outputs
+                    (default: temporary folder)
+    Returns:
+        - (dict): {"meta": {...}, "results": {scale: {stage: {"seconds", "peak_mb"}}}}
+    """
+    results = {}
+    cwd = os.getcwd()
+    cache_dir = data_cache.CACHE_DIR
+
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        for scale in scales:
+            path = os.path.join(tmp, scale)
+            countries = write_synthetic_data(path, all_regions=False, **SCALES[scale])
+            # the xlsx writers write to the working directory
+            os.chdir(path)
+            data_cache.CACHE_DIR = os.path.join(path, "base_data", ".cache")
+            try:
+                stages = pipeline_stages(countries, "./base_data")
+                results[scale] = {
+                    name: measure(stage, repeat) for name, stage in stages.items()
+                }
+            finally:
+                os.chdir(cwd)
+                data_cache.CACHE_DIR = cache_dir
+
+    return {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pandas": pd.__version__,
+            "machine": platform.machine(),
+            "repeat": repeat,
+            "scales": {scale: SCALES[scale] for scale in scales},
+        },
+        "results": results,
+    }
+
+
+def compare(results, baseline, tolerance=0.25, min_seconds=0.01, min_mb=1.0):
+    """
+    Compares results with a baseline and returns the regressions: stages which take
+    longer or need more memory than (1 + tolerance) times the baseline. Differences
+    below min_seconds / min_mb are treated as noise.
+
+    Inputs:
+        - results (dict): output of run_benchmarks()
+        - baseline (dict): output of run_benchmarks() of an earlier run
+        - tolerance (float): OPTIONAL - relative tolerance (default: 0.25)
+        - min_seconds (float): OPTIONAL - absolute tolerance of the wall time
+        - min_mb (float): OPTIONAL - absolute tolerance of the peak memory
+    Returns:
+        - regressions (list): (scale, stage, measure, baseline, new) for every regression
+    """
+    regressions = []
+    for scale, stages in results["results"].items():
+        for stage, new in stages.items():
+            old = baseline["results"].get(scale, {}).get(stage)
+            if old is None:
+                continue
+            for key, minimum in (("seconds", min_seconds), ("peak_mb", min_mb)):
+                if new[key] > old[key] * (1 + tolerance) and new[key] - old[key] > minimum:
+                    regressions.append((scale, stage, key, old[key], new[key]))
+
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scales", nargs="*", default=["small"], choices=sorted(SCALES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", default=None, help="write results as JSON")
+    parser.add_argument("--baseline", default=None, help="JSON of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.scales, args.repeat)
+
+    print(f"{'scale':<10}{'stage':<30}{'seconds':>10}{'peak MB':>10}")
+    for scale, stages in results["results"].items():
+        for stage, values in stages.items():
+            print(
+                f"{scale:<10}{stage:<30}"
+                f"{values['seconds']:>10.3f}{values['peak_mb']:>10.1f}"
+            )
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for scale, stage, key, old, new in regressions:
+            print(f"regression {scale} {stage} {key}: {old:.3f} -> {new:.3f}")
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,206 @@
+"""
+Sparse concordance operator between GLORIA sectors and CPAT consumption categories.
+
+The concordance table (concordance_GLORIA_CPAT() or GLORIA_CPAT_concordance.xlsx) is
+converted once into a sparse (GLORIA sectors x consumption categories) mapping matrix.
+Sector shares, household demand per category and price changes per category are then
+single sparse matrix-vector products on numpy arrays instead of merges and groupbys.
+Demand of sectors mapped to several categories is split with weights per category
+(split_matrix()), e.g. the budget shares of a country.
+"""
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# maximum number of cached operators
+MAXSIZE = 32
+
+# operators built from concordance tables (LRU), keyed by the hash of the table
+_OPERATORS = OrderedDict()
+
+
+class ConcordanceMatrix:
+    """
+    Sparse mapping matrix between GLORIA sectors (rows) and consumption categories (columns)
+
+    Attributes:
+        - frame (df): concordance table with columns "CPAT Variable" and "GLORIASector"
+        - sectors (np.array): sorted GLORIA sector codes (rows of matrix)
+        - categories (np.array): sorted consumption categories (columns of matrix)
+        - matrix (scipy.sparse.csr_matrix): number of rows of the concordance table
+                    mapping sector s to category c (1 for a plain mapping)
+    """
+
+    def __init__(self, concordance):
+        self.frame = concordance[["CPAT Variable", "GLORIASector"]]
+        self.sectors = np.unique(self.frame["GLORIASector"].to_numpy())
+        self.categories = np.unique(self.frame["CPAT Variable"].to_numpy().astype(str))
+
+        rows = np.searchsorted(self.sectors, self.frame["GLORIASector"].to_numpy())
+        cols = np.searchsorted(
+            self.categories, self.frame["CPAT Variable"].to_numpy().astype(str)
+        )
+        # duplicate rows of the concordance table are summed (same as merging)
+        self.matrix = sparse.csr_matrix(
+            (np.ones(len(rows)), (rows, cols)),
+            shape=(len(self.sectors), len(self.categories)),
+        )
+
+    def sector_positions(self, sector_codes):
+        """
+        Returns positions of GLORIA sector codes in self.sectors and a mask
+        of the codes contained in the concordance
+
+        Inputs:
+            - sector_codes (array): GLORIA sector codes, e.g. MS_q["PROD_COMM"]
+        Returns:
+            - positions (np.array): row of each code in self.matrix
+            - found (np.array): boolean mask, False for codes not in the concordance
+        """
+        sector_codes = np.asarray(sector_codes)
+        positions = np.searchsorted(self.sectors, sector_codes)
+        positions = np.minimum(positions, len(self.sectors) - 1)
+        found = self.sectors[positions] == sector_codes
+        return positions, found
+
+    def align(self, sector_codes, values):
+        """
+        Aligns a sectoral vector (or sectors x n matrix) to the rows of the mapping matrix.
+        Sectors missing in sector_codes are set to 0, sectors not contained in the
+        concordance are dropped.
+
+        Inputs:
+            - sector_codes (array): GLORIA sector codes, e.g. MS_q["PROD_COMM"]
+            - values (array): values per sector code, e.g. MS_q["q_hh_base"]
+        Returns:
+            - aligned (np.array): values in order of self.sectors
+        """
+        values = np.asarray(values, dtype=float)
+        positions, found = self.sector_positions(sector_codes)
+        aligned = np.zeros((len(self.sectors),) + values.shape[1:])
+        np.add.at(aligned, positions[found], values[found])
+        return aligned
+
+    def present_categories(self, sector_codes):
+        """
+        Returns boolean mask of categories with at least one sector in sector_codes
+        """
+        positions, found = self.sector_positions(sector_codes)
+        present = np.zeros(len(self.sectors))
+        present[positions[found]] = 1
+        return (self.matrix.T @ present) > 0
+
+    def category_demand(self, q):
+        """
+        Returns total demand per consumption category: sum of demand of mapped sectors
+
+        Inputs:
+            - q (np.array): demand per sector aligned with self.sectors
+        Returns:
+            - (np.array): demand per category in order of self.categories
+        """
+        return self.matrix.T @ q
+
+    def split_matrix(self, category_shares):
+        """
+        Returns the weighted concordance: (sectors x categories) matrix splitting the demand
+        of each sector on its consumption categories. Rows of sectors mapped to one category
+        are kept, rows of sectors mapped to several categories are proportional to the
+        expenditure shares of these categories and add up to one (equal split if the
+        shares of all of them are 0 or missing).
+
+        Inputs:
+            - category_shares (np.array): expenditure shares per category in order of
+                            self.categories (e.g. average budget shares of a country)
+        Returns:
+            - (scipy.sparse.csr_matrix): (sectors x categories) weights
+        """
+        shares = np.nan_to_num(np.asarray(category_shares, dtype=float))
+        matrix = self.matrix.tocoo()
+        n_categories = np.diff(self.matrix.indptr)[matrix.row]
+        split = n_categories > 1
+
+        weights = np.where(split, shares[matrix.col], matrix.data)
+        row_sums = np.bincount(
+            matrix.row, np.where(split, weights, 0), minlength=len(self.sectors)
+        )[matrix.row]
+        weights = np.where(
+            split,
+            np.divide(weights, row_sums, out=1 / n_categories, where=row_sums > 0),
+            weights,
+        )
+
+        return sparse.csr_matrix(
+            (weights, (matrix.row, matrix.col)), shape=self.matrix.shape
+        )
+
+    def sector_shares(self, q):
+        """
+        Returns sparse matrix of sector shares of demand within each consumption category
+
+        Inputs:
+            - q (np.array): demand per sector aligned with self.sectors
+        Returns:
+            - (scipy.sparse.coo_matrix): (sectors x categories) shares, columns add up to one
+        """
+        with np.errstate(divide="ignore", invalid="ignore"):
+            inverse_demand = 1 / self.category_demand(q)
+        return (sparse.diags(q) @ self.matrix @ sparse.diags(inverse_demand)).tocoo()
+
+    def category_prices(self, q, p):
+        """
+        Returns price changes per consumption category: demand weighted average of the
+        price changes of the mapped sectors
+
+        Inputs:
+            - q (np.array): demand per sector aligned with self.sectors, (sectors) or
+                            (sectors x years) with one demand vector per column of p
+            - p (np.array): price changes per sector aligned with self.sectors,
+                            (sectors) or (sectors x scenarios)
+        Returns:
+            - (np.array): price changes per category, (categories) or (categories x scenarios)
+        """
+        p = np.asarray(p, dtype=float)
+        weighted = q[:, None] * p if p.ndim > q.ndim else q * p
+        numerator = self.matrix.T @ weighted
+        demand = self.category_demand(q)
+        if p.ndim > demand.ndim:
+            demand = demand[:, None]
+        return np.divide(
+            numerator,
+            demand,
+            out=np.zeros_like(numerator, dtype=float),
+            where=demand != 0,
+        )
+
+
+def as_concordance_matrix(concordance):
+    """
+    Returns the ConcordanceMatrix of a concordance table. Operators are built once per
+    concordance table and reused afterwards (the MAXSIZE most recently used ones).
+
+    Inputs:
+        - concordance (df or ConcordanceMatrix): concordance table between GLORIA and
+                        expenditure categories
+    Returns:
+        - (ConcordanceMatrix)
+    """
+    if isinstance(concordance, ConcordanceMatrix):
+        return concordance
+
+    # digest of the row hashes in order: a sum could be equal for different tables
+    hashes = pd.util.hash_pandas_object(
+        concordance[["CPAT Variable", "GLORIASector"]], index=False
+    )
+    key = hashlib.sha1(hashes.to_numpy().tobytes()).hexdigest()
+    if key in _OPERATORS:
+        _OPERATORS.move_to_end(key)
+    else:
+        _OPERATORS[key] = ConcordanceMatrix(concordance)
+        while len(_OPERATORS) > MAXSIZE:
+            _OPERATORS.popitem(last=False)
+
+    return _OPERATORS[key]
@@ -0,0 +1,241 @@
+"""
+Columnar on-disk cache for the input data in base_data.
+
+Every workbook/csv is parsed once with pandas and stored as a typed parquet copy
+(pickle if the frame cannot be represented in parquet). Later reads check the
+modification time of the source file (and its hash if the modification time changed)
+and serve the DataFrame from the cache, so a warm run never opens openpyxl.
+
+Cache files are written under a temporary name and renamed when complete, the JSON
+metadata of an entry last, so concurrent readers (e.g. the workers of
+batch_household_results.py) never see a partially written entry.
+
+The cache folder defaults to ./base_data/.cache and can be changed with the
+environment variable HH_CACHE_DIR.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import pandas as pd
+
+
+CACHE_DIR = os.environ.get("HH_CACHE_DIR", os.path.join(".", "base_data", ".cache"))
+
+# merged microdata written by dataprep.py, read by read_microdata()
+MICRODATA_PATH = os.path.join(".", "base_data", "HH_data_with_elas.parquet")
+
+
+def file_hash(path):
+    """
+    Returns the sha256 hash of a file, read in blocks of 1 MB
+
+    Inputs:
+        - path (str): path of the file
+    Returns:
+        - (str): hex digest of the file content
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def _write_atomic(path, write):
+    """
+    Calls write(temporary path) for a temporary file in the folder of path and renames
+    it to path when complete; the temporary file is removed if write fails
+    """
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(path) or ".", prefix=os.path.basename(path), suffix=".tmp"
+    )
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _write_json(meta, path):
+    """
+    Writes the metadata of a cache entry (atomically, see _write_atomic())
+    """
+
+    def write(tmp):
+        with open(tmp, "w") as f:
+            json.dump(meta, f)
+
+    _write_atomic(path, write)
+
+
+def _cache_stem(path, kind, kwargs, cache_dir):
+    """
+    Returns the path stem of the cache entry for a source file and its read options
+    """
+    key = json.dumps(
+        [os.path.abspath(path), kind, kwargs], sort_keys=True, default=str
+    ).encode()
+    name = os.path.splitext(os.path.basename(path))[0].replace(" ", "_")
+    return os.path.join(cache_dir, f"{name}_{hashlib.sha1(key).hexdigest()[:12]}")
+
+
+def _is_fresh(meta, path, stem):
+    """
+    Checks whether a cache entry still corresponds to the source file.
+    Modification time and size are checked first, the file is only hashed
+    if those changed (e.g. after a copy or checkout).
+    """
+    stat = os.stat(path)
+    if meta["mtime_ns"] == stat.st_mtime_ns and meta["size"] == stat.st_size:
+        return True
+    if meta["size"] != stat.st_size or meta["sha256"] != file_hash(path):
+        return False
+    # same content, new timestamp: update metadata to skip hashing next time
+    meta["mtime_ns"] = stat.st_mtime_ns
+    _write_json(meta, stem + ".json")
+    return True
+
+
+def _write_frame(df, file_stem):
+    """
+    Writes DataFrame as parquet (pickle as fallback for frames with mixed object
+    columns) and returns format and original column labels
+    """
+    columns = list(df.columns)
+    try:
+        out = df.copy(deep=False)
+        out.columns = [str(col) for col in columns]
+        _write_atomic(file_stem + ".parquet", out.to_parquet)
+        fmt = "parquet"
+    except (ImportError, ValueError, TypeError, NotImplementedError):
+        _write_atomic(file_stem + ".pkl", df.to_pickle)
+        fmt = "pickle"
+    # column labels are only stored when they are not all strings (e.g. years as int)
+    labels = None if all(isinstance(col, str) for col in columns) else columns
+    return {"format": fmt, "columns": labels}
+
+
+def _read_frame(file_stem, entry):
+    """
+    Reads a DataFrame written by _write_frame()
+    """
+    if entry["format"] == "parquet":
+        df = pd.read_parquet(file_stem + ".parquet")
+    else:
+        df = pd.read_pickle(file_stem + ".pkl")
+    if entry["columns"] is not None:
+        df.columns = entry["columns"]
+    return df
+
+
+def cached_read(reader, path, kind, cache_dir=None, **kwargs):
+    """
+    Reads a file through the cache: if a fresh cache entry exists it is returned,
+    otherwise the file is parsed with reader(path, **kwargs) and cached.
+
+    Inputs:
+        - reader (callable): pandas reader, e.g. pd.read_excel
+        - path (str): path of the source file
+        - kind (str): name of the reader, part of the cache key
+        - cache_dir (str): OPTIONAL - cache folder (default: CACHE_DIR)
+        - **kwargs: keyword arguments passed to the reader
+    Returns:
+        - (df or dict of df): same output as reader(path, **kwargs)
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    stem = _cache_stem(path, kind, kwargs, cache_dir)
+
+    if os.path.exists(stem + ".json"):
+        with open(stem + ".json") as f:
+            meta = json.load(f)
+        if _is_fresh(meta, path, stem):
+            frames = {
+                name: _read_frame(f"{stem}_{i}", entry)
+                for i, (name, entry) in enumerate(zip(meta["names"], meta["entries"]))
+            }
+            return frames if meta["is_dict"] else frames[meta["names"][0]]
+
+    out = reader(path, **kwargs)
+    is_dict = isinstance(out, dict)
+    frames = out if is_dict else {None: out}
+
+    os.makedirs(cache_dir, exist_ok=True)
+    stat = os.stat(path)
+    meta = {
+        "source": os.path.abspath(path),
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": file_hash(path),
+        "is_dict": is_dict,
+        "names": list(frames.keys()),
+        "entries": [
+            _write_frame(df, f"{stem}_{i}") for i, df in enumerate(frames.values())
+        ],
+    }
+    # metadata last: the entry is only used once all frames are complete
+    _write_json(meta, stem + ".json")
+
+    return out
+
+
+def read_excel_cached(path, cache_dir=None, **kwargs):
+    """
+    Cached version of pd.read_excel: same arguments, also for sheet_name = None
+    (dictionary of all sheets)
+    """
+    return cached_read(pd.read_excel, path, "excel", cache_dir=cache_dir, **kwargs)
+
+
+def read_csv_cached(path, cache_dir=None, **kwargs):
+    """
+    Cached version of pd.read_csv: same arguments
+    """
+    return cached_read(pd.read_csv, path, "csv", cache_dir=cache_dir, **kwargs)
+
+
+def read_stata_cached(path, cache_dir=None, **kwargs):
+    """
+    Cached version of pd.read_stata: same arguments
+    """
+    return cached_read(pd.read_stata, path, "stata", cache_dir=cache_dir, **kwargs)
+
+
+def read_microdata(base_path="./base_data", cache_dir=None):
+    """
+    Reads the merged microdata with elasticities: HH_data_with_elas.parquet written by
+    dataprep.py if available, otherwise HH_data_with_elas.xlsx through the cache
+
+    Inputs:
+        - base_path (str): OPTIONAL - folder containing the input data
+        - cache_dir (str): OPTIONAL - cache folder (default: CACHE_DIR)
+    Returns:
+        - HH_data (df): Microdata
+    """
+    path = os.path.join(base_path, os.path.basename(MICRODATA_PATH))
+    if os.path.exists(path):
+        return pd.read_parquet(path)
+
+    return read_excel_cached(
+        os.path.join(base_path, "HH_data_with_elas.xlsx"), cache_dir=cache_dir
+    )
+
+
+def clear_cache(cache_dir=None):
+    """
+    Removes all cached files from the cache folder
+
+    Inputs:
+        - cache_dir (str): OPTIONAL - cache folder (default: CACHE_DIR)
+    """
+    cache_dir = cache_dir or CACHE_DIR
+    if not os.path.isdir(cache_dir):
+        return
+    for name in os.listdir(cache_dir):
+        if name.endswith((".json", ".parquet", ".pkl")):
+            os.remove(os.path.join(cache_dir, name))
@@ -1,21 +1,101 @@
 
 import pandas as pd
 import numpy as np
+from data_cache import MICRODATA_PATH
+from data_cache import read_excel_cached
 
 
-def prepare_Microdata():
+# identifiers of the survey rows, kept in addition to the expenditure columns
+SURVEY_KEYS = ["iso3", "quant_cons", "year", "stat_type", "sample"]
+
+
+def survey_columns(columns):
+    """
+    Returns the columns of the survey used by the household module: identifiers,
+    per capita expenditures, expenditure shares (*_share) and access shares (*_acs_share)
+
+    Inputs:
+        - columns (list): all columns of HH_Data_CPAT_ALL.dta
+    Returns:
+        - (list): columns to read
+    """
+    return [
+        col
+        for col in columns
+        if col in SURVEY_KEYS or col == "cons_pc_acrent" or col.endswith("_share")
+    ]
+
+
+def filter_survey(HH_survey):
+    """
+    Keeps the decile means of the overall sample and downcasts dtypes:
+    integer columns to the smallest integer type, strings to categoricals.
+    Floats keep their Stata storage type.
+
+    Inputs:
+        - HH_survey (df): (chunk of) HH_Data_CPAT_ALL.dta
+    Returns:
+        - (df): filtered survey
+    """
+    HH_survey = HH_survey.loc[
+        (HH_survey["stat_type"] == "mean")
+        & (HH_survey["sample"] == "Overall")
+        & (HH_survey["quant_cons"] != 9999)
+    ].copy()
+
+    for col in HH_survey.columns:
+        if pd.api.types.is_integer_dtype(HH_survey[col]):
+            HH_survey[col] = pd.to_numeric(HH_survey[col], downcast="integer")
+        elif pd.api.types.is_string_dtype(HH_survey[col]):
+            HH_survey[col] = HH_survey[col].astype("category")
+
+    return HH_survey
+
+
+def read_survey(path="./base_data/HH_Data_CPAT_ALL.dta", chunksize=50000):
+    """
+    Reads the household survey in chunks: only the columns of survey_columns() are
+    read and every chunk is filtered with filter_survey() as it arrives, so peak memory
+    is one chunk plus the rows kept
+
+    Inputs:
+        - path (str): path of HH_Data_CPAT_ALL.dta
+        - chunksize (int): OPTIONAL - number of rows per chunk (default: 50000)
+    Returns:
+        - HH_survey (df): decile means of the overall sample
+    """
+    with pd.io.stata.StataReader(path) as reader:
+        columns = survey_columns(list(reader.variable_labels()))
+
+    chunks = []
+    with pd.read_stata(path, columns=columns, chunksize=chunksize) as reader:
+        for chunk in reader:
+            chunks.append(filter_survey(chunk))
+
+    HH_survey = pd.concat(chunks, ignore_index=True)
+    # categories differ between chunks: concat falls back to object
+    for col in HH_survey.columns:
+        if pd.api.types.is_string_dtype(HH_survey[col]):
+            HH_survey[col] = HH_survey[col].astype("category")
+
+    return HH_survey
+
+
+def prepare_Microdata(path="./base_data/HH_Data_CPAT_ALL.dta", chunksize=50000):
     """
     Merges expenditure data with price and income
     elasticity data on country and decile
     
     Inputs:
-        - HH_Data_CPAT_ALL.dta
+        - HH_Data_CPAT_ALL.dta (read in chunks, see read_survey())
         - HH_Elasticities.xlsx
         - Income Elasticities_CPAT.xlsx
+        - path (str): OPTIONAL - path of HH_Data_CPAT_ALL.dta
+        - chunksize (int): OPTIONAL - number of survey rows read at once
     """
-    HH_survey = pd.read_stata("./base_data/HH_Data_CPAT_ALL.dta")
-    HH_price_elasticities = pd.read_excel("./base_data/HH_Elasticities.xlsx")
-    HH_income_elasticities = pd.read_excel("./base_data/Income Elasticities_CPAT.xlsx")
+    HH_survey = read_survey(path, chunksize)
+    HH_price_elasticities = read_excel_cached("./base_data/HH_Elasticities.xlsx")
+    HH_income_elasticities = read_excel_cached("./base_data/Income Elasticities_CPAT.xlsx")
 
     # Merge elasticities: Suppose ethanole elasticity same as lpg elasticity
     HH_price_elasticities.loc[:,"ethanol_elasticity"] = HH_price_elasticities.loc[:,"lpg_elasticity"]
@@ -25,9 +105,6 @@ def prepare_Microdata():
     
     HH_elasticities = pd.merge(HH_price_elasticities,HH_income_elasticities, on=['iso3', 'quant_cons'], suffixes=('_price', '_income'))
 
-    # Prepare HH_survey
-    HH_survey= HH_survey.loc[(HH_survey["stat_type"] == "mean") & (HH_survey["sample"] == "Overall") & (HH_survey['quant_cons'] != 9999)].copy()
-
     full_microdata = pd.merge(left = HH_survey , right = HH_elasticities, on = ['iso3', 'quant_cons'] , how = "left" , suffixes = (None,"_elas"))
 
     return full_microdata
@@ -46,8 +123,8 @@ def concordance_GLORIA_CPAT():
     Returns:
         CPAT_GLORIA(df) : Concordance between GLORIA and CPAT 
     """
-    CPAT_GTAP = pd.read_excel("./base_data/CPAT_GTAP.xlsx", usecols= ["CPAT Variable", "GTAP10 code"])
-    GTAP_GLORIA = pd.read_excel("./base_data/GTAPtoGLORIA.xlsx",sheet_name="Sectors")
+    CPAT_GTAP = read_excel_cached("./base_data/CPAT_GTAP.xlsx", usecols= ["CPAT Variable", "GTAP10 code"])
+    GTAP_GLORIA = read_excel_cached("./base_data/GTAPtoGLORIA.xlsx",sheet_name="Sectors")
     # merge concordance tables
     CPAT_GLORIA = pd.merge(GTAP_GLORIA[["Lfd_Nr","GTAP_Sector"]],CPAT_GTAP, left_on= "GTAP_Sector", right_on="GTAP10 code")
     CPAT_GLORIA.drop(columns=["GTAP_Sector","GTAP10 code"], inplace=True)
@@ -58,7 +135,16 @@ def concordance_GLORIA_CPAT():
     return CPAT_GLORIA
 
 
-# both to excel
+def write_Microdata(full_microdata, path=MICRODATA_PATH):
+    """
+    Writes the merged microdata as parquet (read by data_cache.read_microdata())
+
+    Inputs:
+        - full_microdata (df): output of prepare_Microdata()
+        - path (str): OPTIONAL - output file (default: ./base_data/HH_data_with_elas.parquet)
+    """
+    full_microdata.to_parquet(path, index=False)
 
 
-prepare_Microdata().to_excel("HH_data_with_elas.xlsx")
\ No newline at end of file
+if __name__ == "__main__":
+    write_Microdata(prepare_Microdata())
@@ -0,0 +1,345 @@
+"""
+Monte Carlo simulation of the uncertainty of decile specific price and income elasticities.
+
+The elasticities merged in dataprep.prepare_Microdata() are point estimates. This module
+draws N elasticity samples per decile and consumption category and evaluates for all draws
+
+    - the incidence with price reaction (as in tax_burden_MS())
+    - the price and income adjustment factors per consumption category
+      (as in get_weighted_price_adj_factors() / get_weighted_income_adj_factors())
+    - the GLORIA sectoral adjustment factors (as in HHdemand_adjustments_*_GLORIA())
+
+as batched array computations over chunks of draws and groups, so memory is bounded by
+CHUNK_ELEMENTS (draws x groups x categories) also for percentiles or household records.
+Draws are seeded per country and group from one seed, so results are reproducible
+independent of the order in which countries are run, the worker they are run on and the
+chunks they are evaluated in.
+Results are returned as percentile bands.
+"""
+import zlib
+from concurrent.futures import as_completed
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from auxiliary import calc_price_changes_scenarios
+from auxiliary import calc_tot_demand_g
+from auxiliary import group_weights
+from auxiliary import pc_expenditures
+from auxiliary import revenue_shares
+from batch_household_results import load_country_inputs
+from batch_household_results import load_shared_inputs
+from batch_household_results import SHARED_INPUTS
+from household_data import CONS_CATEGORIES
+from household_data import column_values
+from household_data import country_rows
+from Price_and_Income_Elas.sector_adj_factors import convert_factors_to_GLORIA
+from Price_and_Income_Elas.sector_adj_factors import GLORIA_conversion_matrix
+
+# maximum number of (draws x groups x categories) elements evaluated at once
+CHUNK_ELEMENTS = 2**22
+
+
+def country_seed(seed, country):
+    """
+    Returns the seed sequence of a country: derived from the global seed and the iso code,
+    so every worker draws the same samples for the same country
+
+    Inputs:
+        - seed (int): global seed of the simulation
+        - country (str): 3-digit iso code
+    Returns:
+        - (np.random.SeedSequence)
+    """
+    return np.random.SeedSequence(seed, spawn_key=(zlib.crc32(country.encode()),))
+
+
+def group_generators(seed, country, groups, kind):
+    """
+    Returns one random generator per group of a country: derived from the seed sequence of
+    the country, the group index and the kind of elasticity, so the draws of a group do not
+    depend on the chunks in which the groups and draws are evaluated
+
+    Inputs:
+        - seed (int): global seed of the simulation
+        - country (str): 3-digit iso code
+        - groups (range): indices of the groups (deciles, percentiles or records)
+        - kind (str): "price" or "income"
+    Returns:
+        - (list) of np.random.Generator
+    """
+    sequence = country_seed(seed, country)
+    stream = ("price", "income").index(kind)
+    return [
+        np.random.default_rng(
+            np.random.SeedSequence(
+                sequence.entropy, spawn_key=sequence.spawn_key + (stream, group)
+            )
+        )
+        for group in groups
+    ]
+
+
+def elasticity_moments(HH_data_country, kind, rel_sd=0.1):
+    """
+    Returns point estimates and standard deviations of the elasticities of one country.
+    Standard errors are taken from columns "{cons}_elasticity_{kind}_se" if available,
+    otherwise the standard deviation is rel_sd times the absolute point estimate.
+
+    Inputs:
+        - HH_data_country (df or HouseholdData): Microdata of the country of interest
+        - kind (str): "price" or "income"
+        - rel_sd (float): OPTIONAL - relative standard deviation (default: 0.1)
+    Returns:
+        - mean (np.array): (deciles x categories) point estimates
+        - sd (np.array): (deciles x categories) standard deviations
+    """
+    mean = column_values(
+        HH_data_country, [f"{cons}_elasticity_{kind}" for cons in CONS_CATEGORIES], float
+    )
+
+    se_columns = [f"{cons}_elasticity_{kind}_se" for cons in CONS_CATEGORIES]
+    if all(col in HH_data_country.columns for col in se_columns):
+        sd = column_values(HH_data_country, se_columns, float)
+    else:
+        sd = rel_sd * np.abs(mean)
+
+    return mean, sd
+
+
+def simulate_elasticities(
+    country,
+    HH_data,
+    MS_q,
+    MS_p,
+    MS_rev_inc,
+    concordance,
+    pop_data,
+    n_draws=1000,
+    rel_sd=0.1,
+    decile_target=10,
+    percentiles=(5, 50, 95),
+    chunk_size=2000,
+    seed=0,
+):
+    """
+    Draws n_draws samples of price and income elasticities per decile and consumption category
+    (normal distribution around the point estimates) and returns percentile bands of incidence
+    and adjustment factors
+
+    Inputs:
+        - country (str): 3-digit iso code
+        - HH_data (df or HouseholdData): Microdata
+        - MS_q(df): MINDSET final household demand vector of country of interest:
+                    Has to include columns "PROD_COMM" and "q_hh_base"
+        - Ms_p(df): MINDSET sectoral price changes in country of interest:
+                    Has to include columns "TRAD_COMM" and one price column "delta_p"
+        - MS_rev_inc(float): Tax revenue to be recycled via income tax cut (in 1000 $)
+        - concordance (df): concordance table between GLORIA and expenditure categories
+        - pop_data (df): Population data
+        - n_draws (int): OPTIONAL - number of draws (default: 1000)
+        - rel_sd (float): OPTIONAL - relative standard deviation of the elasticities if the
+                    microdata does not contain standard errors (default: 0.1)
+        - decile_target (int): OPTIONAL - decile under and including which the revenue is distributed
+        - percentiles (tuple): OPTIONAL - percentiles of the bands (default: 5, 50, 95)
+        - chunk_size (int): OPTIONAL - maximum number of draws evaluated at once (default: 2000),
+                    chunks of draws and groups are further limited to CHUNK_ELEMENTS elements
+        - seed (int): OPTIONAL - global seed (default: 0)
+    Returns:
+        - (dict) of DataFrames:
+            - "incidence": iso3, quant_cons, percentile, abs_inc_ela_MS, rel_inc_ela_MS, price_reaction
+            - "price_adj_factors" / "income_adj_factors": consumption categories x percentiles
+            - "price_adj_factors_GLORIA" / "income_adj_factors_GLORIA": GLORIA sectors x percentiles
+    """
+    HH_data_country = country_rows(HH_data, country)
+
+    # 1. Inputs which are the same for all draws
+    # per capita consumption scaled to MINDSET (deciles x categories)
+    cons_pc = pc_expenditures(
+        country, HH_data, MS_q, concordance, pop_data, CONS_CATEGORIES
+    )["pc"]
+    # nansum: same as tax_burden_MS()
+    cons_pc_MS = np.nansum(cons_pc, axis=1)
+    # price changes per category
+    delta_p = (
+        calc_price_changes_scenarios(MS_q, MS_p, concordance)
+        .iloc[:, 0]
+        .loc[CONS_CATEGORIES]
+        .to_numpy()
+    )
+    # share of total expenditures per category by decile (deciles x categories)
+    old_cons = (
+        column_values(HH_data_country, [f"{cons}_share" for cons in CONS_CATEGORIES], float)
+        / 100
+        * column_values(HH_data_country, ["cons_pc_acrent"], float)
+    )
+    # nansum: a missing share only affects its group (as in get_weighted_price_adj_factors())
+    old_cons = group_weights(HH_data_country)[:, None] * old_cons
+    sharetotal = old_cons / np.nansum(old_cons, axis=0)
+    # income increase per decile through transfers
+    MS_total_demand = calc_tot_demand_g(country, HH_data_country, MS_q, concordance)
+    MS_total_demand = np.array(
+        [MS_total_demand.get(cons) for cons in CONS_CATEGORIES], dtype=float
+    )
+    # nansum: same as the pandas sum in get_weighted_income_adj_factors()
+    total_exp_d = np.nansum(sharetotal * MS_total_demand, axis=1)
+    revenue_decile = MS_rev_inc * 1000 * revenue_shares(HH_data_country, decile_target)
+    income_ratio = 1 + revenue_decile / total_exp_d
+
+    price_mean, price_sd = elasticity_moments(HH_data_country, "price", rel_sd)
+    income_mean, income_sd = elasticity_moments(HH_data_country, "income", rel_sd)
+
+    # 2. Batched evaluation of the draws in chunks of groups and draws: as many draws
+    # as possible per chunk, since every group draws from its own generator
+    n_groups, n_categories = price_mean.shape
+    draws_per_chunk = max(1, min(chunk_size, n_draws, CHUNK_ELEMENTS // n_categories))
+    groups_per_chunk = max(
+        1, min(n_groups, CHUNK_ELEMENTS // (draws_per_chunk * n_categories))
+    )
+
+    abs_inc_ela_MS = np.empty((n_draws, n_groups))
+    price_reaction = np.empty((n_draws, n_groups))
+    price_adj = np.zeros((n_draws, n_categories))
+    income_adj = np.zeros((n_draws, n_categories))
+
+    def sample(generators, mean, sd, n):
+        # n draws per group (draws x groups x categories), in the order of the draws
+        return np.stack(
+            [
+                rng.normal(group_mean, group_sd, size=(n, n_categories))
+                for rng, group_mean, group_sd in zip(generators, mean, sd)
+            ],
+            axis=1,
+        )
+
+    for start in range(0, n_groups, groups_per_chunk):
+        groups = slice(start, min(start + groups_per_chunk, n_groups))
+        indices = range(groups.start, groups.stop)
+        price_rngs = group_generators(seed, country, indices, "price")
+        income_rngs = group_generators(seed, country, indices, "income")
+        for first in range(0, n_draws, draws_per_chunk):
+            draws = slice(first, min(first + draws_per_chunk, n_draws))
+            n = draws.stop - draws.start
+
+            # price adjustment factors (draws x groups x categories), weighted sum over
+            # groups (nansum as in get_weighted_price_adj_factors())
+            factor = (delta_p + 1) ** sample(
+                price_rngs, price_mean[groups], price_sd[groups], n
+            )
+            price_adj[draws] += np.nansum(sharetotal[groups] * factor, axis=1)
+            # consumption after price reaction
+            factor *= cons_pc[groups]
+            price_reaction[draws, groups] = factor.sum(axis=2)
+            abs_inc_ela_MS[draws, groups] = factor @ delta_p
+
+            # income adjustment factors (draws x groups x categories)
+            income_effect = income_ratio[groups, None] ** sample(
+                income_rngs, income_mean[groups], income_sd[groups], n
+            )
+            income_effect *= sharetotal[groups]
+            income_adj[draws] += np.nansum(income_effect, axis=1)
+
+    # 3. Percentile bands
+    columns = [f"p{q}" for q in percentiles]
+    conversion = GLORIA_conversion_matrix(country, HH_data, concordance)
+
+    def bands(values, index, name):
+        return pd.DataFrame(
+            np.percentile(values, percentiles, axis=1).T,
+            index=pd.Index(index, name=name),
+            columns=columns,
+        )
+
+    def GLORIA_bands(adj_factors):
+        # all draws are converted at once: (categories x draws) -> (sectors x draws)
+        adj_factors_g = pd.DataFrame(adj_factors.T, index=CONS_CATEGORIES)
+        return bands(
+            convert_factors_to_GLORIA(conversion, adj_factors_g).to_numpy(),
+            conversion.index,
+            "GLORIASector",
+        )
+
+    incidence = pd.DataFrame(
+        {
+            "iso3": country,
+            "quant_cons": np.tile(
+                column_values(HH_data_country, "quant_cons"), len(percentiles)
+            ),
+            "percentile": np.repeat(percentiles, len(cons_pc)),
+            "abs_inc_ela_MS": np.percentile(
+                abs_inc_ela_MS, percentiles, axis=0
+            ).ravel(),
+            "rel_inc_ela_MS": np.percentile(
+                abs_inc_ela_MS / cons_pc_MS, percentiles, axis=0
+            ).ravel(),
+            "price_reaction": np.percentile(
+                price_reaction, percentiles, axis=0
+            ).ravel(),
+        }
+    )
+
+    return {
+        "incidence": incidence,
+        "price_adj_factors": bands(price_adj.T, CONS_CATEGORIES, "CPAT Variable"),
+        "income_adj_factors": bands(income_adj.T, CONS_CATEGORIES, "CPAT Variable"),
+        "price_adj_factors_GLORIA": GLORIA_bands(price_adj),
+        "income_adj_factors_GLORIA": GLORIA_bands(income_adj),
+    }
+
+
+def _init_worker(base_path):
+    """
+    Initializer of the worker processes: loads the shared inputs once per worker
+    """
+    SHARED_INPUTS.update(load_shared_inputs(base_path))
+
+
+def _simulate_country(country, scen, base_path, kwargs):
+    """
+    Runs simulate_elasticities() for one country with the inputs of batch_household_results
+    """
+    if not SHARED_INPUTS:
+        SHARED_INPUTS.update(load_shared_inputs(base_path))
+
+    inputs = load_country_inputs(country, scen, base_path)
+    return country, simulate_elasticities(
+        country=country,
+        HH_data=SHARED_INPUTS["HH_data"],
+        MS_q=inputs["MS_q"],
+        MS_p=inputs["MS_p"],
+        MS_rev_inc=inputs["MS_rev_inc"],
+        concordance=SHARED_INPUTS["concordance"],
+        pop_data=SHARED_INPUTS["pop_data"],
+        **kwargs,
+    )
+
+
+def simulate_batch(
+    countries, scen=3, max_workers=None, base_path="./base_data", **kwargs
+):
+    """
+    Runs simulate_elasticities() for several countries in a process pool. Since draws are
+    seeded per country, results do not depend on the number of workers.
+
+    Inputs:
+        - countries (list): 3-digit iso codes
+        - scen (int): price scenario, key of batch_household_results.SCENARIOS
+        - max_workers (int): OPTIONAL - number of worker processes (default: number of CPUs)
+        - base_path (str): folder containing the input data
+        - **kwargs: keyword arguments passed to simulate_elasticities() (n_draws, seed, ...)
+    Returns:
+        - results (dict): output of simulate_elasticities() per country
+    """
+    results = {}
+    with ProcessPoolExecutor(
+        max_workers=max_workers, initializer=_init_worker, initargs=(base_path,)
+    ) as pool:
+        futures = [
+            pool.submit(_simulate_country, country, scen, base_path, kwargs)
+            for country in countries
+        ]
+        for future in as_completed(futures):
+            country, result = future.result()
+            results[country] = result
+
+    return results
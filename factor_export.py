@@ -0,0 +1,282 @@
+"""
+Export of the GLORIA household demand adjustment factors for the MRIO model.
+
+Factors (HHdemand_adjustments_price_GLORIA(), HHdemand_adjustments_income_GLORIA() or
+their multi-column variants) are written as one contiguous float64 matrix of
+(vectors x GLORIA sectors), so every factor vector is sector-ordered and contiguous:
+
+    - .npy: numpy array, memory-mapped by read_factors(), with the schema in a JSON
+            file next to it (same name, extension .json)
+    - .arrow: Arrow IPC file with one float64 column per vector and the column
+            "GLORIASector", the schema is stored in the metadata of the table (requires pyarrow)
+
+The schema lists the GLORIA sectors (order of the columns of the matrix), the names of
+the vectors (rows) and optional attributes per vector (country, scenario).
+
+    $ python factor_export.py --scen 1 2 3 --format npy --output_dir factors
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from batch_household_results import get_batch_countries
+from batch_household_results import load_country_inputs
+from batch_household_results import load_shared_inputs
+from household_data import HouseholdData
+from Price_and_Income_Elas.sector_adj_factors import HHdemand_adjustments_income_GLORIA
+from Price_and_Income_Elas.sector_adj_factors import HHdemand_adjustments_price_GLORIA
+
+SCHEMA_VERSION = 1
+
+
+def factor_matrix(factors, sectors=None):
+    """
+    Returns the adjustment factors as (vectors x sectors) float64 matrix
+
+    Inputs:
+        - factors (df): GLORIA sectors (index) x one column per vector, e.g. "adj_factor"
+        - sectors (array): OPTIONAL - GLORIA sectors of the columns of the matrix, e.g. all
+                    sectors of the MRIO model (default: index of factors). Sectors missing
+                    in factors get the factor 1 (no adjustment)
+    Returns:
+        - sectors (np.array): GLORIA sectors (columns)
+        - values (np.array): C-contiguous (vectors x sectors) float64 matrix
+    """
+    if sectors is not None:
+        factors = factors.reindex(sectors, fill_value=1.0)
+
+    return (
+        factors.index.to_numpy(),
+        np.ascontiguousarray(factors.to_numpy(dtype=np.float64).T),
+    )
+
+
+def write_factors(values, sectors, vectors, path, attributes=None, kind=None):
+    """
+    Writes a (vectors x sectors) matrix of adjustment factors as .npy (with .json schema)
+    or Arrow IPC file (.arrow), depending on the extension of path
+
+    Inputs:
+        - values (np.array): (vectors x sectors) adjustment factors
+        - sectors (array): GLORIA sectors of the columns
+        - vectors (list): names of the rows, e.g. "BGR/scen3"
+        - path (str): output file ending in .npy or .arrow
+        - attributes (dict): OPTIONAL - lists with one value per vector, e.g. {"country": [...]}
+        - kind (str): OPTIONAL - "price" or "income"
+    Returns:
+        - schema (dict): schema written with the factors
+    """
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    if values.shape != (len(vectors), len(sectors)):
+        raise ValueError(
+            f"factors of shape {values.shape} do not match {len(vectors)} vectors "
+            f"x {len(sectors)} sectors"
+        )
+
+    schema = {
+        "version": SCHEMA_VERSION,
+        "kind": kind,
+        "dtype": "float64",
+        "layout": "vectors x sectors",
+        "sectors": [int(sector) for sector in sectors],
+        "vectors": [str(vector) for vector in vectors],
+        "attributes": {
+            name: [value.item() if hasattr(value, "item") else value for value in column]
+            for name, column in (attributes or {}).items()
+        },
+    }
+
+    extension = os.path.splitext(path)[1]
+    if extension == ".npy":
+        np.save(path, values)
+        with open(os.path.splitext(path)[0] + ".json", "w") as f:
+            json.dump(schema, f)
+    elif extension == ".arrow":
+        import pyarrow as pa
+
+        table = pa.table(
+            {
+                "GLORIASector": np.asarray(schema["sectors"], dtype=np.int64),
+                **{vector: values[i] for i, vector in enumerate(schema["vectors"])},
+            }
+        ).replace_schema_metadata({"schema": json.dumps(schema)})
+        with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        raise ValueError(f"unknown format {extension!r}: use .npy or .arrow")
+
+    return schema
+
+
+def read_factors(path):
+    """
+    Reads factors written by write_factors() without copying: the .npy matrix is
+    memory-mapped, the columns of the Arrow file are views of the memory-mapped file
+
+    Inputs:
+        - path (str): .npy or .arrow file
+    Returns:
+        - schema (dict): sectors, vectors and attributes
+        - values (dict): vector name -> sector-ordered float64 array (read-only)
+    """
+    extension = os.path.splitext(path)[1]
+    if extension == ".npy":
+        with open(os.path.splitext(path)[0] + ".json") as f:
+            schema = json.load(f)
+        matrix = np.load(path, mmap_mode="r")
+        return schema, dict(zip(schema["vectors"], matrix))
+
+    if extension == ".arrow":
+        import pyarrow as pa
+
+        table = pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+        schema = json.loads(table.schema.metadata[b"schema"])
+        return schema, {
+            vector: table.column(vector).chunk(0).to_numpy(zero_copy_only=True)
+            for vector in schema["vectors"]
+        }
+
+    raise ValueError(f"unknown format {extension!r}: use .npy or .arrow")
+
+
+def export_factors(factors, path, sectors=None, kind=None):
+    """
+    Writes the adjustment factors of one country (all columns of factors) for the MRIO model
+
+    Inputs:
+        - factors (df): output of HHdemand_adjustments_price_GLORIA() /
+                    HHdemand_adjustments_income_GLORIA(): GLORIA sectors x factor columns
+        - path (str): output file ending in .npy or .arrow
+        - sectors (array): OPTIONAL - GLORIA sectors of the MRIO model (see factor_matrix())
+        - kind (str): OPTIONAL - "price" or "income"
+    Returns:
+        - schema (dict)
+    """
+    sectors, values = factor_matrix(factors, sectors)
+    return write_factors(values, sectors, list(factors.columns), path, kind=kind)
+
+
+def export_factors_batch(
+    countries=None,
+    scenarios=(3,),
+    decile_target=10,
+    base_path="./base_data",
+    output_dir=".",
+    fmt="npy",
+    sectors=None,
+):
+    """
+    Calculates price adjustment factors for every country and price scenario and income
+    adjustment factors for every country, and writes them as two matrices:
+    price_adj_factors.{fmt} (one vector per country and scenario) and
+    income_adj_factors.{fmt} (one vector per country)
+
+    Inputs:
+        - countries (list): OPTIONAL - 3-digit iso codes (default: get_batch_countries())
+        - scenarios (list): price scenarios, keys of batch_household_results.SCENARIOS
+        - decile_target (int): deciles up to and including which the revenue is recycled
+        - base_path (str): folder containing the input data
+        - output_dir (str): folder of the output files
+        - fmt (str): "npy" or "arrow"
+        - sectors (array): OPTIONAL - GLORIA sectors of the MRIO model (see factor_matrix())
+    Returns:
+        - paths (dict): "price" / "income" -> path of the written file (no price
+                    file without scenarios)
+    """
+    shared = load_shared_inputs(base_path)
+    if countries is None:
+        countries = get_batch_countries(shared["HH_data"], base_path)
+    HH_data = HouseholdData.from_frame(shared["HH_data"])
+    concordance = shared["concordance"]
+
+    price, income = [], []
+    for country in countries:
+        # demand and recycled revenue do not depend on the price scenario
+        inputs = load_country_inputs(country, base_path=base_path)
+        for scen in scenarios:
+            MS_p = load_country_inputs(country, scen, base_path)["MS_p"]
+            price.append(
+                HHdemand_adjustments_price_GLORIA(
+                    country, HH_data, inputs["MS_q"], MS_p, concordance
+                )["adj_factor"]
+            )
+        income.append(
+            HHdemand_adjustments_income_GLORIA(
+                country,
+                HH_data,
+                inputs["MS_q"],
+                inputs["MS_rev_inc"],
+                concordance,
+                decile_target,
+            )["adj_factor"]
+        )
+
+    os.makedirs(output_dir, exist_ok=True)
+    cells = [(country, scen) for country in countries for scen in scenarios]
+    paths = {"income": os.path.join(output_dir, f"income_adj_factors.{fmt}")}
+
+    if cells:
+        paths["price"] = os.path.join(output_dir, f"price_adj_factors.{fmt}")
+        names = [f"{country}/scen{scen}" for country, scen in cells]
+        price_sectors, price_values = factor_matrix(
+            pd.concat(price, axis=1, keys=names), sectors
+        )
+        write_factors(
+            price_values,
+            price_sectors,
+            names,
+            paths["price"],
+            attributes={
+                "country": [country for country, _ in cells],
+                "scen": [scen for _, scen in cells],
+            },
+            kind="price",
+        )
+
+    income_sectors, income_values = factor_matrix(
+        pd.concat(income, axis=1, keys=countries), sectors
+    )
+    write_factors(
+        income_values,
+        income_sectors,
+        list(countries),
+        paths["income"],
+        attributes={
+            "country": list(countries),
+            "decile_target": [decile_target] * len(countries),
+        },
+        kind="income",
+    )
+
+    return paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--countries", nargs="*", default=None)
+    parser.add_argument("--scen", type=int, nargs="+", default=[3])
+    parser.add_argument("--decile_target", type=int, default=10)
+    parser.add_argument("--base_path", default="./base_data")
+    parser.add_argument("--output_dir", default=".")
+    parser.add_argument("--format", default="npy", choices=["npy", "arrow"])
+    parser.add_argument(
+        "--n_sectors",
+        type=int,
+        default=None,
+        help="align the factors to GLORIA sectors 1 to n_sectors (missing sectors: 1)",
+    )
+    args = parser.parse_args()
+
+    paths = export_factors_batch(
+        countries=args.countries,
+        scenarios=args.scen,
+        decile_target=args.decile_target,
+        base_path=args.base_path,
+        output_dir=args.output_dir,
+        fmt=args.format,
+        sectors=None if args.n_sectors is None else np.arange(1, args.n_sectors + 1),
+    )
+    for kind, path in paths.items():
+        print(f"Saved {kind} adjustment factors: {path}")
@@ -0,0 +1,296 @@
+"""
+Compact typed representation of the microdata (HH_data_with_elas).
+
+The wide HH_data frame (one float64/object column per category and variable) is stored
+as contiguous (rows x categories) arrays of expenditure shares, price and income
+elasticities and access shares, with categorical iso3 and integer quantiles. Rows are
+sorted by country, so the rows of one country are a zero-copy view of the arrays.
+
+calc_pc_exp_dg(), tax_burden_MS(), targeted_transfer(), public_investment() and the
+adjustment factors accept a HouseholdData instead of the DataFrame:
+
+    HH_data = load_household_data("./base_data", dtype=np.float32)
+    tax_burden_MS(country, HH_data, MS_q, MS_p, concordance, pop_data)
+"""
+import numpy as np
+import pandas as pd
+from data_cache import read_microdata
+
+# consumption categories of the share and elasticity blocks
+CONS_CATEGORIES = [
+    "appliances",
+    "chemicals",
+    "clothing",
+    "communications",
+    "education",
+    "food",
+    "health_srv",
+    "housing",
+    "other",
+    "paper",
+    "pharma",
+    "rectourism",
+    "transp_eqt",
+    "transp_pub",
+    "ely",
+    "gso",
+    "die",
+    "ker",
+    "lpg",
+    "nga",
+    "ethanol",
+    "oil",
+    "coa",
+    "ccl",
+    "fwd",
+]
+
+# column names of the blocks: block -> pattern of the column of a category
+BLOCKS = {
+    "shares": "{}_share",
+    "price_elasticities": "{}_elasticity_price",
+    "income_elasticities": "{}_elasticity_income",
+    "access": "{}_acs_share",
+}
+
+
+class HouseholdData:
+    """
+    Microdata as contiguous arrays, rows sorted by country
+
+    Attributes:
+        - iso3 (pd.Categorical): country of each row
+        - quant_cons (np.array): integer quantile (decile, percentile) of each row
+        - cons_pc (np.array): per capita consumption "cons_pc_acrent"
+        - shares, price_elasticities, income_elasticities (np.array): (rows x CONS_CATEGORIES)
+        - access (np.array): (rows x infrastructure categories) access shares
+        - access_categories (list): infrastructure categories of access, e.g. "wtr"
+        - extra (dict): other columns (e.g. "weight", standard errors) as 1-d arrays
+        - index (np.array): row labels of the DataFrame the data was built from
+    """
+
+    def __init__(
+        self,
+        iso3,
+        quant_cons,
+        cons_pc,
+        shares,
+        price_elasticities,
+        income_elasticities,
+        access,
+        access_categories,
+        extra=None,
+        index=None,
+    ):
+        self.iso3 = pd.Categorical(iso3)
+        self.quant_cons = np.asarray(quant_cons)
+        self.cons_pc = np.asarray(cons_pc)
+        self.shares = np.asarray(shares)
+        self.price_elasticities = np.asarray(price_elasticities)
+        self.income_elasticities = np.asarray(income_elasticities)
+        self.access = np.asarray(access)
+        self.access_categories = list(access_categories)
+        self.extra = dict(extra or {})
+        self.index = np.arange(len(self.quant_cons)) if index is None else np.asarray(index)
+
+        # rows of each country: rows are sorted by country
+        codes = self.iso3.codes
+        if np.any(np.diff(codes) < 0):
+            raise ValueError("rows of HouseholdData have to be sorted by country")
+        bounds = np.searchsorted(codes, np.arange(len(self.iso3.categories) + 1))
+        self._slices = {
+            country: slice(bounds[i], bounds[i + 1])
+            for i, country in enumerate(self.iso3.categories)
+        }
+
+        # wide column name -> (block, position)
+        self._columns = {"iso3": None, "quant_cons": None, "cons_pc_acrent": None}
+        for block, pattern in BLOCKS.items():
+            categories = self.access_categories if block == "access" else CONS_CATEGORIES
+            for i, category in enumerate(categories):
+                self._columns[pattern.format(category)] = (block, i)
+        for name in self.extra:
+            self._columns[name] = None
+
+    @classmethod
+    def from_frame(cls, HH_data, dtype=np.float64):
+        """
+        Builds the container from the wide microdata frame
+
+        Inputs:
+            - HH_data (df): Microdata (columns iso3, quant_cons, cons_pc_acrent,
+                        "{cons}_share", "{cons}_elasticity_price", "{cons}_elasticity_income",
+                        "{i}_acs_share")
+            - dtype: OPTIONAL - float type of the arrays, e.g. np.float32 (default: float64)
+        Returns:
+            - (HouseholdData)
+        """
+        HH_data = HH_data.iloc[np.argsort(HH_data["iso3"].to_numpy(), kind="stable")]
+        access_categories = [
+            col[: -len("_acs_share")] for col in HH_data.columns if col.endswith("_acs_share")
+        ]
+
+        def block(pattern, categories):
+            columns = [pattern.format(category) for category in categories]
+            return np.ascontiguousarray(HH_data[columns].to_numpy(dtype=dtype))
+
+        used = {"iso3", "quant_cons", "cons_pc_acrent"}
+        for pattern, categories in zip(
+            BLOCKS.values(), [CONS_CATEGORIES] * 3 + [access_categories]
+        ):
+            used.update(pattern.format(category) for category in categories)
+
+        extra = {}
+        for col in HH_data.columns:
+            if col in used:
+                continue
+            values = HH_data[col].to_numpy()
+            extra[col] = values.astype(dtype) if values.dtype.kind == "f" else values
+
+        return cls(
+            iso3=HH_data["iso3"].astype(str),
+            quant_cons=pd.to_numeric(HH_data["quant_cons"], downcast="integer").to_numpy(),
+            cons_pc=HH_data["cons_pc_acrent"].to_numpy(dtype=dtype),
+            shares=block(BLOCKS["shares"], CONS_CATEGORIES),
+            price_elasticities=block(BLOCKS["price_elasticities"], CONS_CATEGORIES),
+            income_elasticities=block(BLOCKS["income_elasticities"], CONS_CATEGORIES),
+            access=block(BLOCKS["access"], access_categories),
+            access_categories=access_categories,
+            extra=extra,
+            index=HH_data.index.to_numpy(),
+        )
+
+    @property
+    def countries(self):
+        """
+        Returns the countries contained in the data
+        """
+        return [country for country, rows in self._slices.items() if rows.stop > rows.start]
+
+    @property
+    def columns(self):
+        """
+        Returns the names of the columns of the wide frame
+        """
+        return pd.Index(list(self._columns))
+
+    def __len__(self):
+        return len(self.quant_cons)
+
+    def arrays(self):
+        """
+        Returns all arrays of the container by name
+        """
+        return {
+            "iso3": self.iso3.codes,
+            "quant_cons": self.quant_cons,
+            "cons_pc": self.cons_pc,
+            **{block: getattr(self, block) for block in BLOCKS},
+            **self.extra,
+        }
+
+    def country(self, country):
+        """
+        Returns the rows of one country as views of the arrays (no copy)
+
+        Inputs:
+            - country (str): 3-digit iso code
+        Returns:
+            - (HouseholdData): rows of the country, empty if the country is not contained
+        """
+        rows = self._slices.get(country, slice(0, 0))
+        return HouseholdData(
+            iso3=self.iso3[rows],
+            quant_cons=self.quant_cons[rows],
+            cons_pc=self.cons_pc[rows],
+            shares=self.shares[rows],
+            price_elasticities=self.price_elasticities[rows],
+            income_elasticities=self.income_elasticities[rows],
+            access=self.access[rows],
+            access_categories=self.access_categories,
+            extra={name: values[rows] for name, values in self.extra.items()},
+            index=self.index[rows],
+        )
+
+    def __getitem__(self, columns):
+        """
+        Returns columns of the wide frame as arrays: one column as 1-d array (view),
+        a list of columns as (rows x columns) array (view if it is a whole block)
+        """
+        if not isinstance(columns, str):
+            columns = list(columns)
+            blocks = {self._columns[col][0] for col in columns if self._columns.get(col)}
+            if len(blocks) == 1:
+                block = blocks.pop()
+                names = [BLOCKS[block].format(category) for category in self._categories(block)]
+                if columns == names:
+                    return getattr(self, block)
+            return np.column_stack([self[col] for col in columns])
+
+        if columns == "iso3":
+            return np.asarray(self.iso3)
+        if columns == "quant_cons":
+            return self.quant_cons
+        if columns == "cons_pc_acrent":
+            return self.cons_pc
+        if columns in self.extra:
+            return self.extra[columns]
+        if columns not in self._columns:
+            raise KeyError(columns)
+        block, position = self._columns[columns]
+        return getattr(self, block)[:, position]
+
+    def _categories(self, block):
+        return self.access_categories if block == "access" else CONS_CATEGORIES
+
+    def to_frame(self):
+        """
+        Returns the wide microdata frame
+        """
+        return pd.DataFrame(
+            {col: self[col] for col in self.columns}, index=self.index
+        )
+
+
+def load_household_data(base_path="./base_data", dtype=np.float64, cache_dir=None):
+    """
+    Loads the microdata (see data_cache.read_microdata()) as HouseholdData
+
+    Inputs:
+        - base_path (str): OPTIONAL - folder containing the input data
+        - dtype: OPTIONAL - float type of the arrays, e.g. np.float32
+        - cache_dir (str): OPTIONAL - folder of the parquet copies
+    Returns:
+        - (HouseholdData)
+    """
+    return HouseholdData.from_frame(read_microdata(base_path, cache_dir), dtype)
+
+
+def country_rows(HH_data, country):
+    """
+    Returns the rows of one country of the microdata: slice of a DataFrame or
+    zero-copy view of a HouseholdData
+
+    Inputs:
+        - HH_data (df or HouseholdData): Microdata
+        - country (str): 3-digit iso code
+    Returns:
+        - (df or HouseholdData)
+    """
+    if isinstance(HH_data, HouseholdData):
+        return HH_data.country(country)
+    return HH_data.loc[(HH_data["iso3"] == country)]
+
+
+def column_values(HH_data, columns, dtype=None):
+    """
+    Returns columns of the microdata (DataFrame or HouseholdData) as array
+
+    Inputs:
+        - HH_data (df or HouseholdData): Microdata
+        - columns (str or list): one column (1-d array) or several columns (2-d array)
+        - dtype: OPTIONAL - dtype of the array, e.g. float
+    Returns:
+        - (np.array)
+    """
+    return np.asarray(HH_data[columns], dtype=dtype)
@@ -0,0 +1,398 @@
+"""
+Local incidence service: keeps the inputs of the household module in memory and
+answers incidence queries over HTTP.
+
+The microdata (as HouseholdData), concordance, population, countrynames and public
+investment are loaded once at start-up, the MINDSET results and the tax template of a
+country at its first query. Intermediates which do not depend on the queried vectors
+(total demand per category, weighted concordance) are then served from the memo cache,
+so a warm query only evaluates the incidence of its price and demand vectors.
+
+    $ python incidence_service.py --port 8050 --countries BGR
+    $ curl localhost:8050/tax_burden -d '{"country": "BGR", "prices": {"21": 0.1}}'
+
+Endpoints (POST):
+    /tax_burden                 tax_burden_MS(), aggregated to deciles
+    /targeted_transfer          targeted_transfer(), aggregated to deciles
+    /public_investment          public_investment()
+    /adjustment_factors/price   HHdemand_adjustments_price_GLORIA()
+    /adjustment_factors/income  HHdemand_adjustments_income_GLORIA()
+and GET /health and /countries.
+
+Queries are JSON objects with the keys
+    - country (str): 3-digit iso code
+    - prices: OPTIONAL - price changes per GLORIA sector, {sector: value} or a list in the
+                order of the concordance sectors. Sectors not given do not change.
+                Default: MINDSET price vector of scenario scen
+    - scen (int): OPTIONAL - price scenario of the default prices, key of SCENARIOS (default: 3)
+    - demand: OPTIONAL - final household demand per GLORIA sector in the same format,
+                replacing the MINDSET demand of the given sectors
+    - revenue (float): OPTIONAL - revenue recycled via transfers / public investment
+                (in 1000 $, default: MINDSET revenue)
+    - decile_target (int): OPTIONAL - deciles up to and including which the transfers are
+                paid (default: 10)
+
+Vectors can also be sent as Arrow IPC stream (Content-Type application/vnd.apache.arrow.stream)
+of a table with the columns "sector" and "prices" and/or "demand", the other keys are then
+URL parameters (?country=BGR&decile_target=5). Results are DataFrames in the JSON "split"
+orientation, or Arrow IPC streams if the request accepts application/vnd.apache.arrow.stream.
+Arrow requires pyarrow.
+"""
+import argparse
+import json
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from urllib.parse import parse_qsl
+from urllib.parse import urlsplit
+
+import numpy as np
+import pandas as pd
+from auxiliary import aggregate_deciles
+from batch_household_results import load_country_inputs
+from batch_household_results import load_shared_inputs
+from batch_household_results import SCENARIOS
+from concordance_matrix import as_concordance_matrix
+from household_data import HouseholdData
+from Price_and_Income_Elas.sector_adj_factors import HHdemand_adjustments_income_GLORIA
+from Price_and_Income_Elas.sector_adj_factors import HHdemand_adjustments_price_GLORIA
+from tax_burden_scaled import tax_burden_MS
+from transfers import public_investment
+from transfers import targeted_transfer
+
+ARROW = "application/vnd.apache.arrow.stream"
+
+# endpoint -> method of IncidenceService
+ENDPOINTS = {
+    "/tax_burden": "tax_burden",
+    "/targeted_transfer": "targeted_transfer",
+    "/public_investment": "public_investment",
+    "/adjustment_factors/price": "price_adj_factors",
+    "/adjustment_factors/income": "income_adj_factors",
+}
+
+
+class IncidenceService:
+    """
+    Inputs of the household module kept in memory and the queries answered with them
+
+    Attributes:
+        - base_path (str): folder containing the input data
+        - inputs (dict): inputs of load_shared_inputs(), HH_data as HouseholdData
+        - sectors (np.array): GLORIA sectors of the concordance, order of vectors given as list
+    """
+
+    def __init__(self, base_path="./base_data", dtype=np.float64):
+        self.base_path = base_path
+        self.inputs = load_shared_inputs(base_path)
+        self.inputs["HH_data"] = HouseholdData.from_frame(self.inputs["HH_data"], dtype)
+        self.sectors = as_concordance_matrix(self.inputs["concordance"]).sectors
+        self._country_inputs = {}
+
+    def country_inputs(self, country, scen=3):
+        """
+        Returns the inputs of load_country_inputs(), loaded at the first query of the country
+        """
+        if country not in self.inputs["HH_data"].countries:
+            raise KeyError(f"no microdata for country {country!r}")
+        if scen not in SCENARIOS:
+            raise ValueError(f"unknown price scenario {scen!r}")
+        if (country, scen) not in self._country_inputs:
+            self._country_inputs[(country, scen)] = load_country_inputs(
+                country, scen, self.base_path
+            )
+        return self._country_inputs[(country, scen)]
+
+    def sector_values(self, values):
+        """
+        Returns a vector of a query as Series indexed by GLORIA sector
+
+        Inputs:
+            - values (dict or list): {sector: value} or one value per sector of the concordance
+        Returns:
+            - (pd.Series): values of the given sectors
+        """
+        if isinstance(values, dict):
+            series = pd.Series(
+                [float(value) for value in values.values()],
+                index=[int(sector) for sector in values],
+                dtype=float,
+            )
+        else:
+            if len(values) != len(self.sectors):
+                raise ValueError(
+                    f"vector has {len(values)} values, the concordance {len(self.sectors)} sectors"
+                )
+            series = pd.Series(np.asarray(values, dtype=float), index=self.sectors)
+
+        unknown = series.index.difference(self.sectors)
+        if len(unknown):
+            raise ValueError(f"unknown GLORIA sectors {unknown.tolist()}")
+        return series
+
+    def vectors(self, query):
+        """
+        Returns country, MINDSET demand (MS_q) and price (MS_p) vectors of a query
+        """
+        if "country" not in query:
+            raise KeyError("query has no country")
+        country = query["country"]
+        inputs = self.country_inputs(country, int(query.get("scen", 3)))
+
+        MS_q = inputs["MS_q"]
+        if query.get("demand") is not None:
+            demand = MS_q.set_index("PROD_COMM")["q_hh_base"]
+            demand = self.sector_values(query["demand"]).combine_first(demand)
+            MS_q = pd.DataFrame(
+                {
+                    "PROD_COMM": demand.index,
+                    "q_hh_base": demand.to_numpy(),
+                    "REG_imp": country,
+                }
+            )
+
+        MS_p = inputs["MS_p"]
+        if query.get("prices") is not None:
+            prices = self.sector_values(query["prices"])
+            MS_p = pd.DataFrame(
+                {
+                    "TRAD_COMM": self.sectors,
+                    "delta_p": prices.reindex(self.sectors, fill_value=0).to_numpy(),
+                }
+            )
+
+        return country, MS_q, MS_p
+
+    def revenue(self, query, key):
+        """
+        Returns the revenue of a query, default: MINDSET revenue "MS_rev_inc" / "MS_rev_govt"
+        """
+        if query.get("revenue") is not None:
+            return float(query["revenue"])
+        return self.country_inputs(query["country"], int(query.get("scen", 3)))[key]
+
+    def tax_burden(self, query):
+        """
+        Incidence per decile of the vectors of the query (tax_burden_MS())
+        """
+        country, MS_q, MS_p = self.vectors(query)
+        return aggregate_deciles(
+            tax_burden_MS(
+                country,
+                self.inputs["HH_data"],
+                MS_q,
+                MS_p,
+                self.inputs["concordance"],
+                self.inputs["pop_data"],
+            )
+        )
+
+    def targeted_transfer(self, query):
+        """
+        Incidence per decile after targeted transfers of the revenue (targeted_transfer())
+        """
+        country, MS_q, MS_p = self.vectors(query)
+        return aggregate_deciles(
+            targeted_transfer(
+                country,
+                self.inputs["HH_data"],
+                MS_q,
+                MS_p,
+                self.revenue(query, "MS_rev_inc"),
+                self.inputs["concordance"],
+                self.inputs["pop_data"],
+                int(query.get("decile_target", 10)),
+            )
+        )
+
+    def public_investment(self, query):
+        """
+        Proxied per capita transfers of public infrastructure investment (public_investment())
+        """
+        country = query["country"]
+        return public_investment(
+            country,
+            self.inputs["HH_data"],
+            self.revenue(query, "MS_rev_govt"),
+            self.country_inputs(country, int(query.get("scen", 3)))["shares"],
+            self.inputs["countrynames"],
+            self.inputs["public_inv"],
+            self.inputs["pop_data"],
+        )
+
+    def price_adj_factors(self, query):
+        """
+        Price adjustment factors per GLORIA sector (HHdemand_adjustments_price_GLORIA())
+        """
+        country, MS_q, MS_p = self.vectors(query)
+        return HHdemand_adjustments_price_GLORIA(
+            country, self.inputs["HH_data"], MS_q, MS_p, self.inputs["concordance"]
+        )
+
+    def income_adj_factors(self, query):
+        """
+        Income adjustment factors per GLORIA sector (HHdemand_adjustments_income_GLORIA())
+        """
+        country, MS_q, _ = self.vectors(query)
+        return HHdemand_adjustments_income_GLORIA(
+            country,
+            self.inputs["HH_data"],
+            MS_q,
+            self.revenue(query, "MS_rev_inc"),
+            self.inputs["concordance"],
+            int(query.get("decile_target", 10)),
+        )
+
+    def query(self, endpoint, query):
+        """
+        Answers a query
+
+        Inputs:
+            - endpoint (str): key of ENDPOINTS, e.g. "/tax_burden"
+            - query (dict): keys as described in the module docstring
+        Returns:
+            - (df): result of the endpoint
+        """
+        if endpoint not in ENDPOINTS:
+            raise LookupError(f"unknown endpoint {endpoint!r}")
+        return getattr(self, ENDPOINTS[endpoint])(query)
+
+    def warm(self, countries):
+        """
+        Loads the inputs of the countries and fills the memo cache with their
+        MINDSET scenario, so the first queries are answered warm
+        """
+        for country in countries:
+            self.tax_burden({"country": country})
+
+
+def read_query(body, content_type, url_query=""):
+    """
+    Returns the query of a request: URL parameters, updated by a JSON body or the
+    vectors of an Arrow IPC stream
+    """
+    query = dict(parse_qsl(url_query))
+    if not body:
+        return query
+
+    if content_type.startswith(ARROW):
+        import pyarrow as pa
+
+        table = pa.ipc.open_stream(body).read_all().to_pandas()
+        for name in ("prices", "demand"):
+            if name in table.columns:
+                query[name] = dict(zip(table["sector"].tolist(), table[name].tolist()))
+    else:
+        query.update(json.loads(body))
+
+    return query
+
+
+def write_result(result, accept=""):
+    """
+    Returns content type and body of a result: JSON "split" orientation or Arrow IPC stream
+    """
+    if ARROW in accept:
+        import pyarrow as pa
+
+        table = pa.Table.from_pandas(result)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return ARROW, sink.getvalue().to_pybytes()
+
+    return "application/json", result.to_json(orient="split").encode()
+
+
+class IncidenceHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of the service: the IncidenceService is the attribute "service"
+    of the server
+    """
+
+    def _send(self, status, content_type, body, start):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Elapsed-ms", f"{(time.perf_counter() - start) * 1000:.2f}")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, value, start):
+        self._send(status, "application/json", json.dumps(value).encode(), start)
+
+    def do_GET(self):
+        start = time.perf_counter()
+        service = self.server.service
+        path = urlsplit(self.path).path
+        if path == "/health":
+            self._send_json(200, {"status": "ok"}, start)
+        elif path == "/countries":
+            self._send_json(200, service.inputs["HH_data"].countries, start)
+        else:
+            self._send_json(404, {"error": f"unknown endpoint {path!r}"}, start)
+
+    def do_POST(self):
+        start = time.perf_counter()
+        url = urlsplit(self.path)
+        if url.path not in ENDPOINTS:
+            self._send_json(404, {"error": f"unknown endpoint {url.path!r}"}, start)
+            return
+
+        try:
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            query = read_query(body, self.headers.get("Content-Type", ""), url.query)
+            result = self.server.service.query(url.path, query)
+            content_type, body = write_result(result, self.headers.get("Accept", ""))
+        except (KeyError, ValueError, TypeError, ImportError) as error:
+            message = error.args[0] if isinstance(error, KeyError) and error.args else error
+            self._send_json(400, {"error": str(message)}, start)
+            return
+        except Exception:
+            self._send_json(500, {"error": traceback.format_exc()}, start)
+            return
+
+        self._send(200, content_type, body, start)
+
+
+def make_server(service, host="127.0.0.1", port=8050):
+    """
+    Returns the HTTP server of a service, started with serve_forever(). Requests are
+    answered one after the other: the memo cache is not shared between threads.
+
+    Inputs:
+        - service (IncidenceService): loaded inputs
+        - host (str): OPTIONAL - address (default: local connections only)
+        - port (int): OPTIONAL - port, 0 for a free port
+    Returns:
+        - (HTTPServer)
+    """
+    server = HTTPServer((host, port), IncidenceHandler)
+    server.service = service
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--base_path", default="./base_data")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8050)
+    parser.add_argument(
+        "--countries", nargs="*", default=[], help="countries loaded at start-up"
+    )
+    parser.add_argument("--float32", action="store_true", help="microdata as float32")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    service = IncidenceService(args.base_path, np.float32 if args.float32 else np.float64)
+    service.warm(args.countries)
+    server = make_server(service, args.host, args.port)
+    print(
+        f"Loaded inputs in {time.perf_counter() - start:.2f} s, "
+        f"serving on http://{args.host}:{server.server_port}"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
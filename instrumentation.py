@@ -0,0 +1,182 @@
+"""
+Opt-in instrumentation of the household pipeline.
+
+Stages (context manager stage()) and functions (decorator traced()) record wall time,
+CPU time, peak memory traced with tracemalloc and the size of the DataFrames they
+return. The events of a run are written as one JSON trace by write_trace().
+
+Instrumentation is disabled by default: stage() and traced() then only check a flag.
+It is enabled with enable() or by setting the environment variable HH_TRACE to the
+path of the trace:
+
+    $ HH_TRACE=trace.json python MASTER_household_results.py
+"""
+import contextlib
+import functools
+import json
+import os
+import platform
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+_STATE = {"enabled": False, "path": None, "started": None}
+# finished events of the run and stack of open stages
+_EVENTS = []
+_STACK = []
+
+
+def enable(path=None):
+    """
+    Enables the instrumentation and starts tracing memory allocations
+
+    Inputs:
+        - path (str): OPTIONAL - file of the JSON trace written by write_trace()
+    """
+    _STATE.update(enabled=True, path=path, started=time.strftime("%Y-%m-%dT%H:%M:%S"))
+    _EVENTS.clear()
+    _STACK.clear()
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    """
+    Disables the instrumentation and stops tracing memory allocations
+    """
+    _STATE["enabled"] = False
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+
+
+def is_enabled():
+    """
+    Returns whether the instrumentation is enabled
+    """
+    return _STATE["enabled"]
+
+
+def frame_info(value):
+    """
+    Returns rows, columns and memory (MB) of a DataFrame or Series, of all DataFrames
+    in a dict or tuple, or None for other values
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return {
+            "rows": int(value.shape[0]),
+            "columns": int(value.shape[1]) if value.ndim > 1 else 1,
+            "mb": float(np.sum(value.memory_usage(index=True, deep=False))) / 2**20,
+        }
+    if isinstance(value, dict):
+        infos = {str(key): frame_info(item) for key, item in value.items()}
+        return {key: info for key, info in infos.items() if info is not None} or None
+    if isinstance(value, tuple):
+        infos = [frame_info(item) for item in value]
+        return infos if any(info is not None for info in infos) else None
+    return None
+
+
+@contextlib.contextmanager
+def stage(name, **attributes):
+    """
+    Context manager: records wall time, CPU time and peak memory of the enclosed block.
+    Stages can be nested, DataFrames can be attached via the yielded event:
+
+        with stage("load", country=country) as event:
+            HH_data = ...
+            event["frames"]["HH_data"] = frame_info(HH_data)
+
+    Inputs:
+        - name (str): name of the stage
+        - **attributes: additional values stored in the event (e.g. country)
+    """
+    if not _STATE["enabled"]:
+        yield {"frames": {}}
+        return
+
+    current, peak = tracemalloc.get_traced_memory()
+    if _STACK:
+        # keep the peak of the enclosing stage before resetting it
+        _STACK[-1]["_peak"] = max(_STACK[-1]["_peak"], peak)
+    tracemalloc.reset_peak()
+
+    event = {
+        "name": name,
+        "path": "/".join([parent["name"] for parent in _STACK] + [name]),
+        **attributes,
+        "frames": {},
+        "_start_memory": current,
+        "_peak": current,
+    }
+    _STACK.append(event)
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield event
+    finally:
+        event["wall_s"] = time.perf_counter() - wall
+        event["cpu_s"] = time.process_time() - cpu
+        peak = max(event.pop("_peak"), tracemalloc.get_traced_memory()[1])
+        event["peak_mb"] = (peak - event.pop("_start_memory")) / 2**20
+        _STACK.pop()
+        if _STACK:
+            _STACK[-1]["_peak"] = max(_STACK[-1]["_peak"], peak)
+        _EVENTS.append(event)
+
+
+def traced(func):
+    """
+    Decorator: records every call of func as a stage named after the function,
+    including the size of the returned DataFrames
+    """
+    name = func.__qualname__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _STATE["enabled"]:
+            return func(*args, **kwargs)
+
+        # country is the first argument of the pipeline functions
+        country = kwargs.get("country", args[0] if args else None)
+        with stage(name, country=country if isinstance(country, str) else None) as event:
+            result = func(*args, **kwargs)
+            info = frame_info(result)
+            if info is not None:
+                event["frames"]["result"] = info
+        return result
+
+    return wrapper
+
+
+def write_trace(path=None):
+    """
+    Writes the events of the run as JSON. Does nothing if the instrumentation is disabled.
+
+    Inputs:
+        - path (str): OPTIONAL - output file (default: path given to enable() or HH_TRACE)
+    Returns:
+        - (dict): the trace, None if disabled
+    """
+    if not _STATE["enabled"]:
+        return None
+
+    trace = {
+        "meta": {
+            "started": _STATE["started"],
+            "python": platform.python_version(),
+            "pandas": pd.__version__,
+            "pid": os.getpid(),
+        },
+        "events": list(_EVENTS),
+    }
+    path = path or _STATE["path"]
+    if path is not None:
+        with open(path, "w") as f:
+            json.dump(trace, f, indent=2, default=str)
+
+    return trace
+
+
+if os.environ.get("HH_TRACE"):
+    enable(os.environ["HH_TRACE"])
@@ -0,0 +1,231 @@
+"""
+In-process memoization of intermediates shared by save_results, save_results_target
+and the adjustment factors (price changes, total demand per category, concordance
+shares, per capita expenditures and tax burdens).
+
+Results are stored in one LRU cache keyed on a fingerprint of the arguments: DataFrames
+are hashed by content (one array per dtype, not per column), the microdata only by the
+rows of the country of interest. Fingerprints are kept per object identity (and
+dropped when the object is garbage collected), so repeated calls with the same inputs
+do not hash them again. Inputs are therefore treated as read-only: a DataFrame modified
+in place after a memoized call is not hashed again, pass a modified copy instead.
+Cached results are returned as read-only arrays and shallow copies of DataFrames
+(copy-on-write), so callers can modify them without changing the cache.
+Hits and misses per function are available via cache_info().
+"""
+import functools
+import hashlib
+import inspect
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# maximum number of cached results (0 disables the cache)
+MAXSIZE = 256
+
+_CACHE = OrderedDict()
+_STATS = {}
+# fingerprints of the arguments: (id, countries) -> (weak reference, fingerprint)
+_FINGERPRINTS = {}
+
+# DataFrames share their data with the cache only with copy-on-write (default from
+# pandas 3.0), otherwise cached frames are copied
+_COPY_ON_WRITE = (
+    int(pd.__version__.split(".")[0]) >= 3 or pd.get_option("mode.copy_on_write") is True
+)
+
+
+def _frame_digest(df):
+    """
+    Returns the sha1 hex digest of the content of a DataFrame: index, column labels and
+    dtypes, and the values as a single array
+    """
+    digest = hashlib.sha1()
+    if isinstance(df.index, pd.RangeIndex):
+        digest.update(repr((df.index.start, df.index.stop, df.index.step)).encode())
+    else:
+        digest.update(pd.util.hash_pandas_object(df.index, index=False).to_numpy().tobytes())
+    dtypes = df.dtypes.tolist()
+    digest.update(repr([(str(col), str(dtype)) for col, dtype in zip(df.columns, dtypes)]).encode())
+
+    # numeric columns as one contiguous array per dtype, the other columns hashed at once
+    numeric = sorted(
+        {dtype for dtype in dtypes if isinstance(dtype, np.dtype) and dtype.kind in "biufcmM"},
+        key=str,
+    )
+    for dtype in numeric:
+        values = df.select_dtypes(include=[dtype]).to_numpy()
+        digest.update(np.ascontiguousarray(values).tobytes())
+    if len(numeric) < len(set(dtypes)):
+        others = df.select_dtypes(exclude=numeric) if numeric else df
+        values = others.to_numpy(dtype=object).ravel()
+        digest.update(pd.util.hash_array(values).tobytes())
+    return digest.hexdigest()
+
+
+def fingerprint(value, countries=None):
+    """
+    Returns a hashable fingerprint of a function argument
+
+    Inputs:
+        - value: argument (DataFrame, Series, array, HouseholdData, concordance operator
+                    or scalar)
+        - countries (list): OPTIONAL - if given, DataFrames with a column "iso3" are only
+                        fingerprinted on the rows of these countries (HH_data slice)
+    Returns:
+        - (tuple or scalar): fingerprint
+    """
+    if isinstance(value, pd.DataFrame):
+        if countries is not None and "iso3" in value.columns:
+            value = value.loc[value["iso3"].isin(countries)]
+        return ("df", value.shape, _frame_digest(value))
+    if isinstance(value, pd.Series):
+        hashes = pd.util.hash_pandas_object(value, index=True).to_numpy()
+        return ("series", str(value.name), hashlib.sha1(hashes.tobytes()).hexdigest())
+    if isinstance(value, np.ndarray):
+        return ("array", value.shape, hashlib.sha1(value.tobytes()).hexdigest())
+    if hasattr(value, "arrays") and hasattr(value, "country"):
+        # HouseholdData: arrays of the rows of the countries of interest
+        digest = hashlib.sha1()
+        for rows in [value] if countries is None else map(value.country, countries):
+            for name, array in rows.arrays().items():
+                array = np.ascontiguousarray(array)
+                digest.update(f"{name}{array.dtype}{array.shape}".encode())
+                digest.update(
+                    pd.util.hash_array(array).tobytes()
+                    if array.dtype == object
+                    else array.tobytes()
+                )
+        return ("households", digest.hexdigest())
+    if hasattr(value, "frame") and isinstance(value.frame, pd.DataFrame):
+        # concordance operator: fingerprint of the underlying table
+        return ("operator", fingerprint(value.frame))
+    if isinstance(value, (list, tuple)):
+        return (type(value).__name__,) + tuple(fingerprint(item, countries) for item in value)
+    if isinstance(value, dict):
+        return ("dict",) + tuple(
+            (key, fingerprint(item, countries)) for key, item in value.items()
+        )
+    return value
+
+
+def _forget(ref):
+    """
+    Removes the fingerprints of a garbage collected argument
+    """
+    for key in [key for key, (other, _) in _FINGERPRINTS.items() if other is ref]:
+        del _FINGERPRINTS[key]
+
+
+def _identity_fingerprint(value, countries):
+    """
+    Returns fingerprint(value, countries), computed once per object: objects which can
+    be weakly referenced (DataFrames, arrays, ...) are looked up by identity, the weak
+    reference guards against the reuse of the id of a collected object
+    """
+    key = (id(value), countries)
+    entry = _FINGERPRINTS.get(key)
+    if entry is not None and entry[0]() is value:
+        return entry[1]
+    result = fingerprint(value, countries)
+    try:
+        _FINGERPRINTS[key] = (weakref.ref(value, _forget), result)
+    except TypeError:
+        # scalars, strings, tuples: cheap to fingerprint
+        pass
+    return result
+
+
+def _read_only(value):
+    """
+    Returns a cached result without copying its data: numpy arrays as read-only views,
+    DataFrames and Series as shallow copy-on-write copies, containers rebuilt
+    """
+    if isinstance(value, np.ndarray):
+        view = value.view()
+        view.flags.writeable = False
+        return view
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return value.copy(deep=not _COPY_ON_WRITE)
+    if isinstance(value, dict):
+        return {key: _read_only(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(_read_only(item) for item in value)
+    if hasattr(value, "tocsr"):
+        # scipy sparse matrix
+        return value.copy()
+    return value
+
+
+def memoize(func):
+    """
+    Decorator: caches results of func in the shared LRU cache. If func has an
+    argument "country", DataFrame arguments with a column "iso3" are fingerprinted
+    on the rows of that country only. Calls with arguments which cannot be
+    fingerprinted (unhashable objects) are not cached.
+
+    Inputs:
+        - func (callable): function to memoize
+    """
+    signature = inspect.signature(func)
+    name = f"{func.__module__}.{func.__qualname__}"
+    _STATS[name] = {"hits": 0, "misses": 0}
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if MAXSIZE <= 0:
+            return func(*args, **kwargs)
+
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        country = bound.arguments.get("country")
+        countries = None if country is None else (country,)
+        key = (name,) + tuple(
+            (arg, _identity_fingerprint(value, countries))
+            for arg, value in bound.arguments.items()
+        )
+        try:
+            hash(key)
+        except TypeError:
+            _STATS[name]["misses"] += 1
+            return func(*args, **kwargs)
+
+        if key in _CACHE:
+            _STATS[name]["hits"] += 1
+            _CACHE.move_to_end(key)
+        else:
+            _STATS[name]["misses"] += 1
+            _CACHE[key] = func(*args, **kwargs)
+            while len(_CACHE) > MAXSIZE:
+                _CACHE.popitem(last=False)
+
+        return _read_only(_CACHE[key])
+
+    return wrapper
+
+
+def cache_info():
+    """
+    Returns hits and misses per memoized function and the current size of the cache
+
+    Returns:
+        - (dict): {"functions": {name: {"hits": int, "misses": int}}, "size": int, "maxsize": int}
+    """
+    return {
+        "functions": {name: dict(stats) for name, stats in _STATS.items()},
+        "size": len(_CACHE),
+        "maxsize": MAXSIZE,
+    }
+
+
+def cache_clear():
+    """
+    Removes all cached results and fingerprints and resets hit and miss counters
+    """
+    _CACHE.clear()
+    _FINGERPRINTS.clear()
+    for stats in _STATS.values():
+        stats["hits"] = 0
+        stats["misses"] = 0
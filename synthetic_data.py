@@ -0,0 +1,368 @@
+"""
+Generator of synthetic, internally consistent input data in the layout of base_data.
+
+base_data is not public. This module writes random inputs with the same files, sheets
+and columns so that the pipeline, the tests and the benchmarks can run locally and at
+sizes beyond one country:
+
+    - GLORIA_CPAT_concordance.xlsx, CPAT_GTAP.xlsx, GTAPtoGLORIA.xlsx (Sectors, Regions)
+    - HH_data_with_elas.parquet (or .xlsx): shares, access shares and elasticities
+    - results_{country}.xlsx (output, price, revenue) and Results_BGR.xlsx for the fixtures
+    - Templates_tax_BTA_{country}_GLORIA.xlsx (govt_spending) and Public_inv.csv
+    - WDI population, exchange rates and GDP deflator
+
+Run from the root of the repository:
+
+    $ python synthetic_data.py ./synthetic --countries 20 --scenarios 3
+"""
+import argparse
+import os
+import shutil
+import string
+
+import numpy as np
+import pandas as pd
+from auxiliary import QUANTILES_COLUMN
+from household_data import CONS_CATEGORIES
+from transfers import INFR_SECTORS
+from wdi_store import WDI_FILES
+
+# GLORIA sectors mapped to several consumption categories (as in the real concordance)
+COMMON_SECTORS = {
+    21: ["ccl", "fwd"],
+    62: ["die", "gso", "ker", "lpg", "ethanol"],
+    63: ["die", "gso", "ker", "lpg", "ethanol"],
+}
+
+# countries used first, further countries get synthetic codes
+COUNTRIES = ["BGR", "ROU", "POL", "HUN", "CZE", "SVK", "HRV", "SVN", "GRC", "SRB"]
+
+
+def synthetic_countries(n_countries):
+    """
+    Returns n_countries 3-digit codes: COUNTRIES first, then "XAA", "XAB", ...
+    """
+    letters = string.ascii_uppercase
+    synthetic = [f"X{a}{b}" for a in letters for b in letters]
+    return (COUNTRIES + synthetic)[:n_countries]
+
+
+def price_scenarios(n_scenarios):
+    """
+    Returns the names of the MINDSET price columns: delta_p_base, delta_p0, delta_p1, ...
+    """
+    return ["delta_p_base"] + [f"delta_p{i}" for i in range(n_scenarios - 1)]
+
+
+def synthetic_concordance(n_sectors):
+    """
+    Returns a concordance table between GLORIA sectors and consumption categories:
+    sectors of COMMON_SECTORS are mapped to several categories, the other sectors are
+    assigned to the remaining categories in turn (every 17th sector to two categories)
+
+    Inputs:
+        - n_sectors (int): number of GLORIA sectors
+    Returns:
+        - (df): columns "CPAT Variable" and "GLORIASector"
+    """
+    common = {cons for categories in COMMON_SECTORS.values() for cons in categories}
+    other = [cons for cons in CONS_CATEGORIES if cons not in common]
+
+    rows = []
+    for sector in range(1, n_sectors + 1):
+        if sector in COMMON_SECTORS:
+            rows += [(cons, sector) for cons in COMMON_SECTORS[sector]]
+            continue
+        rows.append((other[sector % len(other)], sector))
+        if sector % 17 == 0:
+            rows.append((other[(sector + 3) % len(other)], sector))
+
+    return pd.DataFrame(rows, columns=["CPAT Variable", "GLORIASector"])
+
+
+def synthetic_microdata(countries, n_quantiles, rng):
+    """
+    Returns microdata in the layout of HH_data_with_elas: expenditure shares adding up
+    to 100, per capita consumption increasing with the quantile, access shares,
+    negative price and positive income elasticities
+
+    Inputs:
+        - countries (list): 3-digit iso codes
+        - n_quantiles (int): number of consumption quantiles per country
+        - rng (np.random.Generator)
+    Returns:
+        - (df): one row per country and quantile (with QUANTILES_COLUMN for other quantiles
+                    than deciles)
+    """
+    n_rows = len(countries) * n_quantiles
+    quantiles = np.tile(np.arange(1, n_quantiles + 1), len(countries))
+
+    columns = {
+        "iso3": np.repeat(countries, n_quantiles),
+        "quant_cons": quantiles,
+        "year": np.repeat(rng.integers(2010, 2019, len(countries)), n_quantiles),
+        "stat_type": "mean",
+        "sample": "Overall",
+        "cons_pc_acrent": 1000 * quantiles * rng.uniform(0.8, 1.2, n_rows),
+    }
+    shares = rng.dirichlet(np.ones(len(CONS_CATEGORIES)), n_rows) * 100
+    columns.update(
+        {f"{cons}_share": shares[:, i] for i, cons in enumerate(CONS_CATEGORIES)}
+    )
+    columns.update(
+        {f"{infr}_acs_share": rng.uniform(20, 100, n_rows) for infr in INFR_SECTORS}
+    )
+    columns.update(
+        {
+            f"{cons}_elasticity_price": -rng.uniform(0.1, 1.2, n_rows)
+            for cons in CONS_CATEGORIES
+        }
+    )
+    columns.update(
+        {
+            f"{cons}_elasticity_income": rng.uniform(0.3, 1.5, n_rows)
+            for cons in CONS_CATEGORIES
+        }
+    )
+
+    if n_quantiles != 10:
+        columns[QUANTILES_COLUMN] = n_quantiles
+    return pd.DataFrame(columns)
+
+
+def synthetic_results(countries, n_sectors, n_scenarios, rng):
+    """
+    Returns the sheets of a MINDSET results workbook
+
+    Inputs:
+        - countries (list): importing regions contained in the workbook
+        - n_sectors (int): number of GLORIA sectors
+        - n_scenarios (int): number of price columns
+        - rng (np.random.Generator)
+    Returns:
+        - (dict): DataFrames "output", "price" and "revenue"
+    """
+    sectors = np.tile(np.arange(1, n_sectors + 1), len(countries))
+    output = pd.DataFrame(
+        {
+            "PROD_COMM": sectors,
+            "q_hh_base": rng.uniform(1e3, 1e6, len(sectors)),
+            "REG_imp": np.repeat(countries, n_sectors),
+        }
+    )
+    price = pd.DataFrame(
+        {"TRAD_COMM": sectors, "REG_exp": np.repeat(countries, n_sectors)}
+        | {
+            scenario: rng.uniform(0, 0.05, len(sectors))
+            for scenario in price_scenarios(n_scenarios)
+        }
+    )
+    # revenues are read from the second row
+    revenue = pd.DataFrame(
+        {
+            "recyc_inc": [0, rng.uniform(1e4, 1e5)],
+            "recyc_govt": [0, rng.uniform(1e4, 1e5)],
+        }
+    )
+
+    return {"output": output, "price": price, "revenue": revenue}
+
+
+def synthetic_wdi(countries, indicator, low, high, rng):
+    """
+    Returns a WDI table (one row per country, one column per year 1960-2022)
+    """
+    years = [str(year) for year in range(1960, 2023)]
+    return pd.DataFrame(
+        {
+            "Country Name": [f"Country {country}" for country in countries],
+            "Country Code": countries,
+            "Indicator Name": indicator,
+            "Indicator Code": indicator,
+        }
+        | {year: rng.uniform(low, high, len(countries)).round(2) for year in years}
+    )
+
+
+def _write_wdi(table, path):
+    """
+    Writes a WDI table with the four header lines of the World Bank csv files
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write('"Data Source","World Development Indicators",\n\n')
+        f.write('"Last Updated Date","2023-01-01",\n\n')
+        table.to_csv(f, index=False)
+
+
+def _write_sheets(sheets, path):
+    """
+    Writes a dictionary of DataFrames as sheets of one workbook
+    """
+    with pd.ExcelWriter(path) as writer:
+        for name, sheet in sheets.items():
+            sheet.to_excel(writer, sheet_name=name, index=False)
+
+
+def write_synthetic_data(
+    path="./synthetic",
+    n_countries=3,
+    n_sectors=120,
+    n_quantiles=10,
+    n_scenarios=3,
+    all_regions=True,
+    microdata_format="parquet",
+    seed=0,
+):
+    """
+    Writes a synthetic base_data folder
+
+    Inputs:
+        - path (str): OPTIONAL - output folder, the files are written to path/base_data
+        - n_countries (int): OPTIONAL - number of countries (default: 3)
+        - n_sectors (int): OPTIONAL - number of GLORIA sectors, at least 111 for the
+                    infrastructure sectors of transfers.INFR_SECTORS (default: 120)
+        - n_quantiles (int): OPTIONAL - consumption quantiles per country; the pipeline
+                    assumes deciles (default: 10)
+        - n_scenarios (int): OPTIONAL - MINDSET price columns, at least 3 for the
+                    scenarios of MASTER_household_results.py (default: 3)
+        - all_regions (bool): OPTIONAL - results workbooks contain all countries
+                    (as MINDSET results) instead of only the country itself (default: True)
+        - microdata_format (str): OPTIONAL - "parquet" or "xlsx" (default: "parquet")
+        - seed (int): OPTIONAL - seed of the random numbers (default: 0)
+    Returns:
+        - countries (list): 3-digit iso codes of the synthetic countries
+    """
+    infr_sectors = sorted(
+        {sector for weights in INFR_SECTORS.values() for sector in weights}
+    )
+    if n_sectors < max(infr_sectors):
+        raise ValueError(f"n_sectors has to be at least {max(infr_sectors)}")
+    if microdata_format not in ("parquet", "xlsx"):
+        raise ValueError('microdata_format has to be "parquet" or "xlsx"')
+
+    rng = np.random.default_rng(seed)
+    base_path = os.path.join(path, "base_data")
+    os.makedirs(base_path, exist_ok=True)
+    countries = synthetic_countries(n_countries)
+    countrynames = {country: f"Country {country}" for country in countries}
+
+    # concordance: directly and via GTAP codes (dataprep.concordance_GLORIA_CPAT)
+    concordance = synthetic_concordance(n_sectors)
+    concordance.to_excel(
+        os.path.join(base_path, "GLORIA_CPAT_concordance.xlsx"), index=False
+    )
+    sectors = pd.DataFrame(
+        {
+            "Lfd_Nr": np.arange(1, n_sectors + 1),
+            "GTAP_Sector": [f"g{sector}" for sector in range(1, n_sectors + 1)],
+        }
+    )
+    pd.DataFrame(
+        {
+            "CPAT Variable": concordance["CPAT Variable"],
+            "GTAP10 code": "g" + concordance["GLORIASector"].astype(str),
+        }
+    ).to_excel(os.path.join(base_path, "CPAT_GTAP.xlsx"), index=False)
+    _write_sheets(
+        {
+            "Sectors": sectors,
+            "Regions": pd.DataFrame(
+                {
+                    "Region_acronyms": list(countrynames),
+                    "Region_names": list(countrynames.values()),
+                }
+            ),
+        },
+        os.path.join(base_path, "GTAPtoGLORIA.xlsx"),
+    )
+
+    # microdata
+    microdata = synthetic_microdata(countries, n_quantiles, rng)
+    if microdata_format == "parquet":
+        microdata.to_parquet(
+            os.path.join(base_path, "HH_data_with_elas.parquet"), index=False
+        )
+    else:
+        microdata.to_excel(os.path.join(base_path, "HH_data_with_elas.xlsx"))
+
+    # MINDSET results and tax templates per country
+    for country in countries:
+        regions = countries if all_regions else [country]
+        _write_sheets(
+            synthetic_results(regions, n_sectors, n_scenarios, rng),
+            os.path.join(base_path, f"results_{country}.xlsx"),
+        )
+
+        govt_spending = pd.DataFrame(
+            {
+                "REG": country,
+                "PROD_COMM": np.arange(1, n_sectors + 1),
+                "govt_spend": 0.0,
+            }
+        )
+        infr = govt_spending["PROD_COMM"].isin(infr_sectors)
+        govt_spending.loc[infr, "govt_spend"] = rng.dirichlet(np.ones(infr.sum()))
+        _write_sheets(
+            {"govt_spending": govt_spending},
+            os.path.join(base_path, f"Templates_tax_BTA_{country}_GLORIA.xlsx"),
+        )
+
+    # test fixtures read Results_BGR.xlsx
+    if "BGR" in countries:
+        shutil.copyfile(
+            os.path.join(base_path, "results_BGR.xlsx"),
+            os.path.join(base_path, "Results_BGR.xlsx"),
+        )
+
+    # public investment per country and sector (one header line)
+    public_inv = pd.DataFrame(
+        {"": list(countrynames.values())}
+        | {
+            str(sector): rng.uniform(0, 100, len(countries))
+            for sector in range(1, n_sectors + 1)
+        }
+    )
+    with open(os.path.join(base_path, "Public_inv.csv"), "w") as f:
+        f.write("public investment\n")
+        public_inv.to_csv(f, index=False)
+
+    # World Development Indicators
+    indicators = {
+        "pop": ("SP.POP.TOTL", 1e6, 5e7),
+        "er": ("PA.NUS.FCRF", 0.5, 5),
+        "gdp_defl": ("NY.GDP.DEFL.ZS", 50, 150),
+    }
+    for name, (indicator, low, high) in indicators.items():
+        _write_wdi(
+            synthetic_wdi(countries, indicator, low, high, rng),
+            os.path.join(base_path, WDI_FILES[name]),
+        )
+
+    return countries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("path", nargs="?", default="./synthetic")
+    parser.add_argument("--countries", type=int, default=3)
+    parser.add_argument("--sectors", type=int, default=120)
+    parser.add_argument("--quantiles", type=int, default=10)
+    parser.add_argument("--scenarios", type=int, default=3)
+    parser.add_argument("--own_region_only", action="store_true")
+    parser.add_argument(
+        "--microdata_format", default="parquet", choices=["parquet", "xlsx"]
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    write_synthetic_data(
+        path=args.path,
+        n_countries=args.countries,
+        n_sectors=args.sectors,
+        n_quantiles=args.quantiles,
+        n_scenarios=args.scenarios,
+        all_regions=not args.own_region_only,
+        microdata_format=args.microdata_format,
+        seed=args.seed,
+    )
@@ -2,9 +2,24 @@ import os
 
 import numpy as np
 import pandas as pd
-from auxiliary import calc_pc_exp_dg
-from auxiliary import calc_price_changes
+from auxiliary import aggregate_deciles
+from auxiliary import calc_price_changes_scenarios
+from auxiliary import group_deciles
+from auxiliary import group_weights
+from auxiliary import pc_expenditures
+from auxiliary import QUANTILES_COLUMN
+from auxiliary import WEIGHT_COLUMN
+from concordance_matrix import as_concordance_matrix
+from household_data import CONS_CATEGORIES
+from household_data import column_values
+from household_data import country_rows
+from instrumentation import traced
+from memo import memoize
+from scipy import sparse
 
+# rows (groups) per call of incidence_kernel(): bounds the memory of the
+# (groups x categories x scenarios) arrays for household records
+KERNEL_CHUNK = 100_000
 
 #### ALL PATHS will be have to be reset
 #### functions can be called here or in another script
@@ -12,9 +27,12 @@ from auxiliary import calc_price_changes
 ################### FUNCTIONS ###########################################
 
 
+@traced
+@memoize
 def tax_burden_MS(country, HH_data, MS_q, MS_p, concordance , pop_data):
     """
-    Calculates and returns tax burdens per expenditure decile for plots and returns:
+    Calculates and returns tax burdens per expenditure decile (or finer group: percentile,
+    household record with survey weight, see aggregate_deciles()) for plots and returns:
 
     1. absolute and scaled to MINDSET hh demand
     2. relative tax burden (scaled to MINDSET hh demand) in percent of pretax (scaled to MINDSET expenditures)
@@ -23,148 +41,261 @@ def tax_burden_MS(country, HH_data, MS_q, MS_p, concordance , pop_data):
 
     Inputs:
         - country (str): 3-digit iso code
-        - HH_data (df): Microdata
+        - HH_data (df or HouseholdData): Microdata
         - MS_q(df): MINDSET final household demand vector of country of interest:
                     Has to include columns "PROD_COMM" and "q_hh_base"
         - Ms_p(df): MINDSET sectoral price changes in country of interest:
                     Has to include columns "TRAD_COMM" and "delta_p"
                     "delta_p" depends on scenario (base, techn, trade) - column is renamed when
-                    specifying scenario in main file
+                    specifying scenario in main file. If several "delta_p" columns are given
+                    all price scenarios are evaluated in one pass
         - concordance : concordance table between GLORIA and expenditure categories
         - pop_data : Population data
     Returns:
         - HH_data_country_all (Pd.Dataframe): Dataframe containing following columns:
             - "iso3" : 3-digit iso code
-            - "quant_cons" : expenditure decile
+            - "quant_cons" : expenditure decile (quantile of finer groups)
+            - "weight" : survey weight (only if contained in HH_data)
             -"abs_inc_MS" : absolute tax burden
             -"rel_inc_MS": tax burden relative to pretax expenditures
             -"abs_inc_ela_MS" : absolute tax burden with price-reaction
             -"rel_inc_ela_MS": absolute tax burden with price-reaction relative to pretax expenditures
             -"cons_pc_MS" : total consumption per capita per decile pre-policy
             -"price_reaction" : price reaction only -> for tests
+            -"scenario" : name of the price column (only if MS_p contains several price scenarios,
+                          one block of deciles per scenario)
 
     """
 
-    # Get household data with expenditures scaled to Mindset demand
-    HH_data_country_all = calc_pc_exp_dg(country, HH_data, MS_q, concordance, pop_data)
-
-    # load dictionary containing the price changes per CPAT consumption category
-    delta_p_g = calc_price_changes(MS_q, MS_p, concordance)
-
-    # create a list of column names to iterate over
-    cons_categories = [
-        "appliances",
-        "chemicals",
-        "clothing",
-        "communications",
-        "education",
-        "food",
-        "health_srv",
-        "housing",
-        "other",
-        "paper",
-        "pharma",
-        "rectourism",
-        "transp_eqt",
-        "transp_pub",
-        "ely",
-        "gso",
-        "die",
-        "ker",
-        "lpg",
-        "nga",
-        "ethanol",
-        "oil",
-        "coa",
-        "ccl",
-        "fwd",
-    ]
-    # colnames with per capita consumption for all categories
-    pc_cols = [col for col in HH_data_country_all.columns if col.endswith("_pc")]
+    # load price changes per CPAT consumption category (categories x price scenarios)
+    delta_p_g = calc_price_changes_scenarios(MS_q, MS_p, concordance)
+    scenarios = delta_p_g.columns.tolist()
+
+    HH_data_country = country_rows(HH_data, country)
+
+    # (deciles x categories) matrices of per capita consumption scaled to Mindset demand
+    # (as in calc_pc_exp_dg()) and of price elasticities
+    cons_pc = pc_expenditures(
+        country, HH_data, MS_q, concordance, pop_data, CONS_CATEGORIES
+    )["pc"]
+    ela = column_values(
+        HH_data_country, [f"{cons}_elasticity_price" for cons in CONS_CATEGORIES], float
+    )
+    # (categories x scenarios) matrix of price changes
+    delta_p = delta_p_g.loc[CONS_CATEGORIES].to_numpy()
+
     # total consumption per capita per decile
-    HH_data_country_all["cons_pc_MS"] = HH_data_country_all[pc_cols].sum(axis=1)
-
-    # containers
-    abs_inc_MS = np.zeros(len(HH_data_country_all))
-    rel_inc_MS = np.zeros(len(HH_data_country_all))
-    abs_inc_ela_MS = np.zeros(len(HH_data_country_all))
-    rel_inc_ela_MS = np.zeros(len(HH_data_country_all))
-    price_reaction = np.zeros(len(HH_data_country_all))
-
-    for cons in cons_categories:
-        # extract relevant price changes from the price change dictionary
-        delta_p = delta_p_g[cons]
-        # convert HH survey expenditure shares into percent
-        # for absoulte incidence multiply with total consumption per category (scaled to MINDSET)
-        abs_inc_MS += delta_p * HH_data_country_all[f"{cons}_pc"]
-        # for relative incidence multiply HH survey expenditure share (pre-scale) with prices
-        rel_inc_MS += (
-            delta_p
-            * HH_data_country_all[f"{cons}_pc"]
-            / HH_data_country_all["cons_pc_MS"]
-        )
-        col_ela = cons + "_elasticity_price"
-        # price adjustment factors of demand with elasticites
-        ela_values = HH_data_country_all[col_ela]
-        adj_factor = (delta_p + 1) ** ela_values
-
-        abs_inc_ela_MS += adj_factor * delta_p * HH_data_country_all[f"{cons}_pc"]
-        rel_inc_ela_MS += (
-            adj_factor
-            * delta_p
-            * HH_data_country_all[f"{cons}_pc"]
-            / HH_data_country_all["cons_pc_MS"]
-        )
-        price_reaction += adj_factor * HH_data_country_all[f"{cons}_pc"]
+    cons_pc_MS = np.nansum(cons_pc, axis=1)
 
-    HH_data_country_all.loc[:, "abs_inc_MS"] = abs_inc_MS
-    HH_data_country_all.loc[:, "rel_inc_MS"] = rel_inc_MS
-    HH_data_country_all.loc[:, "abs_inc_ela_MS"] = abs_inc_ela_MS
-    HH_data_country_all.loc[:, "rel_inc_ela_MS"] = rel_inc_ela_MS
-    HH_data_country_all.loc[:, "price_reaction"] = price_reaction
+    # incidence in chunks of groups
+    chunks = [
+        incidence_kernel(
+            cons_pc[start : start + KERNEL_CHUNK],
+            ela[start : start + KERNEL_CHUNK],
+            delta_p,
+            cons_pc_MS[start : start + KERNEL_CHUNK],
+        )
+        for start in range(0, max(len(cons_pc), 1), KERNEL_CHUNK)
+    ]
+    results = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in chunks[0]}
+    shape = results["abs_inc_MS"].shape
 
     keep_columns = [
         "iso3",
         "quant_cons",
-        "abs_inc_MS",
-        "rel_inc_MS",
-        "abs_inc_ela_MS",
-        "rel_inc_ela_MS",
-        "cons_pc_MS",
-        "price_reaction",
+        WEIGHT_COLUMN,
+        QUANTILES_COLUMN,
     ]
 
-    HH_data_country_all.drop(
-        columns=[col for col in HH_data_country_all.columns if col not in keep_columns],
-        inplace=True,
+    HH_data_country_all = pd.DataFrame(
+        {
+            **{
+                col: HH_data_country[col]
+                for col in HH_data_country.columns
+                if col in keep_columns
+            },
+            "cons_pc_MS": cons_pc_MS,
+        },
+        index=HH_data_country.index,
     )
 
+    if len(scenarios) == 1:
+        for name, values in results.items():
+            HH_data_country_all[name] = values[:, 0]
+    else:
+        # long format: one block of deciles per price scenario
+        HH_data_country_all = pd.concat(
+            [HH_data_country_all] * len(scenarios), ignore_index=True
+        )
+        HH_data_country_all.insert(
+            HH_data_country_all.columns.get_loc("quant_cons"),
+            "scenario",
+            np.repeat(scenarios, shape[0]),
+        )
+        for name, values in results.items():
+            HH_data_country_all[name] = values.T.ravel()
+
     return HH_data_country_all
 
 
-def save_results(country, HH_data, MS_q, MS_p, concordance , pop_data):
+def incidence_kernel(cons_pc, ela, delta_p, cons_pc_MS=None):
+    """
+    Array kernel of tax_burden_MS(): calculates absolute and relative incidence with and
+    without price reaction for all deciles and price scenarios with whole-array operations
+
+    Inputs:
+        - cons_pc (np.array): (deciles x categories) per capita consumption scaled to MINDSET
+        - ela (np.array): (deciles x categories) price elasticities of demand
+        - delta_p (np.array): (categories x scenarios) price changes per consumption category
+        - cons_pc_MS (np.array): OPTIONAL - (deciles) total per capita consumption
+                                (default: sum of cons_pc over categories)
+    Returns:
+        - (dict): (deciles x scenarios) arrays "abs_inc_MS", "rel_inc_MS", "abs_inc_ela_MS",
+                  "rel_inc_ela_MS" and "price_reaction"
+    """
+    if cons_pc_MS is None:
+        cons_pc_MS = cons_pc.sum(axis=1)
+    # scaled budget shares (deciles x categories)
+    shares = cons_pc / cons_pc_MS[:, None]
+
+    # price adjustment factors of demand with elasticities (deciles x categories x scenarios)
+    cons_pc_ela = (delta_p[None, :, :] + 1) ** ela[:, :, None]
+    # multiplied in place with consumption: consumption after price reaction
+    cons_pc_ela *= cons_pc[:, :, None]
+
+    price_reaction = cons_pc_ela.sum(axis=1)
+    abs_inc_ela_MS = np.einsum("dcs,cs->ds", cons_pc_ela, delta_p)
+
+    return {
+        "abs_inc_MS": cons_pc @ delta_p,
+        "rel_inc_MS": shares @ delta_p,
+        "abs_inc_ela_MS": abs_inc_ela_MS,
+        "rel_inc_ela_MS": abs_inc_ela_MS / cons_pc_MS[:, None],
+        "price_reaction": price_reaction,
+    }
+
+
+@traced
+@memoize
+def incidence_jacobian(country, HH_data, MS_q, concordance, pop_data, MS_p=None):
+    """
+    Calculates the sensitivity (Jacobian) of the incidence per decile with respect to the
+    price changes of the GLORIA sectors, analytically for all deciles and sectors at once.
+
+    Without price reaction the incidence is linear in the sector price changes p (sector
+    shares -> price changes per category -> per capita consumption): abs_inc_MS equals
+    J["abs_inc_MS"] @ p for every price vector, e.g. for a (sectors x candidates) matrix
+    of price vectors. With price reaction ((1 + delta_p)^ela) the incidence is non-linear,
+    its Jacobian is evaluated at the price changes of MS_p (default: no price changes,
+    where it equals the Jacobian without price reaction).
+
+    Inputs:
+        - country (str): 3-digit iso code
+        - HH_data (df or HouseholdData): Microdata
+        - MS_q (df): MINDSET final household demand vector of country of interest:
+                    Has to include columns "PROD_COMM" and "q_hh_base"
+        - concordance (df): concordance table between GLORIA and expenditure categories
+        - pop_data (df): population data
+        - MS_p (df): OPTIONAL - price changes at which the Jacobian is evaluated: column
+                    "TRAD_COMM" and one price column starting with "delta_p"
+    Returns:
+        - (dict) of DataFrames: deciles ("quant_cons") x GLORIA sectors of the concordance
+                    ("GLORIASector") for "abs_inc_MS", "rel_inc_MS", "abs_inc_ela_MS",
+                    "rel_inc_ela_MS" and "price_reaction". Finer groups (percentiles,
+                    household records) are aggregated to deciles as in aggregate_deciles()
+    """
+    operator = as_concordance_matrix(concordance)
+    positions = np.searchsorted(operator.categories, CONS_CATEGORIES)
+
+    # price changes per category are linear in the sector price changes: delta_p = A @ p
+    # with the demand weighted sector shares A (categories x sectors)
+    q = operator.align(MS_q["PROD_COMM"], MS_q["q_hh_base"])
+    A = operator.sector_shares(q).T.tocsr()[positions]
+
+    if MS_p is None:
+        p = np.zeros(len(operator.sectors))
+    else:
+        price_columns = [col for col in MS_p.columns if col.startswith("delta_p")]
+        if len(price_columns) != 1:
+            raise ValueError("MS_p has to contain exactly one price column")
+        p = operator.align(MS_p["TRAD_COMM"], MS_p[price_columns[0]])
+    delta_p = A @ p
+
+    # (groups x categories) per capita consumption and price elasticities
+    HH_data_country = country_rows(HH_data, country)
+    cons_pc = pc_expenditures(
+        country, HH_data, MS_q, concordance, pop_data, CONS_CATEGORIES
+    )["pc"]
+    ela = column_values(
+        HH_data_country, [f"{cons}_elasticity_price" for cons in CONS_CATEGORIES], float
+    )
+
+    # derivatives with respect to the price changes per category (groups x categories)
+    d_price_reaction = cons_pc * ela * (1 + delta_p) ** (ela - 1)
+    derivatives = {
+        "abs_inc_MS": cons_pc,
+        "abs_inc_ela_MS": cons_pc * (1 + delta_p) ** ela + d_price_reaction * delta_p,
+        "price_reaction": d_price_reaction,
+    }
+
+    # population weighted mean per decile (deciles x groups): identity for deciles
+    deciles, rows = np.unique(group_deciles(HH_data_country), return_inverse=True)
+    weights = group_weights(HH_data_country)
+    mean = sparse.csr_matrix(
+        (weights, (rows, np.arange(len(weights)))), shape=(len(deciles), len(weights))
+    )
+    mean = sparse.diags(1 / np.asarray(mean.sum(axis=1)).ravel()) @ mean
+    cons_pc_MS = mean @ np.nansum(cons_pc, axis=1)
+
+    # chain rule, aggregated to deciles first: (deciles x categories) @ (categories x sectors)
+    jacobian = {name: (A.T @ (mean @ d).T).T for name, d in derivatives.items()}
+    jacobian["rel_inc_MS"] = jacobian["abs_inc_MS"] / cons_pc_MS[:, None]
+    jacobian["rel_inc_ela_MS"] = jacobian["abs_inc_ela_MS"] / cons_pc_MS[:, None]
+
+    return {
+        name: pd.DataFrame(
+            jacobian[name],
+            index=pd.Index(deciles, name="quant_cons"),
+            columns=pd.Index(operator.sectors, name="GLORIASector"),
+        )
+        for name in (
+            "abs_inc_MS",
+            "rel_inc_MS",
+            "abs_inc_ela_MS",
+            "rel_inc_ela_MS",
+            "price_reaction",
+        )
+    }
+
+
+@traced
+def save_results(country, HH_data, MS_q, MS_p, concordance , pop_data, folder_path=None):
     """
     Saves sector shares , price changes by consumption categories and absolute and relative incidence
-    by decile as xlsx to be used for further analysis or plots.
+    by decile as xlsx to be used for further analysis or plots. Results of finer groups
+    are aggregated to deciles.
 
+    Inputs as tax_burden_MS(), and
+        - folder_path (str): OPTIONAL - output folder (default: {country}_household_results
+                    in the current working directory)
     """
     # Create the subfolder path in current working directory
-    folder_path = os.path.join(os.getcwd(), f"{country}_household_results")
+    if folder_path is None:
+        folder_path = os.path.join(os.getcwd(), f"{country}_household_results")
 
     # Create the subfolder if it doesn't exist
     if not os.path.exists(folder_path):
         os.makedirs(folder_path)
 
-    pricechange = pd.DataFrame.from_dict(
-        calc_price_changes(MS_q, MS_p, concordance),
-        orient="index",
-        columns=["price changes"],
-    )
-    pricechangecsv = pricechange.reset_index().rename(
-        columns={"index": "consumption category"}
-    )
+    pricechange = calc_price_changes_scenarios(MS_q, MS_p, concordance)
+    # one price scenario: single column "price changes", otherwise one column per scenario
+    if pricechange.shape[1] == 1:
+        pricechange.columns = ["price changes"]
+    pricechangecsv = pricechange.rename_axis("consumption category").reset_index()
 
-    incidence = tax_burden_MS(country, HH_data, MS_q, MS_p, concordance , pop_data)
+    incidence = aggregate_deciles(
+        tax_burden_MS(country, HH_data, MS_q, MS_p, concordance , pop_data)
+    )
 
     # save all dataframes as csv
 
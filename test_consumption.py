@@ -1,20 +1,73 @@
+import io
+import json
 import numpy as np
+import os
 import pandas as pd
 import pytest
+import subprocess
+import sys
+import threading
+import urllib.error
+import urllib.request
+import concordance_matrix
+import data_cache
+import elasticity_uncertainty
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
 from auxiliary import calc_pc_exp_dg
 from auxiliary import calc_price_changes
 from auxiliary import calc_tot_demand_g
+from auxiliary import aggregate_deciles
 from auxiliary import calculate_sectorshares
+from auxiliary import concordance_weights
 from auxiliary import get_pop
+from auxiliary import group_deciles
+from auxiliary import population_shares
+from auxiliary import revenue_shares
+from batch_household_results import cell_folder
+from batch_household_results import get_batch_countries
+from batch_household_results import read_manifest
+from batch_household_results import run_batch
+from batch_household_results import run_grid
+from benchmarks.pipeline import compare
+from data_cache import read_csv_cached
+from data_cache import read_excel_cached
+from data_cache import read_microdata
+from concordance_matrix import as_concordance_matrix
 from dataprep import concordance_GLORIA_CPAT
+from dataprep import read_survey
+from dataprep import write_Microdata
+from elasticity_uncertainty import simulate_elasticities
+from factor_export import export_factors
+from factor_export import export_factors_batch
+from factor_export import read_factors
+from household_data import HouseholdData
+from incidence_service import IncidenceService
+from incidence_service import make_server
+from instrumentation import disable
+from instrumentation import enable
+from instrumentation import stage
+from instrumentation import write_trace
+from memo import cache_clear
+from memo import cache_info
+from memo import memoize
 from numpy.testing import assert_almost_equal
 from Price_and_Income_Elas.sector_adj_factors import get_weighted_price_adj_factors
 from Price_and_Income_Elas.sector_adj_factors import HHdemand_adjustments_price_GLORIA
 from Price_and_Income_Elas.sector_adj_factors import HHdemand_adjustments_income_GLORIA 
 from Price_and_Income_Elas.sector_adj_factors import get_weighted_income_adj_factors
+from Survey_MINDSET_check import pcc_table
+from synthetic_data import write_synthetic_data
+from tax_burden_scaled import incidence_jacobian
+from tax_burden_scaled import incidence_kernel
 from tax_burden_scaled import tax_burden_MS
+from trajectory import incidence_trajectory
+from transfers import get_publ_inv_shares
 from transfers import public_investment
 from transfers import targeted_transfer
+from transfers import targeted_transfer_sweep
+from wdi_store import as_wdi_store
 
 
 ## if you want to run tests paths need to be adjusted : all fixtures rely on results_BGR.xlsx in base_data folder
@@ -22,58 +75,58 @@ from transfers import targeted_transfer
 
 @pytest.fixture(scope="module")
 def HH_data():
-    out = pd.read_excel("./base_data/HH_data_with_elas.xlsx")
+    out = read_microdata("./base_data")
     return out
 
 
 @pytest.fixture(scope="module")
 def MS_q():
-    MS_Q = pd.read_excel("./base_data/Results_BGR.xlsx", sheet_name="output" , usecols = ["PROD_COMM","q_hh_base","REG_imp"])
+    MS_Q = read_excel_cached("./base_data/Results_BGR.xlsx", sheet_name="output" , usecols = ["PROD_COMM","q_hh_base","REG_imp"])
     out = MS_Q.loc[MS_Q["REG_imp"] == "BGR"]
     return out
 
 
 @pytest.fixture(scope="module")
 def MS_p():
-    MS_P = pd.read_excel("./base_data/Results_BGR.xlsx", sheet_name="price")
+    MS_P = read_excel_cached("./base_data/Results_BGR.xlsx", sheet_name="price")
     out = MS_P.loc[MS_P["REG_exp"] == "BGR", ["TRAD_COMM", "delta_p_base"]]
     return out
 
 
 @pytest.fixture(scope="module")
 def MS_rev_inc():
-    MS_REV = pd.read_excel("./base_data/Results_BGR.xlsx", sheet_name="revenue")
+    MS_REV = read_excel_cached("./base_data/Results_BGR.xlsx", sheet_name="revenue")
     out = MS_REV["recyc_inc"].loc[1]
     return out
 
 @pytest.fixture(scope="module")
 def MS_rev_govt():
-    MS_REV = pd.read_excel("./base_data/Results_BGR.xlsx", sheet_name="revenue")
+    MS_REV = read_excel_cached("./base_data/Results_BGR.xlsx", sheet_name="revenue")
     out = MS_REV["recyc_govt"].loc[1]
     return out
 
 @pytest.fixture(scope="module")
 def concordance():
-    out = pd.read_excel("./base_data/GLORIA_CPAT_concordance.xlsx")
+    out = read_excel_cached("./base_data/GLORIA_CPAT_concordance.xlsx")
     return out
 
 @pytest.fixture()
 def public_inv():
-    out = pd.read_csv("./base_data/Public_inv.csv", skiprows=1)
+    out = read_csv_cached("./base_data/Public_inv.csv", skiprows=1)
     return out
 
 @pytest.fixture()
 def countrynames():
-    out = pd.read_excel("./base_data/GTAPtoGLORIA.xlsx", sheet_name="Regions")
+    out = read_excel_cached("./base_data/GTAPtoGLORIA.xlsx", sheet_name="Regions")
     return out
 
 @pytest.fixture()
 def shares():
-    out = pd.read_excel(f"./base_data/Templates_tax_BTA_BGR_GLORIA.xlsx", sheet_name="govt_spending")
+    out = read_excel_cached(f"./base_data/Templates_tax_BTA_BGR_GLORIA.xlsx", sheet_name="govt_spending")
     return out
 @pytest.fixture()
 def pop_data():
-    out = pd.read_csv(
+    out = read_csv_cached(
         "./base_data/population/API_SP.POP.TOTL_DS2_en_csv_v2_5454896.csv", skiprows=4)
     return out
 
@@ -109,6 +162,69 @@ def test_sector_shares_add_up_to_one(MS_q,concordance):
     assert all(np.isclose(value, 1.0, rtol=1e-5) for value in sector_share_sum)
 
 
+def test_concordance_matrix(MS_q, concordance):
+    """
+    Asserts that household demand per consumption category from the sparse
+    concordance operator equals merging and grouping the concordance table
+    """
+    merged = pd.merge(
+        concordance, MS_q, left_on="GLORIASector", right_on="PROD_COMM", how="inner"
+    )
+    expected = merged.groupby("CPAT Variable")["q_hh_base"].sum()
+
+    operator = as_concordance_matrix(concordance)
+    q = operator.align(MS_q["PROD_COMM"], MS_q["q_hh_base"])
+    actual = pd.Series(operator.category_demand(q), index=operator.categories)
+
+    assert np.allclose(actual[expected.index], expected)
+
+
+def test_concordance_matrix_cache(concordance, monkeypatch):
+    """
+    Tests whether operators are reused for the same table, built again for a
+    changed table and whether the cache is bounded
+    """
+    monkeypatch.setattr(concordance_matrix, "MAXSIZE", 2)
+    monkeypatch.setattr(concordance_matrix, "_OPERATORS", OrderedDict())
+
+    operator = as_concordance_matrix(concordance)
+    assert as_concordance_matrix(concordance.copy()) is operator
+
+    # categories reassigned between the sectors: different table
+    swapped = concordance.copy()
+    swapped["CPAT Variable"] = concordance["CPAT Variable"].to_numpy()[::-1]
+    assert as_concordance_matrix(swapped) is not operator
+
+    as_concordance_matrix(concordance.iloc[:-1])
+    assert len(concordance_matrix._OPERATORS) == 2
+    assert as_concordance_matrix(concordance) is not operator
+
+def test_concordance_weights(HH_data, MS_q, concordance):
+    """
+    Tests whether demand of sectors mapped to several categories is split with the
+    budget shares of the country itself and whether total demand is preserved
+    """
+    operator = as_concordance_matrix(concordance)
+    q = operator.align(MS_q["PROD_COMM"], MS_q["q_hh_base"])
+    # sectors mapped to several categories
+    split = np.diff(operator.matrix.indptr) > 1
+
+    weights = {
+        country: concordance_weights(country, HH_data, concordance).toarray()
+        for country in ["BGR", "ROU"]
+    }
+    # shares of the categories of sector 21 (charcoal and firewood) in ROU
+    ROU = HH_data[HH_data["iso3"] == "ROU"][["ccl_share", "fwd_share"]].mean()
+    sector_21 = weights["ROU"][operator.sectors == 21][0]
+
+    # every sector's demand is fully distributed: total demand is preserved
+    assert np.allclose(weights["BGR"].sum(axis=1), 1)
+    assert np.isclose((weights["BGR"].T @ q).sum(), q.sum())
+    assert np.allclose(
+        sector_21[np.isin(operator.categories, ["ccl", "fwd"])], ROU / ROU.sum()
+    )
+    assert not np.allclose(weights["BGR"][split], weights["ROU"][split])
+
 def test_calc_pricechanges(MS_q, MS_p,concordance):
     """
     Asserts that price changes are calculated correctly:
@@ -324,6 +440,139 @@ def test_tax_burden(HH_data, MS_q, MS_p,concordance, pop_data):
     assert np.isclose(actual, expected, rtol=0.001)
 
 
+def test_tax_burden_missing_share(HH_data, MS_q, MS_p, concordance, pop_data):
+    """
+    Tests whether a missing expenditure share only affects the incidence of its decile
+    """
+    HH_missing = HH_data.copy()
+    HH_missing.loc[
+        (HH_missing["iso3"] == "BGR") & (HH_missing["quant_cons"] == 3), "ccl_share"
+    ] = np.nan
+
+    tb = tax_burden_MS("BGR", HH_missing, MS_q, MS_p, concordance, pop_data)
+
+    assert tb["cons_pc_MS"].notna().all()
+    assert tb.loc[tb["quant_cons"] != 3, ["abs_inc_MS", "rel_inc_MS"]].notna().all().all()
+    assert tb.loc[tb["quant_cons"] == 3, "abs_inc_MS"].isna().all()
+
+
+def test_tax_burden_scenarios(HH_data, MS_q, MS_p, concordance, pop_data):
+    """
+    Tests whether evaluating several price scenarios in one pass gives the
+    same incidence as separate runs: second scenario doubles all price changes,
+    so the absolute incidence without price reaction doubles too
+    """
+    MS_p_scen = MS_p.assign(delta_p_double=2 * MS_p["delta_p_base"])
+
+    single = tax_burden_MS("BGR", HH_data, MS_q, MS_p, concordance, pop_data)
+    tb = tax_burden_MS("BGR", HH_data, MS_q, MS_p_scen, concordance, pop_data)
+
+    base = tb.loc[tb["scenario"] == "delta_p_base"]
+    double = tb.loc[tb["scenario"] == "delta_p_double"]
+
+    assert np.allclose(base["abs_inc_ela_MS"], single["abs_inc_ela_MS"])
+    assert np.allclose(double["abs_inc_MS"], 2 * single["abs_inc_MS"])
+
+def test_incidence_kernel():
+    """
+    Tests the array kernel of tax_burden_MS: without price elasticities
+    incidence with and without price reaction are the same and
+    consumption after price reaction equals consumption before
+    """
+    rng = np.random.default_rng(0)
+    cons_pc = rng.uniform(10, 100, size=(10, 25))
+    delta_p = rng.uniform(0, 0.1, size=(25, 3))
+
+    result = incidence_kernel(cons_pc, np.zeros((10, 25)), delta_p)
+
+    assert np.allclose(result["abs_inc_ela_MS"], result["abs_inc_MS"])
+    assert np.allclose(result["abs_inc_MS"], cons_pc @ delta_p)
+    assert np.allclose(result["price_reaction"], cons_pc.sum(axis=1)[:, None])
+
+def test_incidence_jacobian(HH_data, MS_q, MS_p, concordance, pop_data):
+    """
+    Tests whether the Jacobian reproduces the linear incidence exactly, matches finite
+    differences of the incidence with price reaction and aggregates household records
+    to the decile Jacobian
+    """
+    operator = as_concordance_matrix(concordance)
+    p = operator.align(MS_p["TRAD_COMM"], MS_p["delta_p_base"])
+    jacobian = incidence_jacobian("BGR", HH_data, MS_q, concordance, pop_data, MS_p)
+    tb = tax_burden_MS("BGR", HH_data, MS_q, MS_p, concordance, pop_data)
+
+    assert jacobian["abs_inc_MS"].shape == (10, len(operator.sectors))
+    assert np.allclose(jacobian["abs_inc_MS"].to_numpy() @ p, tb["abs_inc_MS"])
+    assert np.allclose(jacobian["rel_inc_MS"].to_numpy() @ p, tb["rel_inc_MS"])
+
+    # central differences along a random direction of sector price changes
+    direction = np.random.default_rng(0).normal(size=len(p)) * 0.01
+    step = 1e-4
+    up, down = (
+        tax_burden_MS(
+            "BGR",
+            HH_data,
+            MS_q,
+            pd.DataFrame({"TRAD_COMM": operator.sectors, "delta_p": p + sign * step * direction}),
+            concordance,
+            pop_data,
+        )
+        for sign in (1, -1)
+    )
+    for name in ("abs_inc_ela_MS", "rel_inc_ela_MS", "price_reaction"):
+        differences = (up[name] - down[name]).to_numpy() / (2 * step)
+        assert np.allclose(jacobian[name].to_numpy() @ direction, differences, rtol=1e-6)
+
+    bgr = HH_data[HH_data["iso3"] == "BGR"]
+    households = bgr.loc[bgr.index.repeat(3)].assign(weight=np.tile([0.2, 0.3, 0.5], len(bgr)))
+    HH_groups = pd.concat([HH_data[HH_data["iso3"] != "BGR"], households], ignore_index=True)
+    aggregated = incidence_jacobian("BGR", HH_groups, MS_q, concordance, pop_data, MS_p)
+    for name, values in jacobian.items():
+        assert np.allclose(aggregated[name], values)
+
+
+def test_memoized_tax_burden(HH_data, MS_q, MS_p, concordance, pop_data):
+    """
+    Tests whether a second call of tax_burden_MS is served from the memo cache
+    and whether modifying a returned result does not change the cached one
+    """
+    cache_clear()
+
+    first = tax_burden_MS("BGR", HH_data, MS_q, MS_p, concordance, pop_data)
+    first["abs_inc_MS"] = 0
+    second = tax_burden_MS("BGR", HH_data, MS_q, MS_p, concordance, pop_data)
+
+    stats = cache_info()["functions"]["tax_burden_scaled.tax_burden_MS"]
+
+    assert stats == {"hits": 1, "misses": 1}
+    assert (second["abs_inc_MS"] != 0).all()
+
+def test_memoize_read_only_results():
+    """
+    Tests whether list arguments are cached, whether cached arrays are returned
+    read-only and whether a modified copy of an input is fingerprinted again
+    """
+    cache_clear()
+
+    @memoize
+    def scaled(values, factors):
+        return np.asarray(values["x"]) * np.sum(factors)
+
+    values = pd.DataFrame({"x": [1.0, 2.0]})
+    first = scaled(values, [1, 2])
+    second = scaled(values, [1, 2])
+    changed = values.copy()
+    changed.loc[0, "x"] = 5.0
+    third = scaled(changed, [1, 2])
+
+    stats = cache_info()["functions"][scaled.__module__ + "." + scaled.__qualname__]
+
+    assert stats == {"hits": 1, "misses": 2}
+    assert not second.flags.writeable
+    with pytest.raises(ValueError):
+        first[0] = 0
+    np.testing.assert_array_equal(second, [3.0, 6.0])
+    np.testing.assert_array_equal(third, [15.0, 6.0])
+
 def test_price_adj_factors_taxburden(HH_data, MS_q, MS_p,concordance, pop_data):
     """
     Test whether individual demand after price elasticites 
@@ -388,6 +637,132 @@ def test_income_adj_factors(HH_data,MS_q,MS_rev_inc,concordance):
     assert np.isclose(actual, expected, rtol=0.001)
 
 
+def test_factor_export(HH_data, MS_q, MS_p, concordance, tmp_path):
+    """
+    Tests whether exported adjustment factors are read back sector-aligned and without
+    copy from .npy and Arrow files, for one country and for the batch export
+    """
+    factors = HHdemand_adjustments_price_GLORIA("BGR", HH_data, MS_q, MS_p, concordance)
+    sectors = np.arange(1, factors.index.max() + 6)
+
+    for fmt in ("npy", "arrow"):
+        path = str(tmp_path / f"BGR.{fmt}")
+        export_factors(factors, path, sectors=sectors, kind="price")
+        schema, values = read_factors(path)
+
+        assert schema["sectors"] == sectors.tolist()
+        assert not values["adj_factor"].flags["OWNDATA"]
+        expected = factors["adj_factor"].reindex(sectors, fill_value=1.0)
+        assert np.allclose(values["adj_factor"], expected)
+
+    paths = export_factors_batch(["BGR"], scenarios=[1], output_dir=str(tmp_path))
+    schema, values = read_factors(paths["price"])
+    assert schema["attributes"] == {"country": ["BGR"], "scen": [1]}
+    assert np.allclose(values["BGR/scen1"], factors["adj_factor"])
+
+    income_only = export_factors_batch(["BGR"], scenarios=[], output_dir=str(tmp_path / "income"))
+    assert list(income_only) == ["income"]
+    assert list(read_factors(income_only["income"])[1]) == ["BGR"]
+
+
+def test_household_data(HH_data, MS_q, MS_p, MS_rev_inc, concordance, pop_data):
+    """
+    Tests whether country slices of HouseholdData are views and whether incidence and
+    adjustment factors of the container equal those of the DataFrame
+    """
+    households = HouseholdData.from_frame(HH_data)
+    bgr = households.country("BGR")
+
+    assert np.shares_memory(bgr.shares, households.shares)
+    assert len(bgr) == (HH_data["iso3"] == "BGR").sum()
+
+    for HH in (households, HouseholdData.from_frame(HH_data, dtype=np.float32)):
+        tb = tax_burden_MS("BGR", HH, MS_q, MS_p, concordance, pop_data)
+        expected = tax_burden_MS("BGR", HH_data, MS_q, MS_p, concordance, pop_data)
+        price = get_weighted_price_adj_factors("BGR", HH, MS_q, MS_p, concordance)[0]
+        income = get_weighted_income_adj_factors("BGR", HH, MS_q, MS_rev_inc, concordance)
+
+        assert np.allclose(tb["abs_inc_ela_MS"], expected["abs_inc_ela_MS"], rtol=1e-5)
+        assert np.allclose(
+            list(price.values()),
+            list(get_weighted_price_adj_factors("BGR", HH_data, MS_q, MS_p, concordance)[0].values()),
+            rtol=1e-5,
+        )
+        assert np.allclose(
+            list(income.values()),
+            list(get_weighted_income_adj_factors("BGR", HH_data, MS_q, MS_rev_inc, concordance).values()),
+            rtol=1e-5,
+        )
+
+def test_incidence_trajectory(HH_data, MS_q, MS_p, MS_rev_inc, concordance, pop_data):
+    """
+    Tests whether the batched trajectory equals tax_burden_MS() and the GLORIA
+    adjustment factors evaluated year by year
+    """
+    scaling = {2025: (1.0, 0.5), 2030: (1.1, 1.0), 2035: (0.9, 2.0)}
+    MS_q_path = pd.concat(
+        [MS_q.assign(year=year, q_hh_base=MS_q["q_hh_base"] * q) for year, (q, p) in scaling.items()]
+    )
+    MS_p_path = pd.concat(
+        [MS_p.assign(year=year, delta_p_base=MS_p["delta_p_base"] * p) for year, (q, p) in scaling.items()]
+    )
+
+    result = incidence_trajectory(
+        "BGR", HH_data, MS_q_path, MS_p_path, concordance, pop_data, MS_rev_inc, 5
+    )
+
+    for year in scaling:
+        MS_q_year = MS_q_path[MS_q_path["year"] == year].drop(columns="year")
+        MS_p_year = MS_p_path[MS_p_path["year"] == year].drop(columns="year")
+        tb = tax_burden_MS("BGR", HH_data, MS_q_year, MS_p_year, concordance, pop_data)
+        incidence = result["incidence"][result["incidence"]["year"] == year]
+        price = HHdemand_adjustments_price_GLORIA("BGR", HH_data, MS_q_year, MS_p_year, concordance)
+        income = HHdemand_adjustments_income_GLORIA(
+            "BGR", HH_data, MS_q_year, MS_rev_inc, concordance, 5
+        )
+
+        for col in ["cons_pc_MS", "abs_inc_MS", "rel_inc_ela_MS", "price_reaction"]:
+            assert np.allclose(incidence[col], tb[col])
+        assert np.allclose(result["price_adj_factors_GLORIA"][year], price["adj_factor"])
+        assert np.allclose(result["income_adj_factors_GLORIA"][year], income["adj_factor"])
+
+
+def test_incidence_trajectory_missing_share(HH_data, MS_q, MS_p, MS_rev_inc, concordance, pop_data):
+    """
+    Tests whether total consumption of the trajectory skips a missing share as
+    tax_burden_MS() does
+    """
+    HH_missing = HH_data.copy()
+    HH_missing.loc[
+        (HH_missing["iso3"] == "BGR") & (HH_missing["quant_cons"] == 3), "ccl_share"
+    ] = np.nan
+
+    result = incidence_trajectory(
+        "BGR", HH_missing, MS_q.assign(year=2030), MS_p.assign(year=2030),
+        concordance, pop_data, MS_rev_inc, 5,
+    )
+    tb = tax_burden_MS("BGR", HH_missing, MS_q, MS_p, concordance, pop_data)
+
+    assert not result["incidence"]["cons_pc_MS"].isna().any()
+    assert np.allclose(result["incidence"]["cons_pc_MS"], tb["cons_pc_MS"])
+
+
+def test_incidence_trajectory_missing_category(HH_data, MS_q, MS_p, concordance, pop_data):
+    """
+    Tests whether the trajectory raises as tax_burden_MS() does if a consumption
+    category has no sector in the MINDSET demand
+    """
+    sectors = concordance.loc[concordance["CPAT Variable"] == "ccl", "GLORIASector"]
+    MS_q_missing = MS_q[~MS_q["PROD_COMM"].isin(sectors)]
+
+    with pytest.raises(KeyError):
+        tax_burden_MS("BGR", HH_data, MS_q_missing, MS_p, concordance, pop_data)
+    with pytest.raises(KeyError):
+        incidence_trajectory(
+            "BGR", HH_data, MS_q_missing.assign(year=2030), MS_p.assign(year=2030),
+            concordance, pop_data,
+        )
+
 def test_pc_transfer(HH_data,MS_q,MS_p,MS_rev_inc,concordance, pop_data):
     """
     Tests whether sum of per capita transfers
@@ -406,6 +781,165 @@ def test_pc_transfer(HH_data,MS_q,MS_p,MS_rev_inc,concordance, pop_data):
     assert np.isclose(actual, expected, rtol=0.0001)
 
 
+
+def test_group_deciles_missing_decile(HH_data, MS_q, MS_p, MS_rev_inc, concordance, pop_data):
+    """
+    Tests whether a country without decile 10 keeps its decile labels: the transfers
+    target the same deciles and the results are not re-aggregated
+    """
+    HH_missing = HH_data.loc[~((HH_data["iso3"] == "BGR") & (HH_data["quant_cons"] == 10))]
+
+    tb = targeted_transfer("BGR", HH_missing, MS_q, MS_p, MS_rev_inc, concordance, pop_data, 5)
+
+    assert list(group_deciles(tb)) == list(range(1, 10))
+    assert list(tb.loc[tb["pc_transfer"] > 0, "quant_cons"]) == [1, 2, 3, 4, 5]
+    assert aggregate_deciles(tb) is tb
+
+    percentiles = pd.DataFrame({"quant_cons": [1, 10, 11, 55, 90], "n_quantiles": 100})
+    assert list(group_deciles(percentiles)) == [1, 1, 2, 6, 9]
+
+
+def test_missing_decile_scaling(HH_data, MS_q, MS_p, MS_rev_inc, concordance, pop_data):
+    """
+    Tests whether deciles without survey weights keep the equal decile scaling of the
+    original implementation if deciles are missing: per capita values scaled with a tenth
+    of the population, transfers shared by decile_target / 10 of the population, and
+    the income adjustment factors receive the same revenue per decile
+    """
+    missing = (HH_data["iso3"] == "BGR") & HH_data["quant_cons"].isin([3, 10])
+    HH_missing = HH_data.loc[~missing]
+    pop = get_pop("BGR", pop_data)
+
+    pc = calc_pc_exp_dg("BGR", HH_missing, MS_q, concordance, pop_data)
+    assert np.allclose(pc["food_pc"], pc["total_food_d"] * 10 / pop)
+
+    tb = targeted_transfer("BGR", HH_missing, MS_q, MS_p, MS_rev_inc, concordance, pop_data, 5)
+    assert np.allclose(
+        tb["pc_transfer"], np.where(tb["quant_cons"] <= 5, MS_rev_inc * 1000 / (pop * 5 / 10), 0)
+    )
+
+    assert np.allclose(revenue_shares(tb, 5), [0.2, 0.2, 0.2, 0.2, 0, 0, 0, 0])
+    assert np.allclose(population_shares(tb), 0.1)
+
+
+def test_household_and_percentile_mode(HH_data, MS_q, MS_p, MS_rev_inc, concordance, pop_data):
+    """
+    Tests whether incidence and transfers of household records with survey weights and of
+    percentiles, where all groups of a decile share the decile's budget, aggregate back
+    to the decile results
+    """
+    bgr = HH_data[HH_data["iso3"] == "BGR"]
+    others = HH_data[HH_data["iso3"] != "BGR"]
+    # three households per decile with weights summing to the decile's weight
+    households = bgr.loc[bgr.index.repeat(3)].assign(weight=np.tile([0.2, 0.3, 0.5], len(bgr)))
+    # ten percentiles per decile
+    percentiles = bgr.loc[bgr.index.repeat(10)].reset_index(drop=True)
+    percentiles["quant_cons"] = np.arange(1, len(percentiles) + 1)
+    percentiles["n_quantiles"] = 100
+
+    expected = targeted_transfer("BGR", HH_data, MS_q, MS_p, MS_rev_inc, concordance, pop_data, 5)
+
+    for groups in (households, percentiles):
+        HH_groups = pd.concat([others, groups], ignore_index=True)
+        result = aggregate_deciles(
+            targeted_transfer(
+                "BGR", HH_groups, MS_q, MS_p, MS_rev_inc, concordance, pop_data, 5
+            )
+        )
+
+        assert len(result) == 10
+        assert list(result.columns) == list(expected.columns)
+        assert np.allclose(
+            result.select_dtypes("number"), expected.reset_index(drop=True).select_dtypes("number")
+        )
+
+def test_targeted_transfer_sweep(HH_data, MS_q, MS_p, MS_rev_inc, concordance, pop_data):
+    """
+    Tests whether the sweep over decile targets gives the same incidence
+    after revenue recycling as targeted_transfer for each target
+    """
+    sweep = targeted_transfer_sweep(
+        "BGR", HH_data, MS_q, MS_p, MS_rev_inc, concordance, pop_data
+    )
+
+    for target in range(1, 11):
+        expected = targeted_transfer(
+            "BGR", HH_data, MS_q, MS_p, MS_rev_inc, concordance, pop_data, target
+        )
+        actual = sweep.loc[sweep["decile_target"] == target]
+        assert np.allclose(actual["abs_inc_ela_RR"], expected["abs_inc_ela_RR"])
+        assert np.allclose(actual["pc_transfer"], expected["pc_transfer"])
+
+def test_elasticity_simulation(HH_data, MS_q, MS_p, MS_rev_inc, concordance, pop_data):
+    """
+    Tests whether the simulation reproduces the point estimates for (almost) zero
+    uncertainty and gives the same bands for the same seed
+    """
+    bands = simulate_elasticities(
+        "BGR", HH_data, MS_q, MS_p, MS_rev_inc, concordance, pop_data,
+        n_draws=20, rel_sd=1e-12,
+    )
+    median = bands["incidence"].loc[bands["incidence"]["percentile"] == 50]
+    expected = tax_burden_MS("BGR", HH_data, MS_q, MS_p, concordance, pop_data)
+    assert np.allclose(median["abs_inc_ela_MS"], expected["abs_inc_ela_MS"])
+
+    expected = HHdemand_adjustments_price_GLORIA("BGR", HH_data, MS_q, MS_p, concordance)
+    assert np.allclose(bands["price_adj_factors_GLORIA"]["p50"], expected.iloc[:, -1])
+
+    first = simulate_elasticities(
+        "BGR", HH_data, MS_q, MS_p, MS_rev_inc, concordance, pop_data,
+        n_draws=50, seed=1,
+    )
+    second = simulate_elasticities(
+        "BGR", HH_data, MS_q, MS_p, MS_rev_inc, concordance, pop_data,
+        n_draws=50, seed=1,
+    )
+    pd.testing.assert_frame_equal(first["incidence"], second["incidence"])
+    assert (first["income_adj_factors"]["p5"] <= first["income_adj_factors"]["p95"]).all()
+
+
+def test_elasticity_simulation_chunks(HH_data, MS_q, MS_p, MS_rev_inc, concordance, pop_data, monkeypatch):
+    """
+    Tests whether the simulation chunked over draws and groups with a missing share
+    reproduces the point estimates, with the missing share only affecting its decile
+    """
+    HH_missing = HH_data.copy()
+    HH_missing.loc[
+        (HH_missing["iso3"] == "BGR") & (HH_missing["quant_cons"] == 3), "ccl_share"
+    ] = np.nan
+    # fewer elements than one draw of all deciles: chunks of single draws and 4 deciles
+    monkeypatch.setattr(elasticity_uncertainty, "CHUNK_ELEMENTS", 100)
+
+    bands = simulate_elasticities(
+        "BGR", HH_missing, MS_q, MS_p, MS_rev_inc, concordance, pop_data,
+        n_draws=5, rel_sd=1e-12,
+    )
+    median = bands["incidence"].loc[bands["incidence"]["percentile"] == 50]
+    expected = tax_burden_MS("BGR", HH_missing, MS_q, MS_p, concordance, pop_data)
+    assert np.allclose(median["rel_inc_ela_MS"], expected["rel_inc_ela_MS"], equal_nan=True)
+    assert not median.loc[median["quant_cons"] != 3, "rel_inc_ela_MS"].isna().any()
+
+    expected = get_weighted_price_adj_factors("BGR", HH_missing, MS_q, MS_p, concordance)[0]
+    assert np.allclose(bands["price_adj_factors"]["p50"], pd.Series(expected))
+
+
+def test_elasticity_simulation_chunk_layout(HH_data, MS_q, MS_p, MS_rev_inc, concordance, pop_data, monkeypatch):
+    """
+    Tests whether the draws of the simulation do not depend on the chunks of draws and
+    groups they are evaluated in
+    """
+    args = ("BGR", HH_data, MS_q, MS_p, MS_rev_inc, concordance, pop_data)
+    whole = simulate_elasticities(*args, n_draws=30, seed=2)
+    small_chunks = simulate_elasticities(*args, n_draws=30, seed=2, chunk_size=7)
+    monkeypatch.setattr(elasticity_uncertainty, "CHUNK_ELEMENTS", 100)
+    single_draws = simulate_elasticities(*args, n_draws=30, seed=2)
+
+    for chunked in (small_chunks, single_draws):
+        for name, frame in whole.items():
+            assert np.allclose(
+                chunked[name].select_dtypes("number"), frame.select_dtypes("number")
+            )
+
 def test_public_transfer(HH_data, MS_rev_govt, shares, countrynames , public_inv , pop_data):
 
     """
@@ -430,3 +964,410 @@ def test_public_transfer(HH_data, MS_rev_govt, shares, countrynames , public_inv
     actual = actual = np.sum((transfer["total_publ_infr_transfer"]) * pop / 10)
 
     assert np.isclose(actual, expected, rtol=0.0001)
+
+
+def test_incidence_service(HH_data, MS_q, MS_p, concordance, pop_data):
+    """
+    Tests whether the service answers price vectors as tax_burden_MS() does, over HTTP
+    as well, and rejects sectors which are not in the concordance
+    """
+    service = IncidenceService("./base_data")
+    prices = dict(zip(MS_p["TRAD_COMM"].tolist(), MS_p["delta_p_base"].tolist()))
+    expected = aggregate_deciles(
+        tax_burden_MS("BGR", HH_data, MS_q, MS_p, concordance, pop_data)
+    )
+
+    result = service.query("/tax_burden", {"country": "BGR", "prices": prices})
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        url = f"http://127.0.0.1:{server.server_port}/tax_burden"
+        body = json.dumps({"country": "BGR", "prices": prices}).encode()
+        with urllib.request.urlopen(urllib.request.Request(url, data=body)) as response:
+            answer = pd.read_json(io.StringIO(response.read().decode()), orient="split")
+        assert np.allclose(answer["abs_inc_ela_MS"], expected["abs_inc_ela_MS"])
+
+        body = json.dumps({"country": "BGR", "prices": {"9999": 0.1}}).encode()
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(urllib.request.Request(url, data=body))
+        assert error.value.code == 400
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_incidence_service_price_adj_factors(HH_data, MS_q, concordance):
+    """
+    Tests whether the price adjustment factors of the service are those of
+    HHdemand_adjustments_price_GLORIA() for the default scenario (scen=3) and for
+    custom prices
+    """
+    service = IncidenceService("./base_data")
+    inputs = service.country_inputs("BGR", 3)
+    expected = HHdemand_adjustments_price_GLORIA(
+        "BGR", HH_data, inputs["MS_q"], inputs["MS_p"], concordance
+    )
+
+    result = service.query("/adjustment_factors/price", {"country": "BGR"})
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+
+    MS_p = pd.DataFrame({"TRAD_COMM": MS_q["PROD_COMM"], "delta_p": 0.1})
+    expected = HHdemand_adjustments_price_GLORIA("BGR", HH_data, MS_q, MS_p, concordance)
+    prices = dict.fromkeys(MS_q["PROD_COMM"].tolist(), 0.1)
+
+    result = service.query(
+        "/adjustment_factors/price", {"country": "BGR", "prices": prices}
+    )
+    pd.testing.assert_frame_equal(result, expected, check_dtype=False)
+    assert not result["adj_factor"].isna().any()
+
+
+def test_cached_read(tmp_path):
+    """
+    Tests whether the cached concordance table is the same as the one
+    read from the xlsx file, both on the first (cold) and second (warm) read
+    """
+
+    expected = pd.read_excel("./base_data/GLORIA_CPAT_concordance.xlsx")
+
+    cold = read_excel_cached("./base_data/GLORIA_CPAT_concordance.xlsx", cache_dir=tmp_path)
+    warm = read_excel_cached("./base_data/GLORIA_CPAT_concordance.xlsx", cache_dir=tmp_path)
+
+    pd.testing.assert_frame_equal(cold, expected)
+    pd.testing.assert_frame_equal(warm, expected)
+
+
+def test_cached_read_atomic(tmp_path, monkeypatch):
+    """
+    Tests whether a cache write interrupted before the metadata leaves neither
+    a cache entry nor temporary files, and whether the next read caches the file
+    """
+    source = tmp_path / "data.csv"
+    pd.DataFrame({"a": [1, 2], "b": [0.5, 1.5]}).to_csv(source, index=False)
+    cache_dir = tmp_path / "cache"
+
+    def interrupted(*args, **kwargs):
+        raise KeyboardInterrupt
+
+    with monkeypatch.context() as m:
+        m.setattr(data_cache.json, "dump", interrupted)
+        with pytest.raises(KeyboardInterrupt):
+            read_csv_cached(str(source), cache_dir=str(cache_dir))
+    assert not [p for p in cache_dir.iterdir() if p.suffix in (".json", ".tmp")]
+
+    expected = pd.read_csv(source)
+    pd.testing.assert_frame_equal(read_csv_cached(str(source), cache_dir=str(cache_dir)), expected)
+    assert len(list(cache_dir.glob("*.json"))) == 1
+    assert not list(cache_dir.glob("*.tmp"))
+    pd.testing.assert_frame_equal(read_csv_cached(str(source), cache_dir=str(cache_dir)), expected)
+
+
+def test_public_transfer_levels(HH_data, MS_rev_govt, shares, countrynames, public_inv, pop_data):
+    """
+    Tests whether evaluating several spending levels at once gives the same
+    transfers as evaluating each level separately
+    """
+    levels = np.array([MS_rev_govt, 2 * MS_rev_govt])
+
+    transfer = public_investment(
+        "BGR", HH_data, levels, shares, countrynames, public_inv, pop_data
+    )
+
+    for level in levels:
+        expected = public_investment(
+            "BGR", HH_data, level, shares, countrynames, public_inv, pop_data
+        )
+        actual = transfer.loc[transfer["MS_rev_govt"] == level]
+        assert np.allclose(
+            actual["total_publ_infr_transfer"], expected["total_publ_infr_transfer"]
+        )
+
+
+def test_public_transfer_missing_access(HH_data, MS_rev_govt, shares, countrynames, public_inv, pop_data):
+    """
+    Tests whether a missing access share or government spending share only
+    affects its own decile or infrastructure category
+    """
+    HH_missing = HH_data.copy()
+    HH_missing.loc[
+        (HH_missing["iso3"] == "BGR") & (HH_missing["quant_cons"] == 3), "ICT_acs_share"
+    ] = np.nan
+
+    expected = public_investment(
+        "BGR", HH_data, MS_rev_govt, shares, countrynames, public_inv, pop_data
+    )
+    transfer = public_investment(
+        "BGR", HH_missing, MS_rev_govt, shares, countrynames, public_inv, pop_data
+    )
+    decile_3 = transfer["quant_cons"] == 3
+
+    assert not transfer["total_publ_infr_transfer"].isna().any()
+    assert transfer.loc[decile_3, "per_cap_transfer_ICT"].isna().all()
+    assert not transfer.loc[~decile_3, "per_cap_transfer_ICT"].isna().any()
+    assert np.allclose(transfer["per_cap_transfer_ely"], expected["per_cap_transfer_ely"])
+
+    shares_missing = shares.copy()
+    shares_missing.loc[shares_missing["PROD_COMM"] == 110, "govt_spend"] = np.nan
+    share_dict = get_publ_inv_shares("BGR", shares_missing)
+    assert np.isnan(share_dict["ICT"])
+    assert not np.isnan([share_dict[i] for i in share_dict if i != "ICT"]).any()
+
+
+def test_imports_side_effect_free(tmp_path):
+    """
+    Tests whether importing dataprep and Survey_MINDSET_check neither reads
+    base_data nor writes output (imports run in an empty folder)
+    """
+    subprocess.run(
+        [sys.executable, "-c", "import dataprep, Survey_MINDSET_check"],
+        cwd=tmp_path,
+        env=dict(os.environ, PYTHONPATH=str(Path(__file__).parent)),
+        check=True,
+    )
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_write_microdata_default(tmp_path, monkeypatch):
+    """
+    Tests whether the microdata written by write_Microdata() with the default path is
+    the microdata read by read_microdata() with its default folder
+    """
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "base_data").mkdir()
+    microdata = pd.DataFrame({"iso3": ["BGR", "BGR"], "quant_cons": [1, 2]})
+
+    write_Microdata(microdata)
+
+    pd.testing.assert_frame_equal(read_microdata(), microdata)
+
+
+def test_read_survey_chunked(tmp_path):
+    """
+    Tests whether reading the survey in chunks gives the same rows as
+    reading the whole file and filtering afterwards
+    """
+    rng = np.random.default_rng(0)
+    n = 1000
+    survey = pd.DataFrame(
+        {
+            "iso3": rng.choice(["BGR", "ROU"], n),
+            "quant_cons": rng.choice([1, 2, 3, 9999], n),
+            "year": 2019,
+            "stat_type": rng.choice(["mean", "median"], n),
+            "sample": rng.choice(["Overall", "Urban"], n),
+            "cons_pc_acrent": rng.random(n),
+            "food_share": rng.random(n) * 100,
+            "ely_acs_share": rng.random(n) * 100,
+            "unused": rng.random(n),
+        }
+    )
+    survey.to_stata(tmp_path / "survey.dta", write_index=False)
+
+    full = pd.read_stata(tmp_path / "survey.dta")
+    expected = full.loc[
+        (full["stat_type"] == "mean")
+        & (full["sample"] == "Overall")
+        & (full["quant_cons"] != 9999)
+    ].drop(columns="unused").reset_index(drop=True)
+
+    actual = read_survey(tmp_path / "survey.dta", chunksize=99)
+
+    pd.testing.assert_frame_equal(
+        actual, expected, check_dtype=False, check_categorical=False
+    )
+
+
+def test_pcc_table():
+    """
+    Tests the survey vs MINDSET per capita consumption for a country with
+    survey year 2015: 100 LCU at 2 LCU/USD, deflator 50 -> 100, population 10
+    """
+    def wdi(values):
+        table = pd.DataFrame({"Country Code": ["BGR", "ROU"]})
+        for year in ["2015", "2019"]:
+            table[year] = values[year]
+        return table
+
+    er = wdi({"2015": [2.0, 1.0], "2019": [4.0, 1.0]})
+    gdp_defl = wdi({"2015": [50.0, 1.0], "2019": [100.0, 1.0]})
+    pop_wb = wdi({"2015": [5.0, 1.0], "2019": [10.0, 1.0]})
+    MS_q = pd.DataFrame({"REG_imp": ["BGR", "BGR", "POL"], "q_hh_base": [0.06, 0.04, 1.0]})
+    HH_data = pd.DataFrame(
+        {"iso3": ["BGR", "BGR", "ROU"], "year": [2015, 2015, 2015], "cons_pc_acrent": [50.0, 150.0, 1.0]}
+    )
+
+    table = pcc_table(er, pop_wb, gdp_defl, MS_q, HH_data)
+
+    assert table["country"].tolist() == ["BGR"]
+    assert np.isclose(table["HH_Survey"].iloc[0], 100)
+    assert np.isclose(table["MINDSET"].iloc[0], 10)
+    assert table["Percent_Deviation"].iloc[0] == "90.00 %"
+
+
+def test_wdi_store(pop_data):
+    """
+    Tests whether single and batch lookups in the WDI store give the values
+    of the population table and whether the store is built once per table
+    """
+    store = as_wdi_store(pop_data)
+    expected = pop_data.loc[pop_data["Country Code"] == "BGR", "2019"].iloc[0]
+
+    assert store.get("pop", "BGR", 2019) == expected
+    assert as_wdi_store(pop_data) is store
+
+    values = store.lookup("pop", ["BGR", "BGR", "XXX"], [2019, 2018, 2019])
+    assert values[0] == expected
+    assert values[1] == pop_data.loc[pop_data["Country Code"] == "BGR", "2018"].iloc[0]
+    assert np.isnan(values[2])
+
+
+def test_wdi_store_modified_table(pop_data):
+    """
+    Tests whether a population table modified in place gives a new WDI store
+    """
+    table = pop_data.copy()
+    store = as_wdi_store(table)
+    table.loc[table["Country Code"] == "BGR", "2019"] = 1.0
+
+    assert as_wdi_store(table) is not store
+    assert as_wdi_store(table).get("pop", "BGR", 2019) == 1.0
+
+
+def test_synthetic_data(tmp_path):
+    """
+    Tests whether the synthetic inputs are consistent: shares add up to 100, every
+    sector is mapped and the pipeline runs on them for every country
+    """
+    countries = write_synthetic_data(tmp_path, n_countries=2, n_scenarios=4)
+    base_path = tmp_path / "base_data"
+
+    HH_data = read_microdata(base_path)
+    concordance = pd.read_excel(base_path / "GLORIA_CPAT_concordance.xlsx")
+    pop_data = pd.read_csv(
+        base_path / "population" / "API_SP.POP.TOTL_DS2_en_csv_v2_5454896.csv", skiprows=4
+    )
+    shares = HH_data[[col for col in HH_data.columns if col.endswith("_share") and "_acs_" not in col]]
+    assert np.allclose(shares.sum(axis=1), 100)
+    assert sorted(concordance["GLORIASector"].unique()) == list(range(1, 121))
+
+    for country in countries:
+        MS = pd.read_excel(base_path / f"results_{country}.xlsx", sheet_name=None)
+        MS_q = MS["output"].loc[MS["output"]["REG_imp"] == country]
+        MS_p = MS["price"].loc[MS["price"]["REG_exp"] == country, ["TRAD_COMM", "delta_p2"]]
+        tb = tax_burden_MS(country, HH_data, MS_q, MS_p, concordance, pop_data)
+        assert len(tb) == 10
+        assert tb["abs_inc_MS"].notna().all()
+
+
+def test_grid_resume(tmp_path, monkeypatch):
+    """
+    Tests whether the grid saves every cell in its own folder, records it in the
+    manifest and only runs the missing cells when an interrupted run is started again
+    """
+    monkeypatch.setattr(data_cache, "CACHE_DIR", str(tmp_path / "cache"))
+    countries = write_synthetic_data(tmp_path, n_countries=1)
+    output_dir = str(tmp_path / "grid")
+    grid = dict(
+        countries=countries,
+        scenarios=[1, 3],
+        decile_targets=[3, 10],
+        max_workers=2,
+        base_path=str(tmp_path / "base_data"),
+        output_dir=output_dir,
+    )
+
+    timings, failures = run_grid(**grid)
+    assert failures == {}
+    # 2 incidence cells (one per price scenario) and 4 transfer cells
+    assert len(timings) == 6
+    assert os.path.exists(os.path.join(cell_folder(output_dir, countries[0], 3, 10), "transfers.xlsx"))
+    assert os.path.exists(os.path.join(cell_folder(output_dir, countries[0], 3, None), "incidence.xlsx"))
+    assert not os.path.exists(os.path.join(cell_folder(output_dir, countries[0], 3, 10), "incidence.xlsx"))
+
+    # interruption while the last cell was recorded
+    manifest = os.path.join(output_dir, "manifest.jsonl")
+    with open(manifest) as f:
+        lines = f.readlines()
+    with open(manifest, "w") as f:
+        f.writelines(lines[:-1] + [lines[-1][:10]])
+
+    timings, failures = run_grid(**grid)
+    assert len(timings) == 1
+    assert len(read_manifest(manifest)) == 6
+    assert run_grid(**grid)[0] == {}
+
+    # a changed shared input file (microdata) invalidates all cells
+    microdata = tmp_path / "base_data" / "HH_data_with_elas.parquet"
+    pd.read_parquet(microdata).to_parquet(microdata, compression="gzip")
+    assert len(run_grid(**grid)[0]) == 6
+
+
+def test_batch_countries_pool(tmp_path, monkeypatch):
+    """
+    Tests whether parsing the results workbooks in a pool finds the same countries as
+    parsing them one after the other, and whether missing shared inputs are reported by
+    the batch before the pool is started
+    """
+    monkeypatch.setattr(data_cache, "CACHE_DIR", str(tmp_path / "cache"))
+    countries = write_synthetic_data(tmp_path, n_countries=3)
+    base_path = str(tmp_path / "base_data")
+    HH_data = read_microdata(base_path)
+    os.remove(os.path.join(base_path, f"results_{countries[0]}.xlsx"))
+
+    with ProcessPoolExecutor(max_workers=2) as pool:
+        parallel = get_batch_countries(HH_data, base_path, pool)
+    assert parallel == get_batch_countries(HH_data, base_path) == countries[1:]
+
+    with pytest.raises(FileNotFoundError):
+        run_batch(max_workers=2, base_path=str(tmp_path / "missing"))
+
+
+def test_benchmark_compare():
+    """
+    Tests whether only stages slower (or larger) than the tolerance and the
+    noise floor are reported as regressions
+    """
+    baseline = {"results": {"small": {"tax_burden_MS": {"seconds": 1.0, "peak_mb": 10.0}}}}
+    results = {
+        "results": {
+            "small": {
+                "tax_burden_MS": {"seconds": 1.5, "peak_mb": 10.5},
+                "new_stage": {"seconds": 9.0, "peak_mb": 9.0},
+            }
+        }
+    }
+
+    regressions = compare(results, baseline, tolerance=0.25)
+
+    assert regressions == [("small", "tax_burden_MS", "seconds", 1.0, 1.5)]
+
+
+def test_instrumentation(HH_data, MS_q, MS_p, concordance, pop_data, tmp_path):
+    """
+    Tests whether traced functions record nested events with the size of their
+    results when enabled, and nothing when disabled
+    """
+    cache_clear()
+    tax_burden_MS("BGR", HH_data, MS_q, MS_p, concordance, pop_data)
+    assert write_trace() is None
+
+    enable(tmp_path / "trace.json")
+    try:
+        cache_clear()
+        with stage("incidence", country="BGR"):
+            tb = tax_burden_MS("BGR", HH_data, MS_q, MS_p, concordance, pop_data)
+        trace = write_trace()
+    finally:
+        disable()
+
+    events = {event["path"]: event for event in trace["events"]}
+
+    assert (tmp_path / "trace.json").exists()
+    assert "incidence/tax_burden_MS/pc_expenditures" in events
+    assert events["incidence/tax_burden_MS"]["country"] == "BGR"
+    assert events["incidence/tax_burden_MS"]["frames"]["result"]["rows"] == len(tb)
+    assert events["incidence"]["wall_s"] >= events["incidence/tax_burden_MS"]["wall_s"]
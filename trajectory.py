@@ -0,0 +1,192 @@
+"""
+Multi-year trajectory mode: incidence and adjustment factors for a path of MINDSET price
+and demand vectors (e.g. one per year of a carbon-price path).
+
+The survey part of the pipeline (shares of the groups in total expenditures per category,
+price and income elasticities) does not depend on the year and is computed once. Each
+year only adds its demand per consumption category (one product of the weighted
+concordance with the (sectors x years) demand matrix) and its price changes per category,
+so all years are evaluated as one batched tensor computation instead of running the
+pipeline once per year.
+
+    result = incidence_trajectory(country, HH_data, MS_q_path, MS_p_path, concordance, pop_data)
+    result["incidence"]                 # one block of deciles per year
+    result["price_adj_factors_GLORIA"]  # GLORIA sectors x years
+"""
+import numpy as np
+import pandas as pd
+from auxiliary import concordance_weights
+from auxiliary import expenditure_allocation
+from auxiliary import get_pop
+from auxiliary import revenue_shares
+from auxiliary import QUANTILES_COLUMN
+from auxiliary import WEIGHT_COLUMN
+from concordance_matrix import as_concordance_matrix
+from household_data import CONS_CATEGORIES
+from household_data import column_values
+from household_data import country_rows
+from instrumentation import traced
+from Price_and_Income_Elas.sector_adj_factors import convert_factors_to_GLORIA
+from Price_and_Income_Elas.sector_adj_factors import GLORIA_conversion_matrix
+from tax_burden_scaled import incidence_kernel
+
+
+def stack_path(path, sector_column, value_column, years=None):
+    """
+    Returns the (sectors x years) matrix of a stacked MINDSET path
+
+    Inputs:
+        - path (df): one row per year and sector, columns "year", sector_column and value_column
+        - sector_column (str): e.g. "PROD_COMM" or "TRAD_COMM"
+        - value_column (str): e.g. "q_hh_base" or "delta_p1"
+        - years (array): OPTIONAL - order of the years (default: sorted years of path)
+    Returns:
+        - sectors (np.array): GLORIA sector codes (rows)
+        - years (np.array): years (columns)
+        - values (np.array): (sectors x years), 0 for sectors missing in a year
+    """
+    table = path.pivot_table(
+        index=sector_column, columns="year", values=value_column, aggfunc="sum"
+    )
+    if years is not None:
+        table = table.reindex(columns=years)
+
+    return (
+        table.index.to_numpy(),
+        table.columns.to_numpy(),
+        table.fillna(0).to_numpy(dtype=float),
+    )
+
+
+@traced
+def incidence_trajectory(
+    country,
+    HH_data,
+    MS_q_path,
+    MS_p_path,
+    concordance,
+    pop_data,
+    MS_rev_inc=None,
+    decile_target=10,
+):
+    """
+    Calculates incidence per decile (as tax_burden_MS()) and price and income adjustment
+    factors per consumption category and GLORIA sector (as the functions of
+    sector_adj_factors.py) for every year of a MINDSET price and demand path at once
+
+    Inputs:
+        - country (str): 3-digit iso code
+        - HH_data (df or HouseholdData): Microdata
+        - MS_q_path (df): MINDSET final household demand per year: columns "year",
+                    "PROD_COMM" and "q_hh_base"
+        - MS_p_path (df): MINDSET price changes per year: columns "year", "TRAD_COMM" and
+                    one price column starting with "delta_p"
+        - concordance (df): concordance table between GLORIA and expenditure categories
+        - pop_data (df): Population data (2019 population, as in calc_pc_exp_dg())
+        - MS_rev_inc (float or array): OPTIONAL - revenue recycled via income tax cuts
+                    (in 1000 $), one value or one per year. Income adjustment factors
+                    are only returned if given
+        - decile_target (int): OPTIONAL - decile under and including which the revenue is
+                    distributed (default: 10)
+    Returns:
+        - (dict) of DataFrames:
+            - "incidence": iso3, year, quant_cons, cons_pc_MS and the incidence columns of
+                    tax_burden_MS(), one block of deciles per year
+            - "price_adj_factors" / "income_adj_factors": consumption categories x years
+            - "price_adj_factors_GLORIA" / "income_adj_factors_GLORIA": GLORIA sectors x years
+    """
+    operator = as_concordance_matrix(concordance)
+
+    # 1. Paths aligned with the concordance (sectors x years)
+    q_sectors, years, q = stack_path(MS_q_path, "PROD_COMM", "q_hh_base")
+    # categories without any sector in the demand path are missing (as in tax_burden_MS())
+    present = pd.Index(operator.categories[operator.present_categories(q_sectors)])
+    missing = [cons for cons in CONS_CATEGORIES if cons not in present]
+    if missing:
+        raise KeyError(f"consumption categories without MINDSET demand: {missing}")
+    positions = pd.Index(operator.categories).get_indexer(CONS_CATEGORIES)
+    price_column = [col for col in MS_p_path.columns if col.startswith("delta_p")][0]
+    p_sectors, _, p = stack_path(MS_p_path, "TRAD_COMM", price_column, years)
+    q = operator.align(q_sectors, q)
+    p = operator.align(p_sectors, p)
+
+    # demand per category and year in 2019 US$ and demand weighted price changes
+    # (categories x years)
+    demand = (concordance_weights(country, HH_data, concordance).T @ q)[positions] * 1000
+    delta_p = operator.category_prices(q, p)[positions]
+
+    # 2. Survey part: computed once for all years (groups x categories)
+    HH_df = country_rows(HH_data, country)
+    _, sharetotal, pc_factor = expenditure_allocation(
+        HH_df, CONS_CATEGORIES, get_pop(country, pop_data)
+    )
+    ela = column_values(
+        HH_df, [f"{cons}_elasticity_price" for cons in CONS_CATEGORIES], float
+    )
+
+    # 3. Incidence with the kernel of tax_burden_MS(), one call per year (groups x years)
+    cons_pc = (sharetotal * pc_factor[:, None])[:, :, None] * demand[None, :, :]
+    # nansum: a missing share only drops its category (as in tax_burden_MS())
+    cons_pc_MS = np.nansum(cons_pc, axis=1)
+    per_year = [
+        incidence_kernel(cons_pc[:, :, y], ela, delta_p[:, [y]], cons_pc_MS[:, y])
+        for y in range(len(years))
+    ]
+    results = {
+        "cons_pc_MS": cons_pc_MS,
+        **{
+            name: np.concatenate([year[name] for year in per_year], axis=1)
+            for name in per_year[0]
+        },
+    }
+
+    n_groups = len(cons_pc)
+    incidence = pd.DataFrame(
+        {
+            "iso3": country,
+            "year": np.repeat(years, n_groups),
+            "quant_cons": np.tile(column_values(HH_df, "quant_cons"), len(years)),
+        }
+    )
+    for col in (WEIGHT_COLUMN, QUANTILES_COLUMN):
+        if col in HH_df.columns:
+            incidence[col] = np.tile(column_values(HH_df, col), len(years))
+    for name, values in results.items():
+        incidence[name] = values.T.ravel()
+
+    # 4. Adjustment factors per category and year (categories x years)
+    # price adjustment factors of demand with elasticities (groups x categories x years)
+    factor = (delta_p[None, :, :] + 1) ** ela[:, :, None]
+    adj_factors = {
+        "price_adj_factors": np.nansum(sharetotal[:, :, None] * factor, axis=0)
+    }
+
+    if MS_rev_inc is not None:
+        revenue = np.broadcast_to(np.asarray(MS_rev_inc, dtype=float), years.shape)
+        # transfer per targeted decile and year (groups x years)
+        revenue_decile = (
+            revenue_shares(HH_df, decile_target)[:, None] * revenue[None, :] * 1000
+        )
+        total_exp_d = np.nansum(sharetotal[:, :, None] * demand[None, :, :], axis=1)
+        ela_income = column_values(
+            HH_df, [f"{cons}_elasticity_income" for cons in CONS_CATEGORIES], float
+        )
+        income_effect = (1 + revenue_decile / total_exp_d)[:, None, :] ** ela_income[
+            :, :, None
+        ]
+        adj_factors["income_adj_factors"] = np.nansum(
+            sharetotal[:, :, None] * income_effect, axis=0
+        )
+
+    result = {"incidence": incidence}
+    conversion = GLORIA_conversion_matrix(country, HH_data, concordance)
+    for name, values in adj_factors.items():
+        result[name] = pd.DataFrame(
+            values,
+            index=pd.Index(CONS_CATEGORIES, name="CPAT Variable"),
+            columns=pd.Index(years, name="year"),
+        )
+        # all years converted at once: (sectors x categories) @ (categories x years)
+        result[f"{name}_GLORIA"] = convert_factors_to_GLORIA(conversion, result[name])
+
+    return result
@@ -2,12 +2,29 @@ import os
 
 import numpy as np
 import pandas as pd
+from auxiliary import aggregate_deciles
 from auxiliary import get_pop
+from auxiliary import population_shares
+from auxiliary import targeted_population_shares
+from household_data import column_values
+from household_data import country_rows
+from instrumentation import traced
 from tax_burden_scaled import tax_burden_MS
 
+# GLORIA sectors of government spending / public investment and their weights per
+# infrastructure category
+INFR_SECTORS = {
+    "wtr": {95: 0.6},
+    "sani": {95: 0.4, 96: 0.2},
+    "ely": {93: 1.0},
+    "ICT": {110: 1.0, 111: 1.0},
+    "transp_pub": {101: 1.0, 102: 1.0, 104: 1.0, 106: 1.0},
+}
+
 #### Direct transfers
 
 
+@traced
 def targeted_transfer(
     country, HH_data, MS_q, MS_p, MS_rev_inc, concordance,pop_data, decile_target
 ):
@@ -15,6 +32,7 @@ def targeted_transfer(
     Calculates tax burden after revenue recycling via direct targeted per capita transfers
     Absolute tax burden after revenue recycling is calculated as pre-revenue recycling tax burden
     calculated by tax_burden_MS() minus the received per capita transfer.
+    Groups finer than deciles (percentiles, household records) are targeted by their decile.
 
 
     Inputs:
@@ -44,29 +62,108 @@ def targeted_transfer(
     # GLORIA population
     population = get_pop(country, pop_data)
 
-    ## per capita transfer for deciles
-    targeted_population = population * decile_target / 10
+    # targeted groups and population share of the targeted deciles
+    targeted, share = targeted_population_shares(tb, decile_target)
+
+    ## per capita transfer for deciles: population of the targeted deciles
+    targeted_population = population * share
     # avg. transfer for targeted deciles capita decile (in 2019 $)
     pc_transfer = MS_rev_inc * 1000 / targeted_population
 
     tb["abs_inc_RR"] = np.where(
-        tb["quant_cons"] <= decile_target,
+        targeted,
         tb["abs_inc_MS"] - pc_transfer,
         tb["abs_inc_MS"],
     )
     tb["rel_inc_RR"] = tb["abs_inc_RR"] / tb["cons_pc_MS"]
     # with price reactions
     tb["abs_inc_ela_RR"] = np.where(
-        tb["quant_cons"] <= decile_target,
+        targeted,
         tb["abs_inc_ela_MS"] - pc_transfer,
         tb["abs_inc_ela_MS"],
     )
     tb["rel_inc_ela_RR"] = tb["abs_inc_ela_RR"] / tb["cons_pc_MS"]
-    tb["pc_transfer"] = np.where(tb["quant_cons"] <= decile_target, pc_transfer, 0)
+    tb["pc_transfer"] = np.where(targeted, pc_transfer, 0)
+
+    return tb
+
+
+@traced
+def targeted_transfer_sweep(
+    country,
+    HH_data,
+    MS_q,
+    MS_p,
+    MS_rev_inc,
+    concordance,
+    pop_data,
+    decile_targets=range(1, 11),
+):
+    """
+    Calculates tax burden after revenue recycling via direct targeted per capita transfers
+    for several decile targets and revenue amounts at once. The pre-recycling tax burden is
+    calculated once by tax_burden_MS() and the transfers of all (target x revenue) combinations
+    are subtracted in a single broadcast.
+
+    Inputs:
+        - country (str): 3-digit iso code
+        - HH_data (df): Microdata
+        - MS_q(df): MINDSET final household demand vector of country of interest:
+                    Has to include columns "PROD_COMM" and "q_hh_base"
+        - Ms_p(df): MINDSET sectoral price changes in country of interest:
+                    Has to include columns "TRAD_COMM" and "delta_p"
+        - MS_rev_inc(float or array) : total tax revenue(s) to be recycled via direct transfers
+        - concordance (df): concordance table between GLORIA and expenditure categories
+        - pop_data (df): Population data
+        - decile_targets (list): OPTIONAL-targeted deciles to evaluate (default = 1 to 10)
+
+    Output;
+
+        - tb (df): tidy Dataframe with one row per decile target, revenue and decile: columns
+                    "decile_target", "MS_rev_inc", the columns of tax_burden_MS() and the
+                    incidence after revenue recycling as in targeted_transfer()
+    """
+
+    tb = tax_burden_MS(
+        country=country, HH_data=HH_data, MS_q=MS_q, MS_p=MS_p, concordance=concordance , pop_data=pop_data
+    )
+
+    # GLORIA population
+    population = get_pop(country, pop_data)
+
+    targets = np.asarray(list(decile_targets))
+    revenues = np.atleast_1d(np.asarray(MS_rev_inc, dtype=float))
+    n_targets, n_revenues, n_rows = len(targets), len(revenues), len(tb)
+
+    # targeted groups per target (targets x groups) and population shares of the
+    # targeted deciles
+    targeted, share = targeted_population_shares(tb, targets)
+
+    ## per capita transfer for targeted deciles (targets x revenues)
+    targeted_population = population * share[:, None]
+    pc_transfer = revenues[None, :] * 1000 / targeted_population
+    # transfer per group (targets x revenues x groups)
+    transfer = targeted[:, None, :] * pc_transfer[:, :, None]
+
+    cons_pc_MS = tb["cons_pc_MS"].to_numpy()
+    abs_inc_RR = tb["abs_inc_MS"].to_numpy() - transfer
+    abs_inc_ela_RR = tb["abs_inc_ela_MS"].to_numpy() - transfer
+
+    # tidy format: one block of deciles per (target, revenue)
+    tb = tb.iloc[np.tile(np.arange(n_rows), n_targets * n_revenues)].reset_index(drop=True)
+    tb.insert(0, "decile_target", np.repeat(targets, n_revenues * n_rows))
+    tb.insert(1, "MS_rev_inc", np.tile(np.repeat(revenues, n_rows), n_targets))
+
+    tb["abs_inc_RR"] = abs_inc_RR.ravel()
+    tb["rel_inc_RR"] = (abs_inc_RR / cons_pc_MS).ravel()
+    tb["abs_inc_ela_RR"] = abs_inc_ela_RR.ravel()
+    tb["rel_inc_ela_RR"] = (abs_inc_ela_RR / cons_pc_MS).ravel()
+    tb["pc_transfer"] = transfer.ravel()
 
     return tb
 
 
+@traced
 def public_investment(country, HH_data, MS_rev_govt, shares, countrynames, public_inv , pop_data):
     """
 
@@ -77,8 +174,9 @@ def public_investment(country, HH_data, MS_rev_govt, shares, countrynames, publi
 
     Inputs:
         - country(str): 3 digit iso code of country
-        - HH_data (df): Microdata
-        - MS_rev_govt (float) : total tax revenue to be recycled into government spending
+        - HH_data (df or HouseholdData): Microdata
+        - MS_rev_govt (float or array) : total tax revenue to be recycled into government spending.
+                    If an array of spending levels is given, all levels are evaluated at once
         - shares(df): Dataframe with shares of revenue recycled into government spending
                     per GLORIA sector. From Templates_tax_BTA_{country}_GLORIA.xlsx,
                     sheet "govt_spending"
@@ -88,60 +186,91 @@ def public_investment(country, HH_data, MS_rev_govt, shares, countrynames, publi
         - pop_data(df): Population data
 
     Returns:
-        - HH_data_country(df):  Dataframe with per proxied per capita transfers when investing in public infrastructure
+        - public_transfers(df):  Dataframe with per proxied per capita transfers when investing in public infrastructure
+                    (with several spending levels: column "MS_rev_govt" and one block of deciles per level)
 
     """
-    HH_data_country = HH_data.loc[(HH_data["iso3"] == country)]
+    HH_data_country = country_rows(HH_data, country)
 
     # Load shares of government spending per infrastructure category
     share_dict = get_publ_inv_shares(country, shares)
     # Load other investment into infrastructure categories and mulitply by 1000 (in 2019 1000$)
     total_dict = get_other_investment(country, countrynames, public_inv)
-    # Read MINDSET tax revenues
-
-    spending = MS_rev_govt * 1000
+    # Read MINDSET tax revenues: one or several spending levels (levels x 1)
+    spending = np.atleast_1d(np.asarray(MS_rev_govt, dtype=float))[:, None] * 1000
 
     # Get population data
     population = get_pop(country,pop_data)
 
     # List of infrastructure categories
     infr_list = list(share_dict.keys())
+    share = np.array([share_dict[i] for i in infr_list])
+    other = np.array([total_dict[i] for i in infr_list])
 
-    # Calculate population without access for each infrastructure category
-    for i in infr_list:
-        HH_data_country[f"pop_no_acs_{i}"] = (
-            (1 - HH_data_country[f"{i}_acs_share"] / 100) * population / 10
-        )
+    # share of decile population without access (deciles x infrastructure categories)
+    no_access = (
+        1 - column_values(HH_data_country, [f"{i}_acs_share" for i in infr_list], float) / 100
+    )
+    # total population without access per infrastructure category: groups weighted
+    # with their population share (tenth of population for deciles)
+    # (nansum: a missing access share only drops its group from the category, as the
+    # pandas sum of the original implementation)
+    shares = population_shares(HH_data_country)
+    pop_no_access = np.nansum(shares[:, None] * no_access, axis=0) * population
+    # per capita transfer for each infrastructure category : share of gov i * spending i / targeted population - pop with no access to category i
+    # (levels x infrastructure categories)
+    per_cap_transfer = (share * spending + other) / pop_no_access
+    # transfers per decile (levels x deciles x infrastructure categories)
+    transfers = no_access[None, :, :] * per_cap_transfer[:, None, :]
+
+    n_levels, n_deciles = transfers.shape[:2]
+
+    public_transfers = pd.DataFrame(
+        transfers.reshape(n_levels * n_deciles, len(infr_list)),
+        columns=[f"per_cap_transfer_{i}" for i in infr_list],
+        index=np.tile(HH_data_country.index, n_levels),
+    )
+    public_transfers.insert(
+        0, "quant_cons", np.tile(column_values(HH_data_country, "quant_cons"), n_levels)
+    )
+    # sum transfers for different categories
+    public_transfers["total_publ_infr_transfer"] = np.nansum(transfers, axis=2).ravel()
 
-    # Save total population without access for each infrastructure category as dictionary
-    pop_no_access_i = {i: HH_data_country[f"pop_no_acs_{i}"].sum() for i in infr_list}
-    # Calculate per capita transfer for each infrastructure category : share of gov i * spending i / targeted population - pop with no access to category i
-    per_cap_transfer_i = {
-        key: ((share_dict[key] * spending )+ total_dict[key]) / pop_no_access_i[key]
-        for key in infr_list
-    }
-
-    for i in infr_list:
-        HH_data_country[f"per_cap_transfer_{i}"] = HH_data_country.apply(
-            lambda row: (1 - row[f"{i}_acs_share"] / 100) * per_cap_transfer_i[i],
-            axis=1,
+    # several spending levels: one block of deciles per level
+    if np.ndim(MS_rev_govt) > 0:
+        public_transfers.insert(
+            0, "MS_rev_govt", np.repeat(spending[:, 0] / 1000, n_deciles)
         )
+        public_transfers.reset_index(drop=True, inplace=True)
 
-    # sum transfers for different categories
-    HH_data_country["total_publ_infr_transfer"] = HH_data_country.filter(
-        like="per_cap_transfer_"
-    ).sum(axis=1)
-    # drop intermediate columns
-    per_cap_cols = [
-        col for col in HH_data_country.columns if col.startswith("per_cap_transfer")
-    ] + ["total_publ_infr_transfer", "quant_cons"]
-
-    HH_data_country.drop(
-        columns=[col for col in HH_data_country.columns if col not in per_cap_cols],
-        inplace=True,
-    )
+    return public_transfers
+
+
+def infrastructure_weights():
+    """
+    Returns the weights of GLORIA sectors in each infrastructure category (see INFR_SECTORS)
 
-    return HH_data_country
+    Returns:
+        - weights(df): infrastructure categories (index) x GLORIA sectors (columns)
+    """
+    weights = pd.DataFrame(INFR_SECTORS).T.fillna(0)
+    return weights[sorted(weights.columns)]
+
+
+def infrastructure_sums(values):
+    """
+    Weighted sums of sector values per infrastructure category (see INFR_SECTORS). Only
+    the sectors of a category enter its sum, so a missing value (NaN) of a sector only
+    affects the categories containing that sector
+
+    Inputs:
+        - values (array): values per GLORIA sector, ordered as the columns of
+                    infrastructure_weights()
+    Returns:
+        - sums (np.array): one value per infrastructure category
+    """
+    weights = infrastructure_weights().to_numpy()
+    return np.where(weights != 0, weights * np.asarray(values, dtype=float), 0).sum(axis=1)
 
 
 def get_publ_inv_shares(country, shares):
@@ -165,19 +294,13 @@ def get_publ_inv_shares(country, shares):
         -pi_share_dict(dict): Dictionary with shares of revenue recycled [value] per consumption category i [key]
 
     """
+    # government spending shares of the country indexed by GLORIA sector
     shares = shares.loc[shares["REG"] == country]
-    pi_share_dict = {
-        "wtr": 0.6 * shares.loc[shares["PROD_COMM"] == 95, "govt_spend"].values[0],
-        "sani": 0.4 * shares.loc[shares["PROD_COMM"] == 95, "govt_spend"].values[0]
-        + 0.2 * shares.loc[shares["PROD_COMM"] == 96, "govt_spend"].values[0],
-        "ely": shares.loc[shares["PROD_COMM"] == 93, "govt_spend"].values[0],
-        "ICT": shares.loc[shares["PROD_COMM"] == 110, "govt_spend"].values[0]
-        + shares.loc[shares["PROD_COMM"] == 111, "govt_spend"].values[0],
-        "transp_pub": shares.loc[shares["PROD_COMM"] == 101, "govt_spend"].values[0]
-        + shares.loc[shares["PROD_COMM"] == 102, "govt_spend"].values[0]
-        + shares.loc[shares["PROD_COMM"] == 104, "govt_spend"].values[0]
-        + shares.loc[shares["PROD_COMM"] == 106, "govt_spend"].values[0],
-    }
+    govt_spend = shares.drop_duplicates("PROD_COMM").set_index("PROD_COMM")["govt_spend"]
+
+    weights = infrastructure_weights()
+    pi_share = infrastructure_sums(govt_spend.loc[weights.columns].to_numpy())
+    pi_share_dict = dict(zip(weights.index, pi_share))
     return pi_share_dict
 
 
@@ -206,31 +329,34 @@ def get_other_investment(country, countrynames, public_inv):
     ].values[0]
 
     # rename index column from unnamed:0 to countryname
-    public_inv.rename(columns={"Unnamed: 0": "Region_names"}, inplace=True)
+    public_inv = public_inv.rename(columns={"Unnamed: 0": "Region_names"})
 
     # use column where countryname is in the row
     public_inv = public_inv.loc[public_inv["Region_names"] == countryname]
 
-    pi_other_dict = {
-        "wtr": 1000 * 0.6 * public_inv["95"].values[0],
-        "sani": 1000* (0.4 * public_inv["95"].values[0] +  0.2 * public_inv["96"].values[0]),
-        "ely": 1000* public_inv["93"].values[0],
-        "ICT": 1000*(public_inv["110"].values[0] + public_inv["111"].values[0]),
-        "transp_pub": 1000*public_inv["101"].values[0]
-        + 1000*public_inv["102"].values[0]
-        + 1000*public_inv["104"].values[0]
-        + 1000*public_inv["106"].values[0],
-    }
+    weights = infrastructure_weights()
+    investment = public_inv[[str(sector) for sector in weights.columns]].to_numpy()[0]
+    pi_other_dict = dict(zip(weights.index, 1000 * infrastructure_sums(investment)))
 
     return pi_other_dict
 
 
+@traced
 def save_results_target(
-    country, HH_data, MS_q, MS_p, MS_rev_inc, concordance, pop_data, decile_target=10
+    country,
+    HH_data,
+    MS_q,
+    MS_p,
+    MS_rev_inc,
+    concordance,
+    pop_data,
+    decile_target=10,
+    folder_path=None,
 ):
     """
     Saves sector shares , price changes by consumption categories and absolute and relative incidence
-    by decile as csv to be used for further analysis or plots.
+    by decile as csv to be used for further analysis or plots. Results of finer groups
+    are aggregated to deciles.
 
     Parameters:
         - country (str): 3-digit iso code
@@ -245,18 +371,23 @@ def save_results_target(
         - concordance (df): concordance table between GLORIA and expenditure categories
         - pop_data (df): population data
         - decile_target (int): OPTIONAL-targeted deciles for per capita transfers (default = 10 )
+        - folder_path (str): OPTIONAL - output folder (default: {country}_household_results
+                    in the current working directory)
 
 
     """
     # Create the subfolder path in current working directory
-    folder_path = os.path.join(os.getcwd(), f"{country}_household_results")
+    if folder_path is None:
+        folder_path = os.path.join(os.getcwd(), f"{country}_household_results")
 
     # Create the subfolder if it doesn't exist
     if not os.path.exists(folder_path):
         os.makedirs(folder_path)
 
-    pct = targeted_transfer(
-        country, HH_data, MS_q, MS_p, MS_rev_inc, concordance, pop_data, decile_target
+    pct = aggregate_deciles(
+        targeted_transfer(
+            country, HH_data, MS_q, MS_p, MS_rev_inc, concordance, pop_data, decile_target
+        )
     )
 
     targeted_transfer_path = os.path.join(folder_path, "transfers.xlsx")
@@ -264,8 +395,16 @@ def save_results_target(
     print(f"Saved DataFrame 'transfers' as XLSX: {targeted_transfer_path}")
 
 
+@traced
 def save_results_public(
-    country, HH_data, MS_rev_govt, shares, countrynames, public_inv , pop_data
+    country,
+    HH_data,
+    MS_rev_govt,
+    shares,
+    countrynames,
+    public_inv,
+    pop_data,
+    folder_path=None,
 ):
     """
     Function to save results of public investment in infrastructure access spending
@@ -282,12 +421,15 @@ def save_results_public(
                             From "REGIONS" sheet of GTAPtoGLORIA.xlsx.
         - public_inv(df): Dataframe containing public investment per country /sector
         - pop_data(df) : Dataframe containing population per country
+        - folder_path (str): OPTIONAL - output folder (default: {country}_household_results
+                    in the current working directory)
 
     Saves per proxied per capita transfers when investing in public infrastructure as xlsx to be used for further analysis or plots.
 
     """
     # Create the subfolder path in current working directory
-    folder_path = os.path.join(os.getcwd(), f"{country}_household_results")
+    if folder_path is None:
+        folder_path = os.path.join(os.getcwd(), f"{country}_household_results")
 
     # Create the subfolder if it doesn't exist
     if not os.path.exists(folder_path):
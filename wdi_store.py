@@ -0,0 +1,156 @@
+"""
+Indexed store of World Development Indicators (population, exchange rates, GDP deflator).
+
+The WDI csv files (one row per country, one column per year) are converted once into a
+dense (indicator x country x year) array. Single values are O(1) lookups of positions
+in dictionaries, many values at once are one fancy indexing operation.
+
+Stores are built once per table content and reused afterwards, so get_pop() in a
+multi-country run only costs hashing the table and a dictionary lookup.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+from data_cache import read_csv_cached
+from memo import fingerprint
+
+# WDI files in base_data per indicator
+WDI_FILES = {
+    "pop": os.path.join("population", "API_SP.POP.TOTL_DS2_en_csv_v2_5454896.csv"),
+    "er": os.path.join("exchange_rates", "API_PA.NUS.FCRF_DS2_en_csv_v2_5457514.csv"),
+    "gdp_defl": os.path.join(
+        "gdp_deflator", "API_NY.GDP.DEFL.ZS_DS2_en_csv_v2_5455800.csv"
+    ),
+}
+
+# stores built from WDI tables, by content of the tables
+_STORES = {}
+
+
+class WDIStore:
+    """
+    Dense array of World Development Indicators
+
+    Attributes:
+        - indicators (list): names of the indicators, e.g. "pop"
+        - countries (np.array): sorted 3-digit iso codes
+        - years (np.array): sorted years
+        - values (np.array): (indicators x countries x years) values, NaN if missing
+    """
+
+    def __init__(self, tables):
+        """
+        Inputs:
+            - tables (dict): WDI tables (columns "Country Code" and one column per year)
+                        per indicator name
+        """
+        self.indicators = list(tables)
+        self.countries = np.array(
+            sorted(set().union(*(table["Country Code"] for table in tables.values())))
+        )
+        self.years = np.array(
+            sorted(
+                {
+                    int(col)
+                    for table in tables.values()
+                    for col in table.columns
+                    if str(col).isdigit()
+                }
+            )
+        )
+
+        self._indicator_pos = {name: i for i, name in enumerate(self.indicators)}
+        self._country_pos = {country: i for i, country in enumerate(self.countries)}
+        self._year_pos = {year: i for i, year in enumerate(self.years)}
+
+        self.values = np.full(
+            (len(self.indicators), len(self.countries), len(self.years)), np.nan
+        )
+        for i, table in enumerate(tables.values()):
+            year_columns = [col for col in table.columns if str(col).isdigit()]
+            rows = [self._country_pos[country] for country in table["Country Code"]]
+            cols = [self._year_pos[int(col)] for col in year_columns]
+            self.values[i][np.ix_(rows, cols)] = table[year_columns].to_numpy(
+                dtype=float
+            )
+
+    def get(self, indicator, country, year):
+        """
+        Returns the value of an indicator for one country and year
+
+        Inputs:
+            - indicator (str): e.g. "pop"
+            - country (str): 3-digit iso code
+            - year (int)
+        Returns:
+            - (np.float64): value, NaN if missing in the WDI table
+        """
+        return self.values[
+            self._indicator_pos[indicator],
+            self._country_pos[country],
+            self._year_pos[int(year)],
+        ]
+
+    def lookup(self, indicator, countries, years):
+        """
+        Returns the values of an indicator for pairs of countries and years
+
+        Inputs:
+            - indicator (str): e.g. "er"
+            - countries (array): 3-digit iso codes
+            - years (array or int): years, one per country or the same for all
+        Returns:
+            - (np.array): values, NaN for countries or years not in the store
+        """
+        countries = np.asarray(countries)
+        years = np.broadcast_to(np.asarray(years, dtype=int), countries.shape)
+
+        country_pos = pd.Index(self.countries).get_indexer(countries)
+        year_pos = pd.Index(self.years).get_indexer(years)
+        found = (country_pos >= 0) & (year_pos >= 0)
+
+        values = np.full(countries.shape, np.nan)
+        values[found] = self.values[
+            self._indicator_pos[indicator], country_pos[found], year_pos[found]
+        ]
+        return values
+
+
+def as_wdi_store(tables):
+    """
+    Returns the WDIStore of WDI tables. Stores are built once per set of tables and
+    reused afterwards.
+
+    Inputs:
+        - tables (df, dict or WDIStore): WDI population table (e.g. pop_data) or
+                    dictionary of WDI tables per indicator name
+    Returns:
+        - (WDIStore)
+    """
+    if isinstance(tables, WDIStore):
+        return tables
+    if isinstance(tables, pd.DataFrame):
+        tables = {"pop": tables}
+
+    key = tuple((name, fingerprint(table)) for name, table in tables.items())
+    if key not in _STORES:
+        _STORES[key] = WDIStore(tables)
+    return _STORES[key]
+
+
+def load_wdi(base_path="./base_data"):
+    """
+    Loads population, exchange rates and GDP deflator into one WDIStore
+
+    Inputs:
+        - base_path (str): OPTIONAL - folder containing the input data
+    Returns:
+        - (WDIStore)
+    """
+    return as_wdi_store(
+        {
+            name: read_csv_cached(os.path.join(base_path, path), skiprows=4)
+            for name, path in WDI_FILES.items()
+        }
+    )